@@ -1,29 +1,106 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import Orbit_Code as OC
-import matplotlib.animation as animation
-from matplotlib.colors import LogNorm
 from timeit import default_timer
-reload(OC)
-  
-print("Load stuff for plotting...")
-start = default_timer()
 
 dpi = 300
 
-theta = "30"
-Lz = np.load('/Users/LBarbano/Desktop/QP_Data/Lz_data_(theta='+theta+').npy')
-Lz = Lz[:,0:1000]
-Lz0 = Lz[:,0][:, np.newaxis]
-del_Lz = Lz-Lz0
-Lz0 = Lz[:,0]
-duration = default_timer() - start
-print "time: %s s" % str(duration) 
+theta = "30" #theta animated when none is given
+LzPath = '/Users/LBarbano/Desktop/QP_Data/Lz_data_(theta=%s).npy' #Lz data of each theta
 
 RC = 1 #Retarding constant for animation
+workers = None #Processes rendering the movies (None uses every core, 1 saves them in this process with anim.save)
+moviePath = '/Users/LBarbano/Desktop/QP_Data/Animate_Lz_%s(theta=%s).mp4' #movie of each kind and theta
 
-#This function animates a surface density histogram of Lz0 versus delta Lz
-def animate_Lz_hist():
+#The Lz data of a theta is only loaded when it is first animated, and is then
+#kept in LzCache (matplotlib is also only imported by the animation functions)
+#The histograms of its frames are binned the first time as well and kept in cubeCache
+LzCache = {}
+cubeCache = {}
+
+#Returns Lz, Lz0 and del_Lz of a theta (e.g. "30"), loading the Lz data the first time only
+def getLz(theta=theta):
+    if theta not in LzCache:
+        print("Load stuff for plotting...")
+        start = default_timer()
+        Lz = np.load(LzPath % theta)
+        Lz = Lz[:,0:1000]
+        Lz0 = Lz[:,0][:, np.newaxis]
+        del_Lz = Lz-Lz0
+        Lz0 = Lz[:,0]
+        LzCache[theta] = (Lz, Lz0, del_Lz)
+        duration = default_timer() - start
+        print "time: %s s" % str(duration) 
+    return LzCache[theta]
+
+#Returns the histograms of Lz0 versus delta Lz of every frame of a movie (see
+#Histogram_Cube), binning all frames in one pass the first time
+#kind = "hist" (frames every RC steps) or "scat" (every 2*RC steps, with the bin
+#each star is colored by)
+def getCube(kind,theta=theta):
+    if (kind,theta) not in cubeCache:
+        import Histogram_Cube
+        Lz, Lz0, del_Lz = getLz(theta)
+        print("Bin stuff for plotting...")
+        start = default_timer()
+        if kind == "hist":
+            cube = Histogram_Cube.makeCube(Lz[:,0], del_Lz, range=[[400,3500], [-1000,1000]], bins=(100, 80), frames=np.arange(0,len(Lz.transpose()),RC), indices=False)
+        else:
+            cube = Histogram_Cube.makeCube(Lz0, del_Lz, range=[[700,3500], [-1000,1000]], bins=(100,80), frames=np.arange(0,len(Lz.transpose()),2*RC))
+        cubeCache[(kind,theta)] = cube
+        duration = default_timer() - start
+        print "time: %s s" % str(duration) 
+    return cubeCache[(kind,theta)]
+
+#Returns the parameters the movies are drawn with, to pass on to the worker
+#processes of Movie_Renderer (which start with the defaults of this file)
+def getParams():
+    return {"RC": RC, "LzPath": LzPath}
+
+#Sets the parameters returned by getParams, emptying the caches if they change
+def setParams(params):
+    global RC
+    global LzPath
+    if params != getParams():
+        RC = params["RC"]
+        LzPath = params["LzPath"]
+        LzCache.clear()
+        cubeCache.clear()
+
+#Saves the movie of an animation made by make (makeHist or makeScat) with frames
+#frames, in this process or on worker processes (see Movie_Renderer, which
+#gives the same movie)
+def saveMovie(make,kind,fig,anim,frames,theta=theta):
+    import matplotlib.animation as animation
+    writer = animation.writers['ffmpeg'](fps=30)
+    start = default_timer()
+    print("Creating %s movie..." % kind)
+    if workers == 1:
+        anim.save(moviePath % (kind,theta),writer=writer,dpi=dpi)
+    else:
+        import Movie_Renderer
+        Movie_Renderer.renderMovie(make,(theta,getParams()),fig,moviePath % (kind,theta),range(frames),writer=writer,dpi=dpi,workers=workers)
+    duration = default_timer() - start
+    print "time: %s s" % str(duration) 
+
+#Checks on the first frames of a movie (kind = "hist" or "scat") that rendering it
+#on worker processes gives the same decoded frames as anim.save (see
+#Movie_Renderer.checkMovie, the two clips are saved next to the movie)
+def checkMovie(kind="hist",theta=theta,frames=60):
+    import matplotlib.animation as animation
+    import Movie_Renderer
+    make = makeHist if kind == "hist" else makeScat
+    writer = animation.writers['ffmpeg'](fps=30)
+    return Movie_Renderer.checkMovie(make,(theta,getParams()),moviePath % (kind+"_check",theta),range(frames),writer=writer,dpi=dpi,workers=workers)
+
+#Makes the figure and animation of the histogram movie of a theta, over the given
+#frames (all of them if None), with the parameters of getParams if given
+def makeHist(theta=theta,params=None,frames=None):
+    import matplotlib.pyplot as plt
+    import matplotlib.animation as animation
+    from matplotlib.colors import LogNorm
+    if params is not None:
+        setParams(params)
+    Lz, Lz0, del_Lz = getLz(theta)
+    getCube("hist",theta)
     
     plt.close('all')    
     fig = plt.figure() #create figure
@@ -43,23 +120,34 @@ def animate_Lz_hist():
     H,xedges,yedges = np.histogram2d(Lz[:,0], del_Lz[:,500], range=[[400,3500], [-1000,1000]],bins=(100, 80)) 
     im = ax.imshow(H.T,origin='low',extent=[700,3000,-1000,1000],interpolation='nearest',aspect='auto',cmap=my_cmap,norm=LogNorm(),vmin=1.)
     plt.colorbar(im)
-    anim = animation.FuncAnimation(fig, update_hist, frames= len(Lz.transpose())/RC, interval= 1.0, 
-    fargs=(fig,ax,im))
+    if frames is None:
+        frames = len(Lz.transpose())/RC
+    anim = animation.FuncAnimation(fig, update_hist, frames= frames, interval= 1.0, 
+    fargs=(fig,ax,im,theta))
+    return fig, anim
+
+#This function animates a surface density histogram of Lz0 versus delta Lz
+def animate_Lz_hist(theta=theta):
+    import matplotlib.pyplot as plt
+    Lz, Lz0, del_Lz = getLz(theta)
+    fig, anim = makeHist(theta)
     plt.show()
     
-    writer = animation.writers['ffmpeg'](fps=30)
-    start = default_timer()
-    print("Creating hist movie...")
-    anim.save('/Users/LBarbano/Desktop/QP_Data/Animate_Lz_hist(theta='+theta+').mp4',writer=writer,dpi=dpi)
-    duration = default_timer() - start
-    print "time: %s s" % str(duration) 
+    saveMovie(makeHist,"hist",fig,anim,len(Lz.transpose())/RC,theta)
     return anim
-       
-#This function animates a scatter plot of Lz0 versus delta Lz and colors the data points
-#according to the surface density histogram of Lz0 versus delta Lz         
-def animate_Lz_scat():
+
+#Makes the figure and animation of the scatter movie of a theta, over the given
+#frames (all of them if None), with the parameters of getParams if given
+def makeScat(theta=theta,params=None,frames=None):
+    import matplotlib.pyplot as plt
+    import matplotlib.animation as animation
+    from matplotlib.colors import LogNorm
+    if params is not None:
+        setParams(params)
+    Lz, Lz0, del_Lz = getLz(theta)
     x = Lz0
     y = del_Lz[:,500]
+    getCube("scat",theta)
     
     #Figure stuff
     plt.close('all')    
@@ -87,32 +175,34 @@ def animate_Lz_scat():
     plt.axis([700,3000,-1000,1000])
     
     #Animation stuff
-    anim = animation.FuncAnimation(fig, update_scat, frames= len(Lz.transpose())/(2*RC), interval= 1, 
-    fargs=(fig,ax,scat))
-    writer = animation.writers['ffmpeg'](fps=30)
-    start = default_timer()
-    print("Creating scat movie...")
-    anim.save('/Users/LBarbano/Desktop/QP_Data/Animate_Lz_scat(theta='+theta+').mp4',writer=writer,dpi=dpi)
-    duration = default_timer() - start
-    print "time: %s s" % str(duration) 
+    if frames is None:
+        frames = len(Lz.transpose())/(2*RC)
+    anim = animation.FuncAnimation(fig, update_scat, frames= frames, interval= 1, 
+    fargs=(fig,ax,scat,theta))
+    return fig, anim
+       
+#This function animates a scatter plot of Lz0 versus delta Lz and colors the data points
+#according to the surface density histogram of Lz0 versus delta Lz         
+def animate_Lz_scat(theta=theta):
+    Lz, Lz0, del_Lz = getLz(theta)
+    fig, anim = makeScat(theta)
+    saveMovie(makeScat,"scat",fig,anim,len(Lz.transpose())/(2*RC),theta)
     return anim
     
     
-def update_scat(i,fig,ax,scat):
+def update_scat(i,fig,ax,scat,theta=theta):
+    Lz, Lz0, del_Lz = getLz(theta)
     x = Lz0
     y = del_Lz[:,i*RC*2]
     data = np.hstack((x[:,np.newaxis], y[:, np.newaxis]))
     scat.set_offsets(data)    
-    H,xedges,yedges = np.histogram2d(x,y, range=[[700,3500], [-1000,1000]],bins=(100,80)) 
-    xidx = np.clip(np.digitize(x, xedges), 0, H.shape[0]-1)
-    yidx = np.clip(np.digitize(y, yedges), 0, H.shape[1]-1)
-    col = H[xidx, yidx] +1
+    col = getCube("scat",theta).colors(i) +1
     scat.set_array(col)
     ax.set_title("Change in Angular Momentum ("+ r'$\theta='+theta+'$'+") \n Time(Gy): %f" % float(2*i*RC/1000.),size = 25)
     return scat
     
-def update_hist(i,fig,ax,im):
-    H,x,y = np.histogram2d(Lz[:,0], del_Lz[:,i*RC], range=[[400,3500], [-1000,1000]],bins=(100, 80)) 
+def update_hist(i,fig,ax,im,theta=theta):
+    H = getCube("hist",theta).frame(i)
     im.set_array(H.T) 
     ax.set_title("Change in Angular Momentum ("+ r'$\theta='+theta+'$'+") \n Time(Gy): %f" % float(i*RC/1000.),size = 20)
     return im,
@@ -1,74 +1,106 @@
 import numpy as np
 from timeit import default_timer
-import matplotlib.animation as animation
-import matplotlib.pyplot as plt
-import Orbit_Code as OC
-reload(OC)
-    
-print("Load stuff for plotting...")
-start = default_timer()
 
-qpRdata = np.load('/Users/LBarbano/Desktop/QP_Data/qpRdata_(theta=20).npy')
-#Create orbit object to plot the spiral parameters
-#Hardcode spiral parameters (m=4,theta=15,20,25,30 etc, t = ?, eps = 0.3, rest don't matter) 
-orbit = OC.Orbit_Calculator(4,30,2,8,0.3,0,0,0,0) 
-duration = default_timer() - start
-print "time: %s s" % str(duration) 
+theta = "20" #theta animated when none is given
+qpRPath = '/Users/LBarbano/Desktop/QP_Data/qpRdata_(theta=%s).npy' #qpR data of each theta
+
+#The qpR data, orbit object and surface density cube of a theta are only made when
+#first needed, and are then kept in qpRCache, orbitCache and cubeCache (matplotlib
+#and Orbit_Code, with astropy, are also only imported by the functions that use them)
+qpRCache = {}
+orbitCache = {}
+cubeCache = {}
+
+#Returns the qpR data of a theta (e.g. "20"), loading it the first time only
+def getqpRdata(theta=theta):
+    if theta not in qpRCache:
+        print("Load stuff for plotting...")
+        start = default_timer()
+        qpRCache[theta] = np.load(qpRPath % theta)
+        duration = default_timer() - start
+        print "time: %s s" % str(duration) 
+    return qpRCache[theta]
+
+#Returns the surface density histogram of every step of a theta and the bin each
+#star is colored by (see Histogram_Cube), binning all steps in one pass the first time
+#(the bins are looked up on the edges shifted by 0.75, as the plots always have)
+def getCube(theta=theta):
+    if theta not in cubeCache:
+        import Histogram_Cube
+        qpRdata = getqpRdata(theta)
+        print("Bin stuff for plotting...")
+        start = default_timer()
+        cubeCache[theta] = Histogram_Cube.makeCube(qpRdata[:,:,0],qpRdata[:,:,1], range=[[-15.,15.0], [-15.,15.0]], bins=(40,40), shift=.75)
+        duration = default_timer() - start
+        print "time: %s s" % str(duration) 
+    return cubeCache[theta]
+
+#Returns an orbit object to plot the spiral of a theta
+def getOrbit(theta=theta):
+    if theta not in orbitCache:
+        import Orbit_Code as OC
+        #Hardcode spiral parameters (m=4,theta=15,20,25,30 etc, t = ?, eps = 0.3, rest don't matter) 
+        #The spiral is the one of theta (it used to be theta=30 whatever the data was)
+        orbitCache[theta] = OC.Orbit_Calculator(4,float(theta),2,8,0.3,0,0,0,0) 
+    return orbitCache[theta]
 
 
 #plots an animation of all qp data
-def animateGalaxy():
+def animateGalaxy(theta=theta):
+    import matplotlib.animation as animation
+    import matplotlib.pyplot as plt
+    qpRdata = getqpRdata(theta)
+    orbit = getOrbit(theta)
     plt.close('all')  
     RetardingConstant = 0.001*len(qpRdata[0]) #Animation related stuff
     fig,ax = orbit.plot(2)
     s, = ax.plot(qpRdata[:,0,0],qpRdata[:,0,1], 'b*',markersize='3.5',markeredgecolor = 'black',alpha = 1) #Draw initial location of star   
-    anim = animation.FuncAnimation(fig, animateScatter, frames= int(len(qpRdata[0])/RetardingConstant), interval= 1.0,fargs = (fig,ax,RetardingConstant,s))
+    anim = animation.FuncAnimation(fig, animateScatter, frames= int(len(qpRdata[0])/RetardingConstant), interval= 1.0,fargs = (fig,ax,RetardingConstant,s,qpRdata))
     ax.set_title("Time: %f" % float(qpRdata[0,0,2]/1000000000.0))
     return anim 
 
 #plots an animation of surface density of all qp data
-def animateSurfaceDensity(): 
+def animateSurfaceDensity(theta=theta): 
+    import matplotlib.animation as animation
+    import matplotlib.pyplot as plt
+    qpRdata = getqpRdata(theta)
+    orbit = getOrbit(theta)
     plt.close('all')  
     RetardingConstant = 0.001*len(qpRdata[0]) #Animation related stuff
+    cube = getCube(theta)
     fig,ax = orbit.plot(2)
-    H, xedges, yedges = np.histogram2d(qpRdata[:,0,0],qpRdata[:,0,1], range=[[-15.,15.0], [-15.,15.0]], bins=(40,40))
-    xidx = np.clip(np.digitize(qpRdata[:,0,0], xedges+.75), 0, H.shape[0]-1)
-    yidx = np.clip(np.digitize(qpRdata[:,0,1], yedges+.75), 0, H.shape[1]-1)
-    col = H[xidx, yidx]
+    col = cube.colors(0)
     scat = ax.scatter(qpRdata[:,0,0],qpRdata[:,0,1],c = col, s = 8,cmap='jet', edgecolor = 'none') #Draw initial location of star 
     ax.set_title("Time: %f" % float(qpRdata[0,0,2]/1000000000.0))
     plt.colorbar(scat)
     anim = animation.FuncAnimation(fig, animateHist, frames= int(len(qpRdata[0])/RetardingConstant), interval= 1.0, 
-    fargs=(fig,ax,scat,RetardingConstant,xedges,yedges))
+    fargs=(fig,ax,scat,RetardingConstant,cube,qpRdata))
     return anim
 
 #Helper functions for animations, don't call these directly   
-def animateScatter(i,fig,ax,RetardingConstant,s):
+def animateScatter(i,fig,ax,RetardingConstant,s,qpRdata):
     s.set_data(qpRdata[:,int(RetardingConstant*i),0],qpRdata[:,int(RetardingConstant*i),1]) 
     ax.set_title("Time(Gy): %f" % float(qpRdata[0,int(RetardingConstant*i),2]/1000000000.0))
     return s 
          
-def animateHist(i,fig,ax,scat,RetardingConstant,xedges,yedges):
+def animateHist(i,fig,ax,scat,RetardingConstant,cube,qpRdata):
     x = qpRdata[:,int(RetardingConstant*i),0]
     y = qpRdata[:,int(RetardingConstant*i),1]
     data = np.hstack((x[:,np.newaxis], y[:, np.newaxis]))
     scat.set_offsets(data)    
-    H, xxedges, yyedges = np.histogram2d(qpRdata[:,int(RetardingConstant*i),0],qpRdata[:,int(RetardingConstant*i),1], range=[[-15.,15.0], [-15.,15.0]], bins=(40, 40))
-    xidx = np.clip(np.digitize(qpRdata[:,int(RetardingConstant*i),0], xedges+.75), 0, H.shape[0]-1)
-    yidx = np.clip(np.digitize(qpRdata[:,int(RetardingConstant*i),1], yedges+.75), 0, H.shape[1]-1)
-    col = H[xidx, yidx]
-    scat.set_array(col)
+    scat.set_array(cube.colors(int(RetardingConstant*i)))
     ax.set_title("Time(Gy): %f" % float(qpRdata[0,int(RetardingConstant*i),2]/1000000000.0))
     return scat
 
 
-def plotSurfaceDensity(i):
+def plotSurfaceDensity(i,theta=theta):
+    import matplotlib.pyplot as plt
+    qpRdata = getqpRdata(theta)
+    orbit = getOrbit(theta)
+    cube = getCube(theta)
   
     fig,ax = orbit.plot(2)
-    H, xedges, yedges = np.histogram2d(qpRdata[:,i,0],qpRdata[:,i,1], range=[[-15.,15.0], [-15.,15.0]], bins=(40,40))
-    xidx = np.clip(np.digitize(qpRdata[:,i,0], xedges+0.75), 0, H.shape[0]-1)
-    yidx = np.clip(np.digitize(qpRdata[:,i,1], yedges+0.75), 0, H.shape[1]-1)
-    col = H[xidx, yidx]
+    col = cube.colors(i)
     scat = ax.scatter(qpRdata[:,i,0],qpRdata[:,i,1],c = col, s = 8,cmap='jet', edgecolor = 'none') #Draw initial location of star 
     ax.set_title("Time(Gy): %f" % float(qpRdata[0,i,2]/1000000000.0))
     plt.colorbar(scat)
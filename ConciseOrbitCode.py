@@ -1,15 +1,7 @@
 import numpy as np
 import Orbit_Code as OC
 reload(OC)
-
-def parseFilename(filename):
-   
-    parts = filename.split("=")
-    args = []
-    for l in range(1, len(parts)):
-        num = float(parts[l].split(")")[0])
-        args.append(num)
-    return args
+from Orbit_Manifest import parseFilename
 
 ###If you want to create a new qp
 #make the orbit
@@ -0,0 +1,141 @@
+'''
+Description:
+    This file runs a whole ensemble of orbits on one computer, in place of the
+OSG workflow (TrappedOrbits.submit queues server.csh, which runs MC_fNew.py and
+./LF_L4 once per orbit and passes the initial conditions through temp_initials).
+    runEnsemble draws NOrbit initial conditions with MC_fNew, splits them into
+chunks and integrates the chunks with Orbit_Calculator.makeEnsemble on a pool of
+worker processes (one per core by default). Every worker writes its orbits
+straight into one memory-mapped ensemble store (see Ensemble_Store), so the qp's
+never go through the pipes between processes: each worker is sent the initial
+conditions of its chunks and only sends back the chunk numbers (and, with
+Orbit_Metrics enabled, appends its metrics records to the metrics file), so the
+run scales with the number of cores.
+    The output is the single file outname.qps, holding the (NOrbit,steps,5) qp's
+laid out like Orbit_Calculator.getqp() and a metadata table with the spiral
+parameters and initial x0,y0,vx0,vy0 of each orbit. Open it with 
+Ensemble_Store.EnsembleStore(outname + ".qps").
+'''
+import numpy as np
+import multiprocessing
+import Ensemble_Store
+import Orbit_Metrics
+import sys
+from timeit import default_timer
+
+# Run parameters (You can toggle these)
+NOrbit = 10000      # Number of orbits to integrate
+NWorkers = None     # Number of worker processes (None uses every core)
+NChunk = 100        # Number of orbits given to a worker at a time
+backend = "numpy"   # Integration backend for makeEnsemble ("numpy" or "jit")
+scheme = "leapfrog" # Integration scheme for makeEnsemble (see Orbit_Code.schemes)
+stepTime = None     # Step of the scheme in years (None for StepTime, see makeEnsemble)
+tol = 1e-10         # Error per step of the "adaptive" scheme
+outputTime = None   # Years between stored states (None stores every step, see makeEnsemble)
+outname = "./ensemble_(m=4)_(th=15)"   # Start of the output filenames
+
+# Spiral parameters, same implicit units as the Orbit_Calculator constructor
+m = 4           # Number of spiral arms
+theta = 15      # Pitch angle (degrees)
+IntTime = 2     # Duration of simulation (gigayears)
+CR = 8          # Corotation radius (kiloparsecs)
+epsilon = 0.3   # Epsilon of the spiral
+
+################################################################################
+# Worker side
+################################################################################
+
+# Sets up each worker process once: an Orbit_Calculator for the spiral and the
+# ensemble store it writes its chunks into (and Orbit_Metrics, from the state of
+# the main process)
+def initWorker(spiral,storename,backend1,scheme1="leapfrog",metrics=(False,None),stepTime1=None,tol1=1e-10,outputTime1=None):
+    global orbit
+    global store
+    global workerBackend
+    global workerScheme
+    global workerStepTime
+    global workerTol
+    global workerOutputTime
+    import Orbit_Code
+    Orbit_Metrics.initWorker(metrics)
+    orbit = Orbit_Code.Orbit_Calculator(spiral[0],spiral[1],spiral[2],spiral[3],spiral[4],0,0,0,0)
+    store = Ensemble_Store.EnsembleStore(storename,'r+')
+    workerBackend = backend1
+    workerScheme = scheme1
+    workerStepTime = stepTime1
+    workerTol = tol1
+    workerOutputTime = outputTime1
+
+# Integrates one chunk of initial conditions and writes it to the store
+# Returns the index of the first orbit of the chunk and the number of orbits
+def integrateChunk(chunk):
+    first, qp0s = chunk
+    with Orbit_Metrics.timer("ensemble.integrate"):
+        qps = orbit.makeEnsemble(qp0s,backend=workerBackend,scheme=workerScheme,stepTime=workerStepTime,tol=workerTol,outputTime=workerOutputTime)
+    with Orbit_Metrics.timer("ensemble.write"):
+        store.writeChunk(first,qps)
+    Orbit_Metrics.count("orbits",len(qp0s))
+    Orbit_Metrics.report("ensemble.chunk")
+    return first, len(qp0s)
+
+################################################################################
+# Main process side
+################################################################################
+
+# Draws N initial conditions (x0,y0,vx0,vy0) from the Monte Carlo in MC_fNew
+def drawInitials(N,seed=None):
+    import MC_fNew
+    return MC_fNew.sample_initial_conditions(N,seed)
+
+# Integrates N orbits of the given spiral on a pool of workers
+# spiral = (m, theta, IntTime, CR, epsilon), qp0s = optional (N,4) initial
+# conditions (drawn with MC_fNew from the given seed if not given)
+# backend, scheme, stepTime, tol and outputTime are passed on to makeEnsemble
+# Returns the filename of the ensemble store
+# With Orbit_Metrics enabled, the sampling and the allocation of the store are 
+# reported for the whole run, and the integration and writing for each chunk
+def runEnsemble(N,outname,spiral=(m,theta,IntTime,CR,epsilon),qp0s=None,seed=None,
+                workers=None,chunk=NChunk,backend=backend,scheme=scheme,stepTime=stepTime,tol=tol,outputTime=outputTime):
+    import Orbit_Code
+    from MC_fNew import timer
+    Orbit_Code.checkScheme(scheme)
+
+    start = default_timer()
+    if qp0s is None:
+        print("Drawing %i initial conditions..." % N)
+        with Orbit_Metrics.timer("ensemble.sample"):
+            qp0s = drawInitials(N,seed)
+    qp0s = np.asarray(qp0s,dtype=float)[:N]
+
+    # Allocate the store and write the metadata before any worker starts 
+    with Orbit_Metrics.timer("ensemble.allocate"):
+        orbit = Orbit_Code.Orbit_Calculator(spiral[0],spiral[1],spiral[2],spiral[3],spiral[4],0,0,0,0)
+        steps = int(orbit.getOutputLength(scheme,stepTime,outputTime))
+        storename = outname + ".qps"
+        store = Ensemble_Store.createStore(storename,len(qp0s),steps)
+        store.writeMeta(0,np.c_[np.tile(np.array(spiral,dtype=float),(len(qp0s),1)),qp0s])
+        del store
+
+    chunks = [(i,qp0s[i:i+chunk]) for i in range(0,len(qp0s),chunk)]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    print("Integrating %i orbits in %i chunks on %i workers..." % (len(qp0s),len(chunks),workers))
+    pool = multiprocessing.Pool(workers, initializer=initWorker, initargs=(spiral,storename,backend,scheme,Orbit_Metrics.getState(),stepTime,tol,outputTime))
+    try:
+        nDone = 0
+        for i, (first, n) in enumerate(pool.imap_unordered(integrateChunk, chunks)):
+            nDone = nDone + n
+            print("Chunk %i/%i | %i orbits done | Time Elapsed: %s | %s%% Finished" % (i+1,len(chunks),
+                  nDone,timer(start,default_timer()),round(100.*nDone/len(qp0s),1)))
+            sys.stdout.flush()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    Orbit_Metrics.report("ensemble")
+    return storename
+
+if __name__ == "__main__":
+    runEnsemble(NOrbit,outname,workers=NWorkers)
@@ -0,0 +1,154 @@
+'''
+Description:
+    This file defines the binary ensemble store: a single file that holds every
+orbit of a run, in place of one text file per star (LF_L4) or one .npy per orbit
+(Orbit_Calculator.saveData).
+    A store file is laid out as:
+        -8 bytes: the magic string "QPSTORE1"
+        -8 bytes: length of the header (little endian unsigned integer)
+        -header: JSON with the shape, columns, dtype and byte offsets below
+        -metadata table: one record per orbit (metaDtype), i.e. the spiral
+         parameters and initial conditions that used to live in the filename
+        -data: one contiguous (orbit, time, column) array of float64, the qp of
+         each orbit in the Orbit_Calculator layout x,y,vx,vy,t (kpc, km/s, yr)
+    Both the metadata and the data are memory mapped when a store is opened, so
+any orbit (store.getOrbit(i)) or any time slice across all orbits
+(store.getTime(j)) can be read without loading the rest of the file, and writers
+can fill the store chunk by chunk (store.writeChunk) from several processes.
+
+Usage:
+    store = createStore(filename, nOrbit, nTime)   # allocate a new store
+    store = resizeStore(filename, nOrbit)          # change the number of orbits of a store
+    store.writeMeta(first, meta)                   # fill the metadata table
+    store.writeChunk(first, qps)                   # fill orbits first:first+len(qps)
+    store = EnsembleStore(filename)                # open an existing store (read only)
+'''
+import os
+import json
+import numpy as np
+
+magic = b"QPSTORE1"
+align = 4096                                   # Byte alignment of the data block
+qpColumns = ["x","y","vx","vy","t"]            # Columns of the qp of each orbit
+metaNames = ["m","th","t","CR","eps","x0","y0","vx0","vy0"]  # Same order as the filenames
+metaDtype = np.dtype([(name,'<f8') for name in metaNames])
+
+# Rounds a byte offset up to the next multiple of align
+def alignOffset(offset):
+    return ((offset + align - 1)//align)*align
+
+# Creates a new store for nOrbit orbits of nTime steps, filled with zeros
+# reserve = number of orbits the metadata table has room for (nOrbit if None),
+# so that resizeStore can grow the store up to it without moving the data
+# Returns the store opened for writing
+def createStore(filename,nOrbit,nTime,columns=qpColumns,reserve=None):
+    header = {"version": 1, "nOrbit": int(nOrbit), "nTime": int(nTime),
+              "columns": list(columns), "dtype": "<f8",
+              "metaDtype": [[name, '<f8'] for name in metaNames]}
+    # The offsets depend on the header length, so leave room for them first
+    header["metaOffset"] = header["dataOffset"] = 0
+    headerLength = len(json.dumps(header)) + 64
+    header["metaOffset"] = alignOffset(16 + headerLength)
+    header["dataOffset"] = alignOffset(header["metaOffset"] + max(int(nOrbit),int(reserve or 0))*metaDtype.itemsize)
+    text = json.dumps(header).encode('ascii').ljust(headerLength)
+    size = header["dataOffset"] + int(nOrbit)*int(nTime)*len(columns)*8
+    with open(filename,'wb') as f:
+        f.write(magic)
+        f.write(np.array([headerLength],dtype='<u8').tobytes())
+        f.write(text)
+        f.truncate(size)
+    return EnsembleStore(filename,'r+')
+
+# Reads the JSON header of a store
+def readHeader(filename):
+    with open(filename,'rb') as f:
+        if f.read(8) != magic:
+            raise IOError("%s is not an ensemble store" % filename)
+        headerLength = int(np.frombuffer(f.read(8),dtype='<u8')[0])
+        return json.loads(f.read(headerLength).decode('ascii'))
+
+# Changes the number of orbits of a store to nOrbit, keeping the first orbits
+# (and metadata) it has: the data block is cut or extended (with zeros) at the
+# end of the file, and only if the metadata table has no room for nOrbit orbits
+# is the store copied into a new file with a larger one
+# Returns the store opened for writing
+def resizeStore(filename,nOrbit):
+    header = readHeader(filename)
+    if header["metaOffset"] + int(nOrbit)*metaDtype.itemsize > header["dataOffset"]:
+        old = EnsembleStore(filename)
+        keep = min(len(old),int(nOrbit))
+        new = createStore(filename + ".resize",nOrbit,old.nTime,old.columns,reserve=2*int(nOrbit))
+        new.meta[0:keep] = old.meta[0:keep]
+        for first in range(0,keep,1000):
+            new.qp[first:min(first + 1000,keep)] = old.qp[first:min(first + 1000,keep)]
+        new.flush()
+        del old, new
+        os.remove(filename)
+        os.rename(filename + ".resize",filename)
+        return EnsembleStore(filename,'r+')
+    header["nOrbit"] = int(nOrbit)
+    with open(filename,'r+b') as f:
+        f.seek(8)
+        headerLength = int(np.frombuffer(f.read(8),dtype='<u8')[0])
+        text = json.dumps(header).encode('ascii')
+        if len(text) > headerLength:
+            raise ValueError("The header of %s has no room for %i orbits" % (filename,int(nOrbit)))
+        f.write(text.ljust(headerLength))
+        f.truncate(header["dataOffset"] + int(nOrbit)*header["nTime"]*len(header["columns"])*8)
+    return EnsembleStore(filename,'r+')
+
+
+class EnsembleStore(object):
+
+    # Opens a store, mode = 'r' for reading only or 'r+' for writing into it
+    def __init__(self,filename,mode='r'):
+        self.filename = filename
+        self.header = readHeader(filename)
+        self.nOrbit = self.header["nOrbit"]
+        self.nTime = self.header["nTime"]
+        self.columns = self.header["columns"]
+        self.meta = np.memmap(filename, dtype=metaDtype, mode=mode,
+                              offset=self.header["metaOffset"], shape=(self.nOrbit,))
+        self.qp = np.memmap(filename, dtype=self.header["dtype"], mode=mode, offset=self.header["dataOffset"],
+                            shape=(self.nOrbit,self.nTime,len(self.columns)))
+
+    def __len__(self):
+        return self.nOrbit
+
+# Returns the (nTime,columns) qp of orbit i (a view into the file)
+    def getOrbit(self,i):
+        return self.qp[i]
+
+# Returns the (nOrbit,columns) positions/velocities of every orbit at time step j
+    def getTime(self,j):
+        return self.qp[:,j]
+
+# Returns the metadata record (m, th, t, CR, eps, x0, y0, vx0, vy0) of orbit i
+    def getMeta(self,i):
+        return self.meta[i]
+
+# Writes the qp's of orbits first to first+len(qps)
+    def writeChunk(self,first,qps):
+        self.qp[first:first+len(qps)] = qps
+        self.qp.flush()
+
+# Writes the metadata of orbits first to first+len(meta), where meta is either
+# a metaDtype array or an (n,9) array with the columns in metaNames order
+    def writeMeta(self,first,meta):
+        meta = np.asarray(meta)
+        if meta.dtype.names is None:
+            meta = np.array([tuple(row) for row in meta],dtype=metaDtype)
+        self.meta[first:first+len(meta)] = meta
+        self.meta.flush()
+
+# Returns an Orbit_Calculator for orbit i with its qp already set
+    def getOrbitCalculator(self,i):
+        import Orbit_Code
+        a = self.meta[i]
+        orbit = Orbit_Code.Orbit_Calculator(*[a[name] for name in metaNames])
+        orbit.setqp(np.array(self.qp[i]))
+        return orbit
+
+    def flush(self):
+        self.meta.flush()
+        self.qp.flush()
@@ -1,40 +1,115 @@
+import os
+import json
 import numpy as np
 from timeit import default_timer
-import Orbit_Code as OC
-reload(OC)
-    
-#load the table
-theta = 'theta=15'
-dataFilePath = "/Users/LBarbano/Github/Summer-2016/table1_"+theta+".txt"
-tableInfo = np.loadtxt(dataFilePath,delimiter=" ",dtype= str)
-filepaths = tableInfo[:,0]
-data = tableInfo[:,1:16].astype(float)
+import Table_Cache
+import Orbit_Kernel
 
+theta = 'theta=15' #theta of the table used when none is given
+tablePath = "/Users/LBarbano/Github/Summer-2016/table1_%s.txt" #table1 of each theta
+LzPath = '/Users/LBarbano/Desktop/QP_Data/Lz_data_(%s).npy' #where the Lz data of each theta is saved
+qpRPath = '/Users/LBarbano/Desktop/QP_Data/qpRdata_(%s).npy' #where the qpR data (xR, yR, t) of each theta is saved
 frac= 1 #fraction of qp data to be animated, 1 for all 0.01 for 1%
-length = int(frac*len(data))
-print("Generating %i Orbit_Code objects for plotting..." % length)
-start = default_timer()
+batch = 500 #orbits read and converted at once by buildData (bounds the memory it uses)
 
-orbits = np.array([OC.Orbit_Calculator(data[i,0],data[i,1],data[i,2],data[i,3],data[i,4],
-data[i,5],data[i,6],data[i,7],data[i,8]) for i in range(length)]) #Create array of orbit objects
-qpdata = np.array([np.loadtxt(filepaths[i],delimiter=" ",dtype= str).astype(float) for i in range(length)]) #extract qpdata from all files
-t = qpdata[:,:,0] #switch around t values to so that we can setqp 
-qpdata = np.array([np.c_[qpdata[i,:,1:5],t[i,:]] for i in range(length)])
+#Nothing is loaded when this file is imported: the table and orbit ensemble of a
+#theta are made when first asked for, and are then kept in ensembleCache
+ensembleCache = {}
 
+#Returns the qp filepaths and the data (the 15 columns after the path) of the table of a theta
+def getTable(theta=theta):
+    data, filepaths = Table_Cache.loadTable(tablePath % theta)
+    return filepaths, data[:,0:15]
 
-for i in range(length):
-    qpdata[i,:,2]= qpdata[i,:,2]*9.777922216731282e+8
-    qpdata[i,:,3]= qpdata[i,:,3]*9.777922216731282e+8
-    orbits[i].setqp(qpdata[i])
+#Returns an Orbit_Ensemble.OrbitEnsemble holding the qp of the first frac of the
+#orbits of the table of a theta (one array, instead of an Orbit_Code object per orbit)
+def getEnsemble(theta=theta,frac=frac):
+    if (theta,frac) not in ensembleCache:
+        from Orbit_Ensemble import OrbitEnsemble
+        filepaths, data = getTable(theta)
+        length = int(frac*len(data))
+        print("Loading %i orbits for plotting..." % length)
+        start = default_timer()
+        ensembleCache[(theta,frac)] = OrbitEnsemble.fromFiles(filepaths[0:length],data[0:length,0:9])
+        duration = default_timer() - start
+        print "time: %s s" % str(duration)
+    return ensembleCache[(theta,frac)]
 
-#qpRdata = np.array([orbits[i].getqpR() for i in range(length)])
-Lz = np.array([orbits[i].find_All_Lz() for i in range(length)])
-duration = default_timer() - start
-print "time: %s s" % str(duration) 
+#Returns an Orbit_Code object of orbit i of a theta, with its qp set
+def getOrbit(i,theta=theta,frac=frac):
+    return getEnsemble(theta,frac).getOrbit(i)
 
-#Add time values to qpR
-#qpR = np.array([np.c_[qpRdata[i,:,0:2],t[i].transpose()] for i in range(length)])
+#Returns the Lz data of a theta (Lz at every step of every orbit)
+def getLz(theta=theta,frac=frac):
+    return getEnsemble(theta,frac).find_All_Lz()
 
-#Save data
-#np.save('/Users/LBarbano/Github/Summer-2016/qpRdata_('+theta+').npy',qpR)
-np.save('/Users/LBarbano/Desktop/QP_Data/Lz_data_('+theta+').npy',Lz)
\ No newline at end of file
+#Returns xR, yR, t and L_z of a qp (the qpR data and Lz data), with the same
+#expressions as Orbit_Kernel.toRframe and findPhys, for OrbitEnsemble.apply
+def findqpRLz(x,y,vx,vy,t,k):
+    xR, yR, vxR, vyR, vr, vphi, vphiR = Orbit_Kernel.toRframe(x,y,vx,vy,t,k)
+    return xR, yR, t, np.sqrt(x**2 + y**2)*vphi
+
+#Returns the filename of the progress record of buildData for a theta
+def progressName(theta=theta):
+    return LzPath % theta + ".progress"
+
+#Returns what a build of the qpR and Lz data of the first length orbits of a
+#table comes from: the size and modification time of the table, the number of
+#orbits and steps, and a hash of the qp paths of those orbits, so that a build
+#only carries on if none of them changed
+def findSource(theta,filepaths,length,nTime):
+    import hashlib
+    stat = os.stat(tablePath % theta)
+    paths = hashlib.md5("\n".join([str(path) for path in filepaths[0:length]]).encode('utf-8')).hexdigest()
+    return {"table": tablePath % theta, "size": stat.st_size, "mtime": stat.st_mtime,
+            "orbits": length, "steps": nTime, "paths": paths}
+
+#Returns the progress record of buildData for a theta, None if there is none
+def loadProgress(theta=theta):
+    try:
+        with open(progressName(theta)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+#Writes the qpR data (orbits,steps,3) and Lz data (orbits,steps) of the first frac
+#of the orbits of a theta into .npy files at qpRPath and LzPath, a batch of
+#orbits at a time, so only one batch is ever in memory
+#The number of orbits written is saved after every batch, so a build that was
+#interrupted carries on from the last batch the next time it is run (if the
+#table is the same, see findSource, otherwise it starts over)
+#Returns the qpR data and Lz data, memory mapped
+def buildData(theta=theta,frac=frac,batch=batch):
+    from Orbit_Ensemble import OrbitEnsemble
+    from Table_Helper import loadQP
+    filepaths, data = getTable(theta)
+    length = int(frac*len(data))
+    nTime = len(loadQP(filepaths[0]))
+    source = findSource(theta,filepaths,length,nTime)
+    progress = loadProgress(theta)
+    if progress is not None and progress["source"] == source and os.path.isfile(qpRPath % theta) and os.path.isfile(LzPath % theta):
+        done = progress["done"]
+        qpR = np.lib.format.open_memmap(qpRPath % theta,mode='r+')
+        Lz = np.lib.format.open_memmap(LzPath % theta,mode='r+')
+        print("Carrying on from orbit %i of %i..." % (done,length))
+    else:
+        done = 0
+        qpR = np.lib.format.open_memmap(qpRPath % theta,mode='w+',dtype=float,shape=(length,nTime,3))
+        Lz = np.lib.format.open_memmap(LzPath % theta,mode='w+',dtype=float,shape=(length,nTime))
+    start = default_timer()
+    for first in range(done,length,batch):
+        last = min(first+batch,length)
+        ensemble = OrbitEnsemble.fromFiles(filepaths[first:last],data[first:last,0:9])
+        values = ensemble.apply(findqpRLz)
+        qpR[first:last] = np.moveaxis(values[0:3],0,2)
+        Lz[first:last] = values[3]
+        qpR.flush()
+        Lz.flush()
+        with open(progressName(theta),'w') as f:  #only written once the batch is on disk
+            json.dump({"source": source, "done": last},f)
+        duration = default_timer() - start
+        print("%i of %i orbits, %.1f s" % (last,length,duration))
+    return qpR, Lz
+
+if __name__ == "__main__":
+    buildData(theta,frac)
@@ -0,0 +1,118 @@
+'''
+Description:
+    This file precomputes the 2d histograms the animations color their frames
+with (Animated_Surface_Density.animateHist and plotSurfaceDensity, Animate_Lz
+update_hist and update_scat), so a frame only indexes arrays instead of running
+np.histogram2d and np.digitize over every star while matplotlib waits.
+    makeCube bins every frame at once: the bin of each star along x and y is
+found for a block of frames with one searchsorted per axis, and the counts of
+every frame with one bincount, giving the same counts as np.histogram2d of each
+frame. Along with the counts it keeps, for each star and frame, the indices the
+animations look the counts up with (np.digitize of the star over the edges plus
+a shift, clipped to the histogram, as the animations do; Animated_Surface_Density
+shifts the edges by 0.75). Counts and indices are stored in the smallest integer
+types that hold them, so a cube of 10000 stars over 2000 frames of 40x40 bins
+takes about 45 MB, and a cube can be saved and loaded as one .npz file.
+    Nothing in a cube depends on the colormap or norm, so frames can be drawn
+again with different ones at no cost.
+
+Usage:
+    cube = makeCube(x, y, range=[[-15.,15.],[-15.,15.]], bins=(40,40), shift=.75)   # x, y (N,T) or (N,)
+    H = cube.counts[t]           # np.histogram2d(x[:,t],y[:,t],...)[0]
+    col = cube.colors(t)         # H[xidx,yidx] of every star at frame t
+'''
+import numpy as np
+
+# Histograms of every frame of a set of stars, made by makeCube
+#   counts          (frames,nx,ny) counts of each frame
+#   xedges, yedges  bin edges, as returned by np.histogram2d
+#   xidx, yidx      (frames,N) look up indices of each star (None if not kept)
+class HistogramCube(object):
+
+    def __init__(self,counts,xedges,yedges,xidx=None,yidx=None):
+        self.counts = counts
+        self.xedges = xedges
+        self.yedges = yedges
+        self.xidx = xidx
+        self.yidx = yidx
+
+    def __len__(self):
+        return len(self.counts)
+
+    # Returns the histogram of frame t, as floats like np.histogram2d
+    def frame(self,t):
+        return self.counts[t].astype(float)
+
+    # Returns the count of the bin each star is looked up in at frame t
+    def colors(self,t):
+        return self.counts[t][self.xidx[t],self.yidx[t]].astype(float)
+
+    # Saves the cube as one .npz file
+    def save(self,filename):
+        arrays = {"counts": self.counts, "xedges": self.xedges, "yedges": self.yedges}
+        if self.xidx is not None:
+            arrays["xidx"] = self.xidx
+            arrays["yidx"] = self.yidx
+        np.savez(filename,**arrays)
+
+    # Loads a cube saved by save
+    @classmethod
+    def load(cls,filename):
+        saved = np.load(filename)
+        if "xidx" in saved.files:
+            return cls(saved["counts"],saved["xedges"],saved["yedges"],saved["xidx"],saved["yidx"])
+        return cls(saved["counts"],saved["xedges"],saved["yedges"])
+
+# Returns the bin of each value along one axis of np.histogram2d, 0 below the
+# range and n+1 above it (values equal to the last edge go in the last bin)
+def histogramBins(values,edges):
+    bins = np.searchsorted(edges,values,side='right')
+    bins[values == edges[-1]] -= 1
+    return bins
+
+# Returns the index each value is looked up in, np.digitize(values,edges+shift)
+# clipped to the n bins
+def lookupIndices(values,edges,shift):
+    return np.clip(np.searchsorted(edges + shift,values,side='right'),0,len(edges) - 2)
+
+# Returns the values of frames of an (N,T) array, or of an (N,) array for
+# every frame, as (frames,N)
+def frameValues(values,frames):
+    values = np.asarray(values)
+    if values.ndim == 1:
+        return np.broadcast_to(values,(len(frames),len(values)))
+    return values[:,frames].T
+
+# Bins stars at every frame
+#   x, y    (N,T) positions of N stars at T times, or (N,) if the same at every time
+#   range   [[xmin,xmax],[ymin,ymax]] and bins = (nx,ny), as in np.histogram2d
+#   frames  the times binned (all times if None)
+#   shift   added to the edges the look up indices are found on (see lookupIndices)
+#   indices keep the look up indices of every star (False keeps only the counts)
+#   block   frames binned at once (bounds the memory of the temporary arrays)
+def makeCube(x,y,range,bins,frames=None,shift=0.,indices=True,block=64):
+    nx, ny = bins
+    xedges = np.linspace(range[0][0],range[0][1],nx + 1)
+    yedges = np.linspace(range[1][0],range[1][1],ny + 1)
+    if frames is None:
+        frames = np.arange(np.shape(x)[1] if np.ndim(x) == 2 else np.shape(y)[1])
+    frames = np.asarray(frames)
+    N = np.shape(x)[0]
+    counts = np.empty((len(frames),nx,ny),dtype=np.min_scalar_type(N))
+    if indices:
+        xidx = np.empty((len(frames),N),dtype=np.min_scalar_type(nx - 1))
+        yidx = np.empty((len(frames),N),dtype=np.min_scalar_type(ny - 1))
+    for start in np.arange(0,len(frames),block):
+        part = frames[start:start + block]
+        xs = frameValues(x,part)
+        ys = frameValues(y,part)
+        cell = histogramBins(xs,xedges)*(ny + 2) + histogramBins(ys,yedges)
+        cell += np.arange(len(part))[:,np.newaxis]*((nx + 2)*(ny + 2))
+        full = np.bincount(cell.ravel(),minlength=len(part)*(nx + 2)*(ny + 2))
+        counts[start:start + len(part)] = full.reshape(len(part),nx + 2,ny + 2)[:,1:-1,1:-1]
+        if indices:
+            xidx[start:start + len(part)] = lookupIndices(xs,xedges,shift)
+            yidx[start:start + len(part)] = lookupIndices(ys,yedges,shift)
+    if indices:
+        return HistogramCube(counts,xedges,yedges,xidx,yidx)
+    return HistogramCube(counts,xedges,yedges)
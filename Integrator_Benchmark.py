@@ -0,0 +1,98 @@
+'''
+Description:
+    This file compares the integration schemes of Orbit_Calculator (see
+Orbit_Code.schemes and Orbit_Kernel) by their work and precision. A single orbit
+is integrated with every scheme over a range of step sizes, and for each run the
+drift of the Jacobi integral E_j (which is conserved in the rotating frame of the
+spiral) is plotted against the number of force evaluations it took.
+    A scheme is worth using when its curve lies below and to the left of the
+others: the same E_j drift for fewer force evaluations, i.e. larger steps.
+    The runs call the kernel directly, with the state written out every
+OutputTime years, so the step size isn't tied to the time grid of
+Orbit_Calculator.
+'''
+import numpy as np
+from timeit import default_timer
+import Orbit_Code
+import Orbit_Kernel
+
+# Benchmark parameters (You can toggle these)
+spiral = (4,15,8,0.3)           # m, theta (degrees), CR (kpc), epsilon
+qp0 = (7.5,1.2,-20.,215.)       # x0, y0 (kpc), vx0, vy0 (km/s)
+IntTime = 0.5e9                 # Duration of each run (years)
+OutputTime = 1e7                # Time between the states that are checked (years)
+backend = "jit"                 # "jit" (numba) or "numpy"
+filename = "./Integrator_Benchmark.pdf"
+# Step sizes (years) run with each scheme
+stepTimes = {"leapfrog": [1e3,3e3,1e4,3e4,1e5],
+             "verlet": [1e3,3e3,1e4,3e4,1e5,3e5],
+             "yoshida4": [1e4,3e4,1e5,3e5,1e6,3e6],
+             "yoshida6": [3e4,1e5,3e5,1e6,3e6,1e7]}
+tols = [1e-6,1e-8,1e-10,1e-12,1e-14]   # Tolerances of "adaptive" (first step 1e6 yr)
+
+# Returns the largest relative change of E_j over a qp
+def jacobiDrift(qp,k):
+    Ej = Orbit_Kernel.findPhys(qp[:,0],qp[:,1],qp[:,2],qp[:,3],qp[:,4],k)[1]
+    return np.max(np.abs(Ej - Ej[0]))/np.abs(Ej[0])
+
+# Integrates qp0 with a scheme and step (years), or tolerance for "adaptive"
+# Returns the number of force evaluations and the Jacobi drift
+def runScheme(integrator,scheme,stepTime,k,tol=None):
+    x, y, vx, vy = qp0
+    dt = stepTime*Orbit_Kernel.yr2sec
+    if scheme == "leapfrog":
+        # The original scheme stores every step, and kicks with the force at the
+        # start of the step, so the state it stores is the one at T + stepTime
+        T = np.arange(0.,IntTime,stepTime)
+        qp = np.zeros((len(T),5))
+        integrator.integrate(x,y,vx,vy,T,dt,k,qp)
+        qp[:,4] = qp[:,4] + stepTime
+        return 2*len(T), jacobiDrift(qp,k)
+    T = np.arange(0.,IntTime+OutputTime/2.,OutputTime)
+    qp = np.zeros((len(T),5))
+    if scheme == "adaptive":
+        nEval = integrator.integrateAdaptive(x,y,vx,vy,T,dt,k,qp,tol)
+    else:
+        nEval = integrator.integrateComposed(x,y,vx,vy,T,dt,k,qp,Orbit_Code.schemes[scheme])
+    return nEval, jacobiDrift(qp,k)
+
+# Runs every scheme, prints a table and returns {scheme: (nEvals, drifts)}
+def runBenchmark():
+    integrator = Orbit_Code.findBackend(backend)
+    k = Orbit_Code.findKernel(*spiral)
+    results = {}
+    print("%-10s %12s %12s %12s %10s" % ("scheme","step (yr)","force evals","E_j drift","time (s)"))
+    for scheme in ["leapfrog","verlet","yoshida4","yoshida6","adaptive"]:
+        runs = [(s,None) for s in stepTimes[scheme]] if scheme != "adaptive" else [(1e6,tol) for tol in tols]
+        nEvals = []
+        drifts = []
+        for stepTime, tol in runs:
+            start = default_timer()
+            nEval, drift = runScheme(integrator,scheme,stepTime,k,tol)
+            duration = default_timer() - start
+            nEvals.append(nEval)
+            drifts.append(drift)
+            label = "%.0e" % stepTime if tol is None else "tol %.0e" % tol
+            print("%-10s %12s %12i %12.3e %10.3f" % (scheme,label,nEval,drift,duration))
+        results[scheme] = (np.array(nEvals),np.array(drifts))
+    return results
+
+# Plots the Jacobi drift against the force evaluations of every scheme
+def plotBenchmark(results):
+    import matplotlib.pyplot as plt
+    plt.close('all')
+    fig = plt.figure(1)
+    ax = fig.add_subplot(111)
+    for scheme in ["leapfrog","verlet","yoshida4","yoshida6","adaptive"]:
+        nEvals, drifts = results[scheme]
+        ax.loglog(nEvals,drifts,marker='o',label=scheme)
+    ax.set_xlabel('Force evaluations',size=18)
+    ax.set_ylabel(r'max $|\Delta E_j/E_j|$',size=18)
+    ax.set_title('Work-precision of the integrators (%.1f Gyr)' % (IntTime/1e9),size=20)
+    ax.legend(loc='upper right')
+    fig.savefig(filename)
+    return fig, ax
+
+if __name__ == "__main__":
+    results = runBenchmark()
+    plotBenchmark(results)
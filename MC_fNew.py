@@ -176,30 +176,230 @@ def getMCqp0(): # Define initial conditions evenly distributed within f_New
                             nOK = 1
     return qp0    
 
-nRun = 1
-#starttime = time.time()
-'''
-while nRun < NRun+1:
+################################################################################
+# Monte Carlo - Tabulated envelope
+################################################################################
+
+# The constant envelope gx = 2*findfMax(EMax,LzMax) of getMCqp0 lies below f for
+# stars with RE < 15 kpc - 3Rd ln(2) ~ 9.8 kpc, where every draw is accepted. So 
+# the density getMCqp0 really samples is min(f,gx). The tabulated envelope below
+# samples that same clipped density, only inside the (E,Lz) region that can pass
+# the RL, Eran and vran cuts, so both methods give the same distribution.
+
+# Calculates the acceptance probability of getMCqp0, min(f/gx, 1)
+def findAcceptProb(E,Lz):
+    gx = 2.*findfMax(EMax,LzMax)*M
+    return np.minimum((findf(E,Lz)/gx).decompose().value, 1.)
+
+# Finds the box around the (E,Lz) region allowed by the cuts of getMCqp0
+# RL in 4-12 kpc and 0 < Eran < 2 sigma(3Rd)^2 (i.e. vran < 2 sigma(3Rd))
+# Returns E0, E1 in (km/s)^2 and Lz0, Lz1 in kpc km/s
+def findAllowedBox():
+    EranMax = 2.*findVelocityDispersion(3.*Rd)**2
+    Lz0 = (4.*u.kpc*vc).to(u.kpc*u.km/u.s).value
+    Lz1 = (12.*u.kpc*vc).to(u.kpc*u.km/u.s).value
+    E0 = findE(4.*u.kpc,vc).to((u.km/u.s)**2).value
+    E1 = min((findE(12.*u.kpc,vc) + EranMax).to((u.km/u.s)**2).value, EMax.to((u.km/u.s)**2).value)
+    return E0, E1, Lz0, Lz1
+
+# Tabulates a piecewise constant envelope of findAcceptProb on an NE x NLz grid
+# of cells over the allowed box. Each cell holds the largest value of 
+# findAcceptProb over an NSub x NSub sub-grid of the cell (edges included) times
+# a safety factor, and cells with no point that can pass the cuts are set to 0.
+# Returns the cell edges and the (NE,NLz) envelope
+def buildEnvelope(NE=64,NLz=64,NSub=9,safety=1.1):
+    E0, E1, Lz0, Lz1 = findAllowedBox()
+    Eedges = np.linspace(E0,E1,NE+1)
+    Lzedges = np.linspace(Lz0,Lz1,NLz+1)
+    # Sample findAcceptProb on the sub-grid of every cell
+    sub = np.linspace(0.,1.,NSub)
+    Esub = Eedges[:-1,np.newaxis] + np.outer(np.diff(Eedges),sub)
+    Lzsub = Lzedges[:-1,np.newaxis] + np.outer(np.diff(Lzedges),sub)
+    p = findAcceptProb(Esub.reshape(NE,1,NSub,1)*(u.km/u.s)**2,
+                       Lzsub.reshape(1,NLz,1,NSub)*u.kpc*u.km/u.s)
+    env = np.minimum(safety*p.max(axis=(2,3)), 1.)
+    # Throw away cells below Eran = 0 or above the vran cut
+    EranMax = (2.*findVelocityDispersion(3.*Rd)**2).to((u.km/u.s)**2).value
+    Ec0 = findE(findRL(Lzedges[:-1]*u.kpc*u.km/u.s),vc).to((u.km/u.s)**2).value
+    Ec1 = findE(findRL(Lzedges[1:]*u.kpc*u.km/u.s),vc).to((u.km/u.s)**2).value
+    allowed = (Eedges[1:,np.newaxis] > Ec0) & (Eedges[:-1,np.newaxis] < Ec1 + EranMax)
+    env[~allowed] = 0.
+    return Eedges, Lzedges, env
+
+# Envelopes already built, one per disk model
+envelopes = {}
+
+# Returns the envelope for the current disk model, building it only once 
+# If cachefile is given, the envelope is also kept on disk (as a .npz) between runs
+def getEnvelope(cachefile=None):
+    key = tuple(float(q.value) for q in [vc,RSun,SigmaSun,sigmaSun,Rd,Rp,RMax])
+    if key not in envelopes:
+        if cachefile is not None and os.path.isfile(cachefile):
+            cache = np.load(cachefile)
+            if tuple(cache['key']) == key:
+                envelopes[key] = (cache['Eedges'],cache['Lzedges'],cache['env'])
+        if key not in envelopes:
+            envelopes[key] = buildEnvelope()
+            if cachefile is not None:
+                np.savez(cachefile,key=np.array(key),Eedges=envelopes[key][0],
+                         Lzedges=envelopes[key][1],env=envelopes[key][2])
+    return envelopes[key]
+
+################################################################################
+# Monte Carlo - Batch sampling
+################################################################################
+
+# Draws N candidate (E,Lz) uniformly in the (EMax,LzMax) box and applies the
+# rejection test of getMCqp0. Returns the accepted E and Lz (with units)
+def drawBox(N,rng):
+    gx = 2.*findfMax(EMax,LzMax)*M
+    iLz = LzMax *rng.random_sample(N)
+    iE = EMax *rng.random_sample(N)
+    utest = rng.random_sample(N)
+    ok = utest < findf(iE,iLz)/gx
+    return iE[ok], iLz[ok]
+
+# Draws N candidate (E,Lz) from the tabulated envelope and applies the rejection
+# test against it. Returns the accepted E and Lz (with units) and the number of 
+# candidates that were above the envelope (should always be 0)
+def drawEnvelope(N,rng,cachefile=None):
+    Eedges, Lzedges, env = getEnvelope(cachefile)
+    # Pick cells by their share of the envelope volume, then a point in the cell
+    weight = (env *np.outer(np.diff(Eedges),np.diff(Lzedges))).ravel()
+    cell = np.searchsorted(np.cumsum(weight),weight.sum()*rng.random_sample(N),side='right')
+    cell = np.minimum(cell,len(weight)-1)
+    iEcell, iLzcell = np.unravel_index(cell,env.shape)
+    iE = Eedges[iEcell] + np.diff(Eedges)[iEcell]*rng.random_sample(N)
+    iLz = Lzedges[iLzcell] + np.diff(Lzedges)[iLzcell]*rng.random_sample(N)
+    iE = iE*(u.km/u.s)**2
+    iLz = iLz*u.kpc*u.km/u.s
+    AcceptProb = findAcceptProb(iE,iLz)/env[iEcell,iLzcell]
+    utest = rng.random_sample(N)
+    ok = utest < AcceptProb
+    return iE[ok], iLz[ok], (AcceptProb > 1.).sum()
+
+# Applies the RL, Eran, vran and R cuts of getMCqp0 to accepted (E,Lz) and puts 
+# the stars that pass on their epicycles, exactly as getMCqp0 does
+# Returns an (n,4) array of x0,y0,vx0,vy0 (kpc and km/s)
+def placeStars(iE,iLz,rng):
+    # Cut on guiding center radius
+    RL = (findRL(iLz)/u.kpc).decompose()
+    ok = (RL > 4) & (RL < 12)
+    iLz = iLz[ok]
+    iE = iE[ok]
+    RL = RL[ok]
+    # Cut on random energy and random velocity
+    Eran = findEran(iE,iLz)
+    ok = Eran/(u.km/u.s)**2 > 0
+    Eran = Eran[ok]
+    RL = RL[ok]
+    vran = np.sqrt(2.*Eran)
+    ok = vran < 2.*findVelocityDispersion(3.*Rd)
+    vran = vran[ok]
+    RL = RL[ok]
+    # Place the stars on their epicycles (see getMCqp0)
+    ranglec = 2.*pi *rng.random_sample(len(RL))
+    xc = RL *np.cos(ranglec)
+    yc = RL *np.sin(ranglec)
+    ae = 1./np.sqrt(2.)
+    be = 0.5
+    rangleran = 2.*pi *rng.random_sample(len(RL))
+    xe = ae *np.cos(rangleran)
+    ye = ae *np.sin(rangleran)
+    Rran = np.sqrt(xe**2 + ye**2)
+    vanglerane = np.arctan2(-be**2 *xe, ae**2 *ye)
+    vangleran = vanglerane -(ranglec -pi/2.)
+    x0 = (xc + Rran *np.cos(rangleran -ranglec +pi/2.)).decompose().value
+    y0 = (yc + Rran *np.sin(rangleran -ranglec +pi/2.)).decompose().value
+    vx0 = ((vc *np.cos(ranglec +pi/2.) + vran *np.cos(vangleran))/(u.km/u.s)).decompose().value
+    vy0 = ((vc *np.sin(ranglec +pi/2.) + vran *np.sin(vangleran))/(u.km/u.s)).decompose().value
+    ok = np.sqrt(x0**2 + y0**2) < 15
+    return np.transpose(np.array([x0[ok],y0[ok],vx0[ok],vy0[ok]]))
+
+# Draws n initial conditions at once, from the same distribution as n calls of
+# getMCqp0. Candidate (E,Lz) are drawn in blocks of arrays, the acceptance test
+# and the RL, Eran, vran and R cuts are applied to whole blocks with masks, and 
+# new blocks are drawn until n have been accepted. seed seeds the random numbers
+# method = "box" draws candidates like getMCqp0, method = "envelope" draws them
+# from the tabulated envelope (far fewer candidates are thrown away)
+# Returns an (n,4) array of x0,y0,vx0,vy0 (kpc and km/s), and the acceptance 
+# rate (initial conditions kept per candidate drawn) if return_rate is True
+def sample_initial_conditions(n,seed=None,block=None,method="box",return_rate=False,cachefile=None):
+    if method not in ["box","envelope"]:
+        raise ValueError("Unknown method '%s', use 'box' or 'envelope'" % str(method))
+    rng = np.random.RandomState(seed)
+    qp0s = []
+    nOK = 0
+    nTry = 0
+    nAbove = 0
+    while (nOK < n):
+        # Size the next block from the acceptance rate measured so far
+        if block is not None:
+            nBlock = block
+        elif nOK == 0:
+            nBlock = min(max(100*n,10000),1000000)
+        else:
+            nBlock = min(int(1.2*(n-nOK)*nTry/nOK)+1000,1000000)
+        nTry = nTry + nBlock
+        if method == "box":
+            iE, iLz = drawBox(nBlock,rng)
+        else:
+            iE, iLz, above = drawEnvelope(nBlock,rng,cachefile)
+            nAbove = nAbove + above
+        qp0 = placeStars(iE,iLz,rng)
+        qp0s.append(qp0)
+        nOK = nOK + len(qp0)
+    if nAbove > 0:
+        print("Warning: %i candidates were above the tabulated envelope" % nAbove)
+    qp0s = np.concatenate(qp0s)[:n]
+    if return_rate:
+        return qp0s, float(nOK)/nTry
+    return qp0s
+
+# Checks that the two methods of sample_initial_conditions give the same 
+# distribution: draws n initial conditions with each and runs two-sample 
+# Kolmogorov-Smirnov tests on R, v_R and v_phi
+# Returns the three p-values (values well above ~0.01 mean the samples agree)
+def compareSamplers(n=100000,seed=None):
+    from scipy.stats import ks_2samp
+    rng = np.random.RandomState(seed)
+    qpBox = sample_initial_conditions(n,rng.randint(2**31),method="box")
+    qpEnv = sample_initial_conditions(n,rng.randint(2**31),method="envelope")
+    pvalues = []
+    for qp0s in [qpBox,qpEnv]:
+        R = np.sqrt(qp0s[:,0]**2 + qp0s[:,1]**2)
+        alph = np.arctan2(qp0s[:,3],qp0s[:,2]) - np.arctan2(qp0s[:,1],qp0s[:,0])
+        vtot = np.sqrt(qp0s[:,2]**2 + qp0s[:,3]**2)
+        pvalues.append([R, vtot*np.cos(alph), vtot*np.sin(alph)])
+    return [ks_2samp(pvalues[0][i],pvalues[1][i])[1] for i in range(3)]
+
+# Only write temp_initials when run as a script (server.csh), so that other
+# files can import getMCqp0 without side effects
+if __name__ == "__main__":
+    nRun = 1
+    #starttime = time.time()
+    '''
+    while nRun < NRun+1:
+        AOut = []
+        nOrbit = 1
+        while nOrbit < NOrbit+1:
+            qp0 = getMCqp0()
+            AOut.append([qp0[0],qp0[1],qp0[2],qp0[3],nRun,nOrbit])
+            rangle = np.arctan2(qp0[1],qp0[0])
+            vangle = np.arctan2(qp0[3],qp0[2])
+            alph = vangle - rangle
+            vtot = np.sqrt(qp0[2]**2 + qp0[3]**2)
+            vr = np.round(vtot*np.cos(alph),1)
+            vphi = np.round(vtot*np.sin(alph) - 220.,1)
+            R = np.round(np.sqrt(qp0[0]**2 + qp0[1]**2),1)
+            vran = np.round(np.sqrt(vr**2 +vphi**2),1)
+            print 'R = ',R, '| v_R = ', vr, '| v_phi = ', vphi, '| v_ran = ', vran
+            #print "Orbit # ", nOrbit, "| Run # ", nRun, "| Time Elapsed: ", timer(starttime,time.time()), "| ", round(100.*(float(nRun-1)*float(NOrbit) + (nOrbit-1))/float(NRun*NOrbit),1), "% Finished |"
+            nOrbit = nOrbit+1
+        nRun = nRun +1
+    '''
     AOut = []
-    nOrbit = 1
-    while nOrbit < NOrbit+1:
-        qp0 = getMCqp0()
-        AOut.append([qp0[0],qp0[1],qp0[2],qp0[3],nRun,nOrbit])
-        rangle = np.arctan2(qp0[1],qp0[0])
-        vangle = np.arctan2(qp0[3],qp0[2])
-        alph = vangle - rangle
-        vtot = np.sqrt(qp0[2]**2 + qp0[3]**2)
-        vr = np.round(vtot*np.cos(alph),1)
-        vphi = np.round(vtot*np.sin(alph) - 220.,1)
-        R = np.round(np.sqrt(qp0[0]**2 + qp0[1]**2),1)
-        vran = np.round(np.sqrt(vr**2 +vphi**2),1)
-        print 'R = ',R, '| v_R = ', vr, '| v_phi = ', vphi, '| v_ran = ', vran
-        #print "Orbit # ", nOrbit, "| Run # ", nRun, "| Time Elapsed: ", timer(starttime,time.time()), "| ", round(100.*(float(nRun-1)*float(NOrbit) + (nOrbit-1))/float(NRun*NOrbit),1), "% Finished |"
-        nOrbit = nOrbit+1
-    nRun = nRun +1
-'''
-AOut = []
-qp0 = getMCqp0()
-AOut.append([qp0[0],qp0[1],qp0[2],qp0[3]])
-initials = AOut[0]
-np.savetxt(MasterOutName,initials, delimiter="", fmt="%s", newline=" ")
+    qp0 = getMCqp0()
+    AOut.append([qp0[0],qp0[1],qp0[2],qp0[3]])
+    initials = AOut[0]
+    np.savetxt(MasterOutName,initials, delimiter="", fmt="%s", newline=" ")
@@ -0,0 +1,216 @@
+'''
+Description:
+    This file renders the frames of a matplotlib movie on a pool of worker
+processes and streams them into one encoder, instead of drawing every frame in
+the process that encodes them (as anim.save does). It is used by the movies of
+Animate_Lz, which draw 1000 frames at dpi=300 each.
+    The frames are split into chunks. Each worker builds the figure and the
+animation of a chunk with the same function the movie is made with, and saves
+them with anim.save through FrameWriter, which is the movie writer with the
+encoder swapped for a buffer of raw frames. So the frames are drawn exactly as
+anim.save would draw them, with the figure size, dpi, facecolor and frame format
+of the writer. The raw frames of a chunk come back as the result of its task,
+and the process that started the pool runs the one real writer (one ffmpeg,
+with the writer's own arguments) and feeds it the frames of every chunk in
+order, so the movie is the same file the serial anim.save makes. Nothing goes
+through the disk: at most window chunks (workers+1 by default) of raw frames
+are held at once, a chunk taking chunk*width*height*4 bytes, and chunks are made
+small enough for the window to fit in memory bytes (1 GB by default, at least
+one frame per chunk).
+    FrameWriter and renderMovie use two private parts of the matplotlib movie
+writers (the encoder is started by _run and fed through _proc.stdin). If the
+writer or matplotlib doesn't have them (see canStream), renderMovie saves the
+movie with anim.save in this process instead, and the length of the frames of
+every chunk is checked against the frame size of the writer.
+    The workers are started fresh (the "spawn" start method) where multiprocessing
+has it, so they don't inherit the screen backend of an interactive session
+(e.g. after plt.show()), and draw with Agg; the rcParams of the session are
+passed on to them. Where only fork is available (python 2), the forked workers
+are switched to Agg before they draw. make has to be a function of a module
+(e.g. Animate_Lz.makeHist) so the workers can find it, and every frame must only
+depend on its frame number (as the update functions of Animate_Lz do), since a
+chunk starts drawing at its first frame.
+    checkMovie renders the first frames of a movie both ways, and checks that
+ffmpeg decodes the two movies to the same bytes.
+
+Usage:
+    #make(*args,frames=frames) returns the figure and animation of some frames
+    fig, anim = make(theta)
+    renderMovie(make,(theta,),fig,"movie.mp4",range(nFrames),writer=writer,dpi=300,workers=None)
+    checkMovie(make,(theta,),"check.mp4",range(60),writer=writer,dpi=300)
+'''
+import io
+import os
+import sys
+import collections
+import numpy as np
+from timeit import default_timer
+import matplotlib.animation as animation
+
+# Stands in for the encoder process of FrameWriter: the frames written to stdin
+# are kept in memory, in frames once the writer is done
+class FrameBuffer(object):
+
+    def __init__(self):
+        self.stdin = io.BytesIO()
+        self.args = ["<frames>"]
+        self.returncode = 0
+        self.frames = b""
+
+    def communicate(self):
+        if not self.stdin.closed:
+            self.frames = self.stdin.getvalue()
+            self.stdin.close()
+        return b"", b""
+
+    def wait(self):
+        self.communicate()
+        return 0
+
+# The ffmpeg movie writer, keeping the raw frames it would pipe to ffmpeg in
+# memory instead (self._proc.frames after anim.save)
+class FrameWriter(animation.FFMpegWriter):
+
+    def _run(self):
+        self._proc = FrameBuffer()
+
+# Returns the rcParams of this process that the workers take on (all but the backend)
+def workerParams():
+    import matplotlib
+    return dict((key, value) for key, value in matplotlib.rcParams.items() if not key.startswith("backend"))
+
+# Initializer of the worker processes: draw with Agg, without a screen, and with
+# the rcParams of the process that started them
+def initWorker(params=None):
+    import warnings
+    import matplotlib
+    if "matplotlib.pyplot" in sys.modules:      # forked from a process that has pyplot
+        sys.modules["matplotlib.pyplot"].switch_backend('Agg')
+    else:
+        matplotlib.use('Agg')
+    if params is not None:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            matplotlib.rcParams.update(params)
+
+# Returns a pool of worker processes that draw with Agg (see initWorker)
+def startPool(workers):
+    import multiprocessing
+    if hasattr(multiprocessing,"get_context"):
+        context = multiprocessing.get_context("spawn")
+    else:
+        context = multiprocessing
+    backend = os.environ.get("MPLBACKEND")
+    os.environ["MPLBACKEND"] = "Agg"          # for any pyplot imported before initWorker runs
+    try:
+        return context.Pool(workers,initializer=initWorker,initargs=(workerParams(),))
+    finally:
+        if backend is None:
+            del os.environ["MPLBACKEND"]
+        else:
+            os.environ["MPLBACKEND"] = backend
+
+# Returns True if the frames of writer can be rendered by the workers and fed to
+# it (an ffmpeg writer, of a matplotlib whose writers start the encoder in _run)
+def canStream(writer):
+    return (isinstance(writer,animation.FFMpegWriter) and hasattr(animation.FFMpegWriter,"_run")
+            and hasattr(animation.FFMpegWriter,"grab_frame"))
+
+# Worker of renderMovie: returns the raw frames of one chunk
+def renderChunk(make,args,frames,dpi,fps,codec):
+    import matplotlib.pyplot as plt
+    fig, anim = make(*args,frames=frames)
+    writer = FrameWriter(fps=fps,codec=codec)
+    anim.save("frames.raw",writer=writer,dpi=dpi)
+    plt.close(fig)
+    if not isinstance(getattr(writer,"_proc",None),FrameBuffer):
+        raise RuntimeError("FrameWriter did not capture the frames, this matplotlib starts its movie writers differently")
+    return writer._proc.frames
+
+# Renders a movie on a pool of worker processes
+#   make        make(*args,frames=frames) returns (figure, animation) of some frames
+#   fig         a figure made by make (only its size is used, to set up the writer)
+#   frames      list of the frames of the movie
+#   writer      ffmpeg movie writer (the default one at 30 fps if None)
+#   dpi         as in anim.save (savefig.dpi if None)
+#   workers     number of processes (None uses every core)
+#   chunk       most frames per task
+#   window      chunks rendered or waiting to be encoded at once (workers+1 if None)
+#   memory      bytes of raw frames the window may hold (chunk is lowered to fit)
+# Any module parameters make depends on should be in args, since the workers
+# are started fresh (see Animate_Lz.getParams)
+def renderMovie(make,args,fig,filename,frames,writer=None,dpi=None,workers=None,chunk=20,window=None,memory=2**30):
+    import multiprocessing
+    import matplotlib
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if window is None:
+        window = workers + 1
+    if writer is None:
+        writer = animation.writers['ffmpeg'](fps=30)
+    if dpi is None:
+        dpi = matplotlib.rcParams['savefig.dpi']
+    if dpi == 'figure':
+        dpi = fig.dpi
+    frames = list(frames)
+    if not canStream(writer):
+        print("Can't stream frames into %s, saving the movie with anim.save" % type(writer).__name__)
+        fig, anim = make(*args,frames=frames)
+        anim.save(filename,writer=writer,dpi=dpi)
+        return
+    width, height = [int(size*dpi) for size in fig.get_size_inches()]
+    chunk = max(1,min(chunk,memory//(window*width*height*4)))
+    chunks = [frames[i:i+chunk] for i in range(0,len(frames),chunk)]
+    pool = startPool(workers)
+    start = default_timer()
+    try:
+        with writer.saving(fig,filename,dpi):
+            stdin = getattr(getattr(writer,"_proc",None),"stdin",None)
+            if stdin is None:
+                raise RuntimeError("%s has no encoder to feed, this matplotlib starts its movie writers differently" % type(writer).__name__)
+            frameBytes = 4*int(np.prod(writer.frame_size))
+            pending = collections.deque()
+            done = 0
+            for j, part in enumerate(chunks):
+                task = (make,args,part,dpi,writer.fps,writer.codec)
+                pending.append((len(part),pool.apply_async(renderChunk,task)))
+                while len(pending) >= window or (j == len(chunks)-1 and len(pending) > 0):
+                    n, result = pending.popleft()
+                    data = result.get()
+                    if len(data) != n*frameBytes:
+                        raise RuntimeError("A chunk of %i frames came back with %i bytes, not %i" % (n,len(data),n*frameBytes))
+                    stdin.write(data)
+                    done = done + n
+                    print("Rendered %i/%i frames, %.1f s" % (done,len(frames),default_timer() - start))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+# Returns the frames of a movie file as decoded by ffmpeg (raw rgb24 bytes)
+def decodeFrames(filename):
+    import subprocess
+    import matplotlib
+    return subprocess.check_output([matplotlib.rcParams['animation.ffmpeg_path'],'-loglevel','error',
+                                    '-i',filename,'-f','rawvideo','-pix_fmt','rgb24','-'])
+
+# Saves the frames of a short clip with anim.save (into <filename>_serial) and
+# with renderMovie (into filename, chunk frames per task so every worker gets
+# some), and returns True if ffmpeg decodes the two movies to the same bytes
+# (the arguments are the same as those of renderMovie)
+def checkMovie(make,args,filename,frames,writer=None,dpi=None,workers=None,chunk=5):
+    import matplotlib.pyplot as plt
+    if writer is None:
+        writer = animation.writers['ffmpeg'](fps=30)
+    frames = list(frames)
+    root, ext = os.path.splitext(filename)
+    serial = root + "_serial" + ext
+    fig, anim = make(*args,frames=frames)
+    anim.save(serial,writer=writer,dpi=dpi)
+    renderMovie(make,args,fig,filename,frames,writer=writer,dpi=dpi,workers=workers,chunk=chunk)
+    plt.close(fig)
+    same = decodeFrames(serial) == decodeFrames(filename)
+    print("Decoded frames of %s and %s are %s" % (serial,filename,"the same" if same else "different"))
+    return same
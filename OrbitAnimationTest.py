@@ -2,15 +2,7 @@ import numpy as np
 from matplotlib import animation
 import Orbit_Code 
 reload(Orbit_Code)
-
-def parseFilename(filename):
-   
-    parts = filename.split("=")
-    args = []
-    for l in range(1, len(parts)):
-        num = float(parts[l].split(")")[0])
-        args.append(num)
-    return args
+from Orbit_Manifest import parseFilename
     
 filepath = "C:/Users/Noah/Documents/GitHub/Trapped_Orbital_Integrator/qp_file/"
 
@@ -33,9 +33,42 @@ Constructor:
     
 Public (Callable) Methods:
     
-    --makeOrbit(self)
+    --makeOrbit(self, backend, scheme, stepTime, tol)
         -calculates the orbit
-        -creates global numpy arrays for qp and qpR
+        -backend = "numpy" (default) or "jit" (compiled with numba, cached on disk)
+        -scheme = "leapfrog" (default), "verlet", "yoshida4" ("forestruth"), "yoshida6" or "adaptive"
+        -stepTime = step in years, tol = error per step of "adaptive"
+        -force = "analytic" (default) or "grid" (spiral force read from a table saved on disk)
+        -outputTime = years between stored states, out = array/memmap/.npy filename to write qp into
+        -creates the numpy array qp (qpR is calculated from it when first needed)
+    --makeEnsemble(self, qp0s, backend, scheme, stepTime, tol, force, outputTime)
+        -calculates the orbits of N stars in this spiral at once
+        -qp0s is an (N,4) array of x0,y0,vx0,vy0 (e.g. stacked getMCqp0 outputs)
+        -returns an (N,steps,5) numpy array, one qp per star (steps = getOutputLength)
+    --streamEnsemble(self, qp0s, reducers, backend, scheme, stepTime, tol, force, block, outputTime)
+        -calculates the orbits of N stars like makeEnsemble, block steps at a time,
+         without keeping them
+        -reducers (see Orbit_Reducers) keep Lam_special, Lz, E_j drift, etc. as it goes
+        -returns a dict of the results of the reducers
+    --streamOrbit(self, reducers, backend, scheme, stepTime, tol, force, block, outputTime)
+        -streamEnsemble for the star of this orbit, e.g. to find the times it is
+         trapped, escapes and crosses the resonances (Orbit_Reducers.Events)
+        
+    --checkKernel(self, N)
+        -compares the unit-free force kernel with the astropy version of __dvdt
+        -returns the largest relative difference (expected below 1e-12)
+        
+    --checkGrid(self, N)
+        -compares the grid force (force="grid") with the analytic kernel
+        -returns the largest relative difference (about 1e-8)
+        
+    --checkPhys(self)
+        -compares the unit-free findLam values of qp with the astropy version
+        -returns the largest relative difference (expected below 1e-12)
+        
+    --getOutputLength(self, scheme, stepTime, outputTime)
+        -returns the number of rows of the qp makeOrbit and makeEnsemble make (to size an out array)
+        
     --getqp(self)
         -returns numpy array qp
         
@@ -45,6 +78,14 @@ Public (Callable) Methods:
     --saveData(self)  
         -save qp to a file in a designated filepath 
         
+    --checkRframe(self)
+        -compares qpR and findRg with their astropy versions (expected below 1e-12)
+        
+    --findLam(self), Lam_special(self), findLz(self), find_All_Lz(self), findRg(self)
+        -lambda and the other findPhys values, the trapped classification, Lz at
+         5 times, Lz at every step and the guiding center in the rotating frame
+        -Orbit_Ensemble.OrbitEnsemble does the same for many orbits at once
+        
     --plot(self, plotOption)
         -plots the orbit
         -if plotOption == 0, plots in the non-rotating frame
@@ -67,11 +108,11 @@ _______________________________________________________________________________
 import astropy.units as u
 import astropy.constants as const
 import numpy as np
-from scipy import interpolate
-import matplotlib.pyplot as plt
 from timeit import default_timer
 from numpy import arange
 from numpy import meshgrid
+import Orbit_Kernel
+import Orbit_Metrics
 
 ################################################################################
 # Defining some constants
@@ -88,6 +129,156 @@ vc = 220 *u.km /u.s             # Circular velocity of the disk
 RSun = 8 *u.kpc                 # Solar galactocentric radius
 SigmaSun = 50 *u.Msun /u.pc**2  # Surface density at the solar radius
 Rd = 2.5 *u.kpc                 # Scale length of the disk 
+
+################################################################################
+# Units boundary for the unit-free kernel in Orbit_Kernel
+################################################################################
+
+# Folds every model constant (m, theta, CR, epsilon, vc, Rd, SigmaSun) into the
+# plain float tuple used by Orbit_Kernel (see its docstring for the layout)
+# Arguments take the same implicit units as the Orbit_Calculator constructor
+# Every tuple is kept in kernels, so a run of orbits with the same spiral only
+# goes through astropy once
+kernels = {}
+def findKernel(m1,theta1,CR1,epsilon1):
+    key = (float(m1),float(theta1),float(CR1),float(epsilon1))
+    if key not in kernels:
+        kernels[key] = findKernelUnits(m1,theta1,CR1,epsilon1)
+    return kernels[key]
+
+def findKernelUnits(m1,theta1,CR1,epsilon1):
+    mk = float(int(m1))
+    alphak = mk/np.tan(theta1*u.degree)
+    CRk = CR1*u.kpc
+    Omega = ((vc/CRk)*u.yr).decompose()
+    Sigma0 = SigmaSun *np.exp(RSun/Rd)
+    Acoef = (2. *pi *G *Sigma0 *epsilon1/alphak).to((u.km/u.s)**2/u.kpc)
+    return (mk, float(alphak), float(CR1), float(Rd/u.kpc), float(Omega),
+            float((vc**2)/((u.km/u.s)**2)), float(Acoef.value))
+
+# Returns the module holding the integration functions for a backend
+# "numpy" is the plain python kernel, "jit" is the numba-compiled copy of it
+# (Orbit_Jit is only imported here, so numba is needed for the jit backend only)
+def findBackend(backend):
+    if backend == "numpy":
+        return Orbit_Kernel
+    elif backend == "jit":
+        import Orbit_Jit
+        return Orbit_Jit
+    raise ValueError("Unknown backend '%s', use 'numpy' or 'jit'" % str(backend))
+
+# Integration schemes of makeOrbit and makeEnsemble, besides the original 
+# "leapfrog" (which stays the default, so old runs are reproduced exactly) and 
+# "adaptive" (error-controlled yoshida4 steps), as the substep weights of 
+# Orbit_Kernel.composestep 
+schemes = {"verlet": Orbit_Kernel.verlet,         # 2nd order
+           "yoshida4": Orbit_Kernel.yoshida4,     # 4th order
+           "forestruth": Orbit_Kernel.yoshida4,   # Forest-Ruth is the same 4th order scheme
+           "yoshida6": Orbit_Kernel.yoshida6}     # 6th order
+
+# Raises an error if makeOrbit or makeEnsemble can't integrate with a scheme
+def checkScheme(scheme):
+    if scheme not in ("leapfrog","adaptive") and scheme not in schemes:
+        raise ValueError("Unknown scheme '%s', use 'leapfrog', 'adaptive' or one of %s" % (str(scheme),", ".join(sorted(schemes))))
+
+# Returns the integration functions and kernel tuple for a backend and force mode
+# force = "analytic" works out the force from the formulas at every step (exact),
+# force = "grid" reads the spiral force from a table made once per spiral and 
+# saved on disk (see Orbit_Grid, accurate to about 1e-8)
+def findIntegrator(backend,force):
+    if force == "analytic":
+        return findBackend(backend), kernel
+    elif force == "grid":
+        findBackend(backend)                    # Checks the backend
+        import Orbit_Grid
+        return Orbit_Grid.findGridIntegrator(backend), Orbit_Grid.findGridKernel(kernel)
+    raise ValueError("Unknown force '%s', use 'analytic' or 'grid'" % str(force))
+
+# Integrates one star from x,y,vx,vy over the times T1 into the (len(T1),5) array
+# qp with a scheme, the integration functions of a backend and the kernel tuple k
+# (see findIntegrator), dt = step in seconds (the first step for "adaptive", 
+# whose error per step is kept below tol)
+# "leapfrog" takes one step of dt per time in T1 and stores the state after each
+# step, the other schemes store the state at each time in T1 (qp[0] = initial)
+# With every > 1 only every every-th of those states is stored (qp then has
+# ceil(len(T1)/every) rows), the steps stay the same
+# Returns the number of force evaluations (also counted by Orbit_Metrics, with
+# the number of output steps)
+def integrateScheme(integrator,k,x,y,vx,vy,T1,qp,scheme,dt,tol,every=1):
+    checkScheme(scheme)
+    if scheme == "leapfrog":
+        if every == 1:
+            integrator.integrate(x,y,vx,vy,T1,dt,k,qp)
+        else:
+            integrator.integrateEvery(x,y,vx,vy,T1,dt,k,qp,every)
+        nEval = 2*len(T1)
+    elif scheme == "adaptive":
+        nEval = integrator.integrateAdaptive(x,y,vx,vy,T1[::every],dt,k,qp,tol)
+    else:
+        nEval = integrator.integrateComposed(x,y,vx,vy,T1[::every],dt,k,qp,schemes[scheme])
+    Orbit_Metrics.count("steps",len(qp))
+    Orbit_Metrics.count("forceEvals",nEval)
+    return nEval
+
+# Returns the times makeOrbit steps through (leapfrog, one step per time) or 
+# stores at (the other schemes, any number of steps between two times), the step
+# dt in seconds, and how many of those times there are per output (see 
+# integrateScheme), from stepTime and outputTime in years (StepTime if None)
+# The leapfrog times are T unless stepTime is given, and outputTime is rounded 
+# to a whole number of them
+# Raises an error if the step of a fixed step scheme (verlet, yoshida4, ...) is
+# longer than the time between two stored states, which it can't step past
+def findTimes(scheme,stepTime=None,outputTime=None):
+    if stepTime is None:
+        T1, dt = T, StepSeconds
+    elif scheme == "leapfrog":
+        T1 = np.linspace(0,float(IntTimeUnitless),int(np.rint(float(IntTimeUnitless)/float(stepTime))))
+        dt = float(stepTime)*Orbit_Kernel.yr2sec
+    else:
+        T1, dt = T, float(stepTime)*Orbit_Kernel.yr2sec
+    every = 1 if outputTime is None else max(1,int(np.rint(float(outputTime)/(T1[1] - T1[0]))))
+    if scheme in schemes and stepTime is not None and float(stepTime) > every*(T1[1] - T1[0])*(1. + 1e-9):
+        raise ValueError("stepTime of %s years is longer than the %s years between stored states, use a larger outputTime"
+                         % (str(stepTime),str(every*(T1[1] - T1[0]))))
+    return T1, dt, every
+
+# Integrates the stars qp0s (N,4) over the times T1 into the (N,len(T1),5) array
+# qps, like integrateScheme does for one star (and like it, with every > 1 only 
+# stores every every-th state, qps then being (N,ceil(len(T1)/every),5)). With 
+# the numpy backend and a fixed step scheme every star is advanced at once, so 
+# the python loop runs once per step rather than once per star; with backend = 
+# "jit" (or scheme = "adaptive", whose steps differ from star to star) each star
+# runs through the loop in turn
+def integrateStars(integrator,k,qp0s,T1,qps,scheme,dt,tol,backend,every=1):
+    checkScheme(scheme)
+    if backend == "jit" or scheme == "adaptive":
+        for j in range(len(qp0s)):
+            integrateScheme(integrator,k,qp0s[j,0],qp0s[j,1],qp0s[j,2],qp0s[j,3],T1,qps[j],scheme,dt,tol,every)
+    elif scheme == "leapfrog":
+        qpnow = np.transpose(qp0s[:,0:4])
+        for i in range(len(T1)):
+            qpnow = integrator.leapstep(qpnow[0],qpnow[1],qpnow[2],qpnow[3],T1[i],dt,k)
+            if i % every == 0:
+                qps[:,i//every,0:4] = np.transpose(qpnow)
+                qps[:,i//every,4] = T1[i]
+        Orbit_Metrics.count("steps",len(qp0s)*((len(T1) + every - 1)//every))
+        Orbit_Metrics.count("forceEvals",2*len(qp0s)*len(T1))
+    else:
+        T1 = T1[::every]
+        qpnow = np.transpose(qp0s[:,0:4])
+        qps[:,0,0:4] = qp0s[:,0:4]
+        qps[:,0,4] = T1[0]
+        for i in range(1,len(T1)):
+            span = (T1[i] - T1[i-1])*Orbit_Kernel.yr2sec
+            n = max(1,int(np.rint(span/dt)))
+            t = T1[i-1]
+            for j in range(n):
+                x, y, vx, vy, t = integrator.composestep(qpnow[0],qpnow[1],qpnow[2],qpnow[3],t,span/n,k,schemes[scheme])
+                qpnow = np.array([x,y,vx,vy])
+            qps[:,i,0:4] = np.transpose(qpnow)
+            qps[:,i,4] = T1[i]
+            Orbit_Metrics.count("forceEvals",len(qp0s)*n*len(schemes[scheme]))
+        Orbit_Metrics.count("steps",len(qp0s)*len(T1))
   
 
 class Orbit_Calculator(object):
@@ -116,6 +307,8 @@ class Orbit_Calculator(object):
         global T
         global OmegaCR
         global theta 
+        global kernel
+        global StepSeconds
         
         #Assign global variables
         m = int(m1)
@@ -133,7 +326,9 @@ class Orbit_Calculator(object):
         StepTime = 100000.*u.yr                          #Time between each calculation   
         IntTimeUnitless = (IntTime/u.yr).decompose()     #Simulation time
         NSteps = np.rint((IntTime/StepTime).decompose()) #Integer number of total steps to take
-        T = np.linspace(0,IntTimeUnitless,NSteps)        #Time values
+        T = np.linspace(0,float(IntTimeUnitless),NSteps) #Time values (plain floats for the kernel)
+        StepSeconds = float((StepTime/u.yr).decompose())*Orbit_Kernel.yr2sec #Unitless step for the kernel
+        kernel = findKernel(m1,theta1,CR1,epsilon1)      #Unitless model constants for the kernel
         
         self.__findalpha()
         self.__findhcr()
@@ -182,8 +377,14 @@ class Orbit_Calculator(object):
 #Private Calculation Methods
 ################################################################################    
 
-# Calculates the acceleration in this potential at coordinate x-y
-    def __dvdt(self,qp,tnow):         
+# Calculates the acceleration (km/s^2) in this potential at coordinate x-y
+# All of the work is done by the unit-free Orbit_Kernel.accel
+    def __dvdt(self,qp,tnow):
+        return np.array(Orbit_Kernel.accel(qp[0],qp[1],tnow,kernel))
+        
+# Reference version of __dvdt that carries astropy units through every step
+# It is much slower and only kept to check the kernel against (see checkKernel)
+    def __dvdtUnits(self,qp,tnow):         
         
         x = qp[0] *u.kpc
         y = qp[1] *u.kpc
@@ -202,49 +403,25 @@ class Orbit_Calculator(object):
         dvxS = dvSFront *(m*y + var2*x)
         dvyS = dvSFront *(-m*x + var2*y)
     
-        # Find total acceleration
-        dvxdt = ((dvxD + dvxS)/(u.km /u.s**2))
-        dvydt = ((dvyD + dvyS)/(u.km /u.s**2))
+        # Find total acceleration (decomposed so arrays of stars drop their units correctly)
+        dvxdt = ((dvxD + dvxS)/(u.km /u.s**2)).decompose()
+        dvydt = ((dvyD + dvyS)/(u.km /u.s**2)).decompose()
         return np.array([dvxdt,dvydt])
                      
-# Perform a single leapstep (t+dt), using kick-drift-kick method
-    def __leapstep(self,qpnow,tnow): 
-        
-        dt = (StepTime/u.year)*3.15576e+07 #convert to seconds/remove units
-        x = qpnow[0]
-        y = qpnow[1]
-        vx = qpnow[2]
-        vy = qpnow[3]
-        # Note: x and y are in kpc, vx and vy are in km/s
-        
-        a = self.__dvdt(qpnow,tnow)      # Find acceleration at this coordinate
-        vx = vx -0.5 *dt *a[0]           # Advance v_x by half step
-        vy = vy -0.5 *dt *a[1]           # Advance v_y by half step
-        x = x +(dt*vx*3.24077928947e-17) # Advance x by full step, while converting v*dt from km to kpc
-        y = y +(dt*vy*3.24077928947e-17) # Advance y by full step, while converting v*dt from km to kpc
-        # x and y are in kpc, vx and vy are in km/s
-        
-        qpmid = np.array([x,y,vx,vy])
-        a  = self.__dvdt(qpmid,tnow)     # Find a at new position and complete the velocity step
-        vx = vx -0.5 *dt *a[0]           # Complete v_x step
-        vy = vy -0.5 *dt *a[1]           # Complete v_y step
-        
-        return np.array([x,y,vx,vy,tnow]) 
-        
 # Helper function to plot the spiral arms, arm points calcualted in polar 
 # coordinates and then converted to rectangular for plotting  
     def __plotArms(self,ax):
-        
-        points = 20                     #Number of points of each arm to plot
-        radius = np.zeros(points)       #empty array for arm radii
-        t = np.linspace(pi/24,pi/2+pi/16,points)  #array of angles 
-        for i in xrange(0,m):
-            radius = (CR/u.kpc)*np.exp((-m*(t)+np.pi)/alpha)
-            ax.plot(radius*np.cos(t+2*np.pi*i/m),radius*np.sin(t+2*np.pi*i/m), color="purple",ls='dotted')   
+        import Orbit_Overlay
+        Orbit_Overlay.drawArms(ax,kernel)
         return
           
 # Convert coordinates from non-rotating frame to rotating frame
     def __toRframe(self,qpl):  
+        return np.transpose(np.array(Orbit_Kernel.toRframe(qpl[:,0],qpl[:,1],qpl[:,2],qpl[:,3],qpl[:,4],kernel)))
+
+# Reference version of __toRframe that carries astropy units through every step
+# (only kept to check the kernel against, see checkRframe)
+    def __toRframeUnits(self,qpl):  
         
         # Pull out cartesian non-rotating info
         x = qpl[:,0]
@@ -277,25 +454,217 @@ class Orbit_Calculator(object):
 ################################################################################  
     
 # Calls the previously defined functions to calculate the orbit in both frames  
-    def makeOrbit(self):
+# backend = "numpy" runs the kernel in python, backend = "jit" runs it compiled
+# scheme = "leapfrog" (default), "verlet", "yoshida4"/"forestruth", "yoshida6" or
+# "adaptive" (see integrateScheme), stepTime = step in years (StepTime if None),
+# tol = error per step of "adaptive", force = "analytic" or "grid" (see 
+# findIntegrator)
+# outputTime = years between the states stored in qp (StepTime if None), so a 
+# small stepTime doesn't have to mean a large qp (see findTimes)
+# out = where qp is written: None for a new array, a (rows,5) array (e.g. a 
+# memmap) or the filename of a .npy file that is made as a memmap of the right
+# size (rows = getOutputLength(scheme,stepTime,outputTime))
+# The number of force evaluations is kept in self.nEval
+    def makeOrbit(self,backend="numpy",scheme="leapfrog",stepTime=None,tol=1e-10,force="analytic",outputTime=None,out=None):
         
         start = default_timer()
     
-        qp0 = np.array([x0,y0,vx0,vy0,T[0]])
-        self.qp = np.zeros(shape=(len(T),5))
-        self.qp[0] = qp0
-        print "Steps: %s" %str(NSteps)
-        for i in range(len(T)):
-            qpstep = qp0 = self.__leapstep(qp0,T[i])
-            self.qp[i] = qpstep
-            
-        global qpR
-        qpR =  self.__toRframe(self.qp) 
+        integrator, k = findIntegrator(backend,force)
+        T1, dt, every = findTimes(scheme,stepTime,outputTime)
+        rows = (len(T1) + every - 1)//every
+        if out is None:
+            out = np.zeros(shape=(rows,5))
+        elif isinstance(out,basestring):
+            out = np.lib.format.open_memmap(out,mode='w+',dtype=float,shape=(rows,5))
+        elif out.shape != (rows,5):
+            raise ValueError("out has shape %s, makeOrbit needs %s" % (str(out.shape),str((rows,5))))
+        print "Steps: %s Stored: %s" %(str(len(T1)),str(rows))
+        self.nEval = integrateScheme(integrator,k,float(x0),float(y0),float(vx0),float(vy0),T1,out,scheme,dt,tol,every)
+        self.qp = out
           
         duration = default_timer() - start 
         print "time: %s s" % str(duration)
         return
 
+# Calculates the orbits of a whole ensemble of stars in this spiral
+# qp0s is an (N,4) array of initial x,y,vx,vy (the x0,y0,vx0,vy0 given to the 
+# constructor are ignored), see integrateStars for how the stars are advanced
+# Returns an (N,getOutputLength(scheme,stepTime,outputTime),5) array holding the
+# qp of each star
+# scheme, stepTime, tol, force and outputTime are the same as in makeOrbit (see
+# findTimes), so each star gets the qp makeOrbit would give it
+    def makeEnsemble(self,qp0s,backend="numpy",scheme="leapfrog",stepTime=None,tol=1e-10,force="analytic",outputTime=None):
+        
+        start = default_timer()
+        
+        integrator, k = findIntegrator(backend,force)
+        checkScheme(scheme)
+        T1, dt, every = findTimes(scheme,stepTime,outputTime)
+        rows = (len(T1) + every - 1)//every
+        qp0s = np.atleast_2d(qp0s).astype(float)
+        qps = np.zeros(shape=(len(qp0s),rows,5))
+        print "Stars: %s Steps: %s Stored: %s" %(str(len(qp0s)),str(len(T1)),str(rows))
+        integrateStars(integrator,k,qp0s,T1,qps,scheme,dt,tol,backend,every)
+            
+        duration = default_timer() - start 
+        print "time: %s s" % str(duration)
+        return qps
+
+# Calculates the orbits of an ensemble of stars like makeEnsemble, but without 
+# keeping them: the stars are integrated block steps at a time into one reused
+# (N,block,5) buffer, and each block is handed to the reducers (see 
+# Orbit_Reducers), which keep only what they need of it
+# reducers = list of Orbit_Reducers objects (Orbit_Reducers.tableReducers() if None)
+# Returns the results of all of the reducers merged into one dict, along with
+# "nSteps", the number of stored states each star was integrated for (less than
+# getOutputLength for the stars a reducer stopped early, e.g.
+# Orbit_Reducers.Events(stopFree))
+# scheme, stepTime, tol, force and outputTime are the same as in makeEnsemble,
+# and the reducers see the states makeEnsemble would store
+# Memory grows with N*block rather than N*steps, and the results are the same
+# as those of makeEnsemble followed by findLam, Lam_special, findLz, etc. (for
+# "adaptive" up to tol, since its step size starts again from stepTime each block)
+# The stars a reducer asks for at the end (rerun, e.g. the always trapped stars
+# of Orbit_Reducers.TrappedSums) are streamed a second time
+    def streamEnsemble(self,qp0s,reducers=None,backend="numpy",scheme="leapfrog",stepTime=None,tol=1e-10,force="analytic",block=1000,outputTime=None):
+        import Orbit_Reducers
+        
+        start = default_timer()
+        
+        integrator, k = findIntegrator(backend,force)
+        checkScheme(scheme)
+        T2, dt, every = findTimes(scheme,stepTime,outputTime)
+        if scheme != "leapfrog":
+            # The other schemes step between the times they store at by themselves
+            T2, every = T2[::every], 1
+        rows = (len(T2) + every - 1)//every
+        # A leapfrog block is a whole number of output intervals, integrated 
+        # every step and then thinned to the stored states
+        block = max(every,(block//every)*every)
+        if reducers is None:
+            reducers = Orbit_Reducers.tableReducers()
+        qp0s = np.atleast_2d(qp0s).astype(float)
+        N = len(qp0s)
+        print "Stars: %s Steps: %s Stored: %s Block: %s" %(str(N),str(len(T2)),str(rows),str(block))
+        for reducer in reducers:
+            reducer.start(N,rows,kernel)
+        # The other schemes store the starting state as their first row, so each
+        # block after the first starts again at the last time of the one before
+        overlap = 0 if scheme == "leapfrog" else 1
+        buf = np.zeros(shape=(N,block+overlap,5))
+        stars = np.arange(N)                    # Stars still being integrated
+        nSteps = np.zeros(N,dtype=int)
+        qpnow = qp0s[:,0:4]
+        Ej0 = None
+        for i0 in range(0,len(T2),block):
+            i1 = min(i0 + block,len(T2))
+            if i0 == 0 or overlap == 0:
+                T1 = T2[i0:i1]
+                qps = buf[0:len(stars),0:i1-i0]
+            else:
+                T1 = T2[i0-1:i1]
+                qps = buf[0:len(stars),0:i1-i0+1]
+            integrateStars(integrator,k,qpnow,T1,qps,scheme,dt,tol,backend)
+            qpnow = qps[:,-1,0:4].copy()
+            if i0 > 0 and overlap == 1:
+                qps = qps[:,1:]
+            qps = qps[:,::every]
+            phys = Orbit_Kernel.findPhys(qps[:,:,0],qps[:,:,1],qps[:,:,2],qps[:,:,3],qps[:,:,4],kernel,
+                                         None if Ej0 is None else Ej0[stars])
+            if Ej0 is None:
+                Ej0 = phys[1][:,0:1].copy()
+            for reducer in reducers:
+                reducer.update(i0//every,qps,phys,stars)
+            nSteps[stars] = (i1 + every - 1)//every
+            # Leave out the stars the reducers are done with (see Orbit_Reducers.Events)
+            done = np.zeros(len(stars),dtype=bool)
+            for reducer in reducers:
+                if hasattr(reducer,"isDone"):
+                    done |= reducer.isDone(stars)
+            if done.any():
+                stars = stars[~done]
+                qpnow = qpnow[~done]
+                if len(stars) == 0:
+                    break
+        summary = {"nSteps": nSteps}
+        for reducer in reducers:
+            summary.update(reducer.finish())
+        # Integrate again the stars a reducer could only pick out at the end (see
+        # Orbit_Reducers.TrappedSums)
+        for reducer in reducers:
+            if hasattr(reducer,"rerun"):
+                again, more = reducer.rerun()
+                if len(again) > 0:
+                    rerun = self.streamEnsemble(qp0s[again],more,backend,scheme,stepTime,tol,force,block,outputTime)
+                    summary.update(reducer.finishRerun(rerun))
+            
+        duration = default_timer() - start 
+        print "time: %s s" % str(duration)
+        return summary
+
+# Calculates the orbit from x0,y0,vx0,vy0 with streamEnsemble, without keeping qp
+# Returns the results of the reducers as an ensemble of one star (e.g. "lamsp" 
+# is an array of length 1), with Orbit_Reducers.Events() its event table of the
+# times it is trapped, escapes and crosses the resonances
+    def streamOrbit(self,reducers=None,backend="numpy",scheme="leapfrog",stepTime=None,tol=1e-10,force="analytic",block=1000,outputTime=None):
+        return self.streamEnsemble([[float(x0),float(y0),float(vx0),float(vy0)]],reducers,backend,scheme,stepTime,tol,force,block,outputTime)
+
+# Compares the unit-free kernel with the astropy reference at N random positions
+# between 1 and 15 kpc over one spiral pattern period, returns the largest 
+# relative difference in the acceleration. The kernel folds the constants in a 
+# different order than astropy does, so the two agree to rounding: the result is
+# expected to stay below 1e-12 
+    def checkKernel(self,N=1000):
+        R = 1. + 14.*np.random.random(N)
+        phi = 2.*pi*np.random.random(N)
+        tnow = 2.*pi*np.random.random(N)/kernel[4]
+        qp = np.array([R*np.cos(phi),R*np.sin(phi)])
+        a = self.__dvdt(qp,tnow)
+        aUnits = self.__dvdtUnits(qp,tnow)
+        return np.max(np.abs(a - aUnits)/np.sqrt(aUnits[0]**2 + aUnits[1]**2))
+
+# Compares the grid force (force="grid", see Orbit_Grid) with the analytic kernel
+# at N random positions between 1 and 15 kpc, returns the largest difference 
+# relative to the acceleration (about 1e-8 with the default grid)
+    def checkGrid(self,N=1000):
+        import Orbit_Grid
+        return Orbit_Grid.checkGrid(kernel,N)
+
+# qp is a property so that setting it (makeOrbit, setqp or directly) throws away
+# everything calculated from the previous qp: qpR and the findLam values
+    @property
+    def qp(self):
+        return self.__qp
+        
+    @qp.setter
+    def qp(self,qps):
+        self.__qp = qps
+        self.__qpR = None
+        self.__phys = None
+        
+# qpR is only calculated from qp the first time it is needed
+    @property
+    def qpR(self):
+        if self.__qpR is None:
+            self.__qpR = self.__toRframe(self.qp)
+        return self.__qpR
+
+# Compares the findLam values of the current qp with the astropy reference,
+# returns the largest difference relative to the largest value of each quantity
+# (expected below 1e-12, like checkKernel)
+    def checkPhys(self):
+        phys = self.findLam()
+        physUnits = self.__findPhysUnits()
+        return np.max(np.abs(phys - physUnits)/np.max(np.abs(physUnits),axis=1)[:,np.newaxis])
+
+# Compares qpR and findRg of the current qp with the astropy references, returns
+# the largest difference relative to the largest value of each quantity
+# (expected below 1e-12, like checkPhys)
+    def checkRframe(self):
+        qpR = np.vstack((np.transpose(self.qpR),self.findRg()))
+        qpRUnits = np.vstack((np.transpose(np.array(self.__toRframeUnits(self.qp),dtype=float)),self.__findRgUnits()))
+        return np.max(np.abs(qpR - qpRUnits)/np.max(np.abs(qpRUnits),axis=1)[:,np.newaxis])
+
 # Returns qp                 
     def getqp(self):
         return self.qp
@@ -307,11 +676,16 @@ class Orbit_Calculator(object):
 # Returns NSteps                 
     def getNSteps(self):
         return NSteps
+
+# Returns the number of rows of the qp makeOrbit (and of each star of makeEnsemble)
+# makes with these arguments
+    def getOutputLength(self,scheme="leapfrog",stepTime=None,outputTime=None):
+        T1, dt, every = findTimes(scheme,stepTime,outputTime)
+        return (len(T1) + every - 1)//every
         
 # Sets qp                 
     def setqp(self,qps):
         self.qp = qps
-        self.qpR = self.__toRframe(self.qp)
         return
         
 # Saves data from non-rotating frame in dump file  
@@ -326,6 +700,8 @@ class Orbit_Calculator(object):
 # For plot of orbit in non-rotating frame, enter 0 as the plot option
 # For plot of orbit in rotating frame, enter 1 as the plot option (recomended)
     def plot(self,plotOption):
+        import matplotlib.pyplot as plt   #imported here so that using the class without plotting doesn't load matplotlib
+        import Orbit_Overlay
         
         plt.close('all')         #close old plots still up
         
@@ -336,49 +712,18 @@ class Orbit_Calculator(object):
         plt.axis([-20,20,-20,20])
         ax.set_aspect('equal', 'datalim')
         
-        #calculate Lindlbad Resonance radii
-        R_1o = (m+np.sqrt(2))*vc/(m*OmegaCR)
-        R_1i = (m-np.sqrt(2))*vc/(m*OmegaCR)
-        #calculate ultraharmonic resonance radii
-        R_2o = ((2*m)+np.sqrt(2))*vc/((2*m)*OmegaCR)
-        R_2i = ((2*m)-np.sqrt(2))*vc/((2*m)*OmegaCR)
-        #plot the lindblad radii
-        lind1 = plt.Circle((0,0), (R_1o/u.kpc), color='g', fill=False,ls = 'dashed')
-        lind2 = plt.Circle((0,0), (R_1i/u.kpc), color='g', fill=False,ls = 'dashed')
-        lind1uh = plt.Circle((0,0), (R_2o/u.kpc), color='g', fill=False,ls = 'dotted')
-        lind2uh = plt.Circle((0,0), (R_2i/u.kpc), color='g', fill=False,ls = 'dotted')
-        ax.add_patch(lind1)
-        ax.add_patch(lind2)
-        ax.add_patch(lind1uh)
-        ax.add_patch(lind2uh)
+        #plot the Lindblad and ultraharmonic resonance radii
+        Orbit_Overlay.drawResonances(ax,kernel)
         
         self.__plotArms(ax)
         plt.show()
         
         #Plot corotation radius
-        circ = plt.Circle((0,0), (CR/u.kpc), color='g', fill=False) #plotting CR radius
-        ax.add_patch(circ)
+        Orbit_Overlay.drawCorotation(ax,kernel)
         
-        #Plot the capture region
+        #Plot the capture region (contoured once per spiral and figure resolution, see Orbit_Overlay)
         if plotOption != 0:
-            delta = 0.025
-            x_range = arange(-13.0, 13.0, delta)
-            y_range = arange(-13.0, 13.0, delta)
-            X, Y = meshgrid(x_range,y_range)
-            R = np.sqrt((X**2) + (Y**2))
-            phi = np.arctan2(Y,X)
-            #find Phi_eff_min
-            A_CR = self.__findA(CR).to((u.km/u.s)**2)
-            phi_min = (hcr - A_CR)/((u.km/u.s)**2)
-            phi_max = (hcr + A_CR)/((u.km/u.s)**2)
-            #defining the contour equation
-            A = self.__findA(R*u.kpc).to((u.km/u.s)**2)
-            spiral_potential = A*np.cos(-alpha*np.log(R*u.kpc/CR)*u.rad -m*phi*u.rad)
-            disk_potential = (vc**2)*np.log(R)
-            potential = spiral_potential + disk_potential
-            func = (0.5*(OmegaCR**2)*(CR**2) - (OmegaCR**2)*CR*(R*u.kpc) + potential)/((u.km/u.s)**2)
-            #plotting contour
-            plt.contourf(X,Y,func,[phi_min,phi_max],colors='gray',alpha=0.3)
+            Orbit_Overlay.drawCaptureRegion(ax,kernel)
             
         if plotOption==0:  #this plots in the inertial frame (rarely used)
             self.qps = self.qp
@@ -395,6 +740,7 @@ class Orbit_Calculator(object):
     ###Creates a plot of orbital properties over time for an individual qp
     #shows lambda, normalized random energy, and normalized radius (for star and guiding center)
     def plot_prop(self):
+        import matplotlib.pyplot as plt
         
         plt.close('all')         #close old plots still up
         
@@ -458,8 +804,13 @@ class Orbit_Calculator(object):
         plt.show()    
 
 
-# Calculates position of guiding center radius in rotating frame        
+# Calculates position of guiding center radius in rotating frame (kpc)
     def findRg(self):
+        return np.array(Orbit_Kernel.findRg(self.qp[:,0],self.qp[:,1],self.qp[:,2],self.qp[:,3],self.qp[:,4],kernel))
+
+# Reference version of findRg that carries astropy units through every step
+# (only kept to check the kernel against, see checkRframe)
+    def __findRgUnits(self):
         #pulling info out of qp
         x = self.qp[:,0]*u.kpc
         y = self.qp[:,1]*u.kpc
@@ -471,11 +822,13 @@ class Orbit_Calculator(object):
         phiR= phi - (t*OmegaCR).decompose() *u.rad
         xR = R_g *np.cos(phiR)
         yR = R_g *np.sin(phiR)
-        return np.array([xR,yR])
+        return np.array([xR.to(u.kpc).value,yR.to(u.kpc).value])
         
 #this function makes an x/vx poincare map using a spline for the discretized qp
 #it has not been used for anything and might need some fixing         
     def Poincare(self):
+        import matplotlib.pyplot as plt
+        from scipy import interpolate
         plt.close('all')
         yspline = interpolate.splrep(self.qp[:,4], self.qpR[:,1], s=0)
         roots = interpolate.sproot(yspline)
@@ -489,9 +842,23 @@ class Orbit_Calculator(object):
         plt.show()
         return
         
+###This function returns a few important physical values for a given qp
+#they are calculated once per qp by __findPhys and reused until qp is set again
+#the returned array is shared between calls, so copy it before changing it
+    def findLam(self):
+        if self.__phys is None:
+            self.__phys = self.__findPhys()
+        return self.__phys
+        
 ###This function calculates a few important physical values for a given qp
 #it calculates lambda, E_j, effective potential, angmom, total energy, and random energy at every discretized step
-    def findLam(self):
+#all of the work is done by the unit-free Orbit_Kernel.findPhys
+    def __findPhys(self):
+        return np.array(Orbit_Kernel.findPhys(self.qp[:,0],self.qp[:,1],self.qp[:,2],self.qp[:,3],self.qp[:,4],kernel))
+        
+###Reference version of __findPhys that carries astropy units through every step
+#it is much slower and only kept to check the kernel against (see checkPhys)
+    def __findPhysUnits(self):
         #pulling qp data
         x = self.qp[:,0]*u.kpc
         y = self.qp[:,1]*u.kpc
@@ -564,3 +931,7 @@ class Orbit_Calculator(object):
         Lz_3 = Lz[(3.*size/4.)]  #angmom after three quarters time
         Lz_4 = Lz[(size-1)]     #final angmom
         return np.array([Lz_0,Lz_1,Lz_2,Lz_3,Lz_4])
+
+###This function returns angmom at every step of qp (shared with findLam, copy it before changing it)
+    def find_All_Lz(self):
+        return self.findLam()[3]
@@ -0,0 +1,137 @@
+'''
+Description:
+    This file defines OrbitEnsemble, the array-backed counterpart of an array of
+Orbit_Calculator objects for analysing many orbits at once. It holds one
+(N,steps,5) qp array (x,y,vx,vy,t as in Orbit_Calculator, e.g. the memory map of
+an ensemble store) and the parameters of the orbits as one array per parameter
+(m, th, t, CR, eps, x0, y0, vx0, vy0, the names of Ensemble_Store.metaNames).
+    Its methods are the analysis methods of Orbit_Calculator, run over the whole
+ensemble at once with the same unit-free Orbit_Kernel functions (findPhys,
+toRframe, findRg), so they give the same numbers as calling the method of each
+orbit in turn, without making N objects. Orbits with different spirals are
+handled one spiral at a time.
+
+Methods (N orbits of T steps):
+    findLam()       (6,N,T) Lam_nc2, E_j, phi_eff, L_z, E_tot, E_ran (calculated once)
+    Lam_special()   (N,) trapped classification 0 to 5 (see Orbit_Calculator.Lam_special)
+    findLz()        (N,5) L_z at the start, a quarter, half, three quarters and the end
+    find_All_Lz()   (N,T) L_z at every step
+    findRg()        (2,N,T) guiding center x,y in the rotating frame
+    getqpR()        (N,T,7) qpR of every orbit (calculated once)
+    getOrbit(i)     Orbit_Calculator of orbit i with its qp set (e.g. for plotting)
+
+Usage:
+    ensemble = OrbitEnsemble.fromStore("ensemble_(m=4)_(th=15).qps")
+    ensemble = OrbitEnsemble.fromFiles(filepaths)      # LF_L4 text files
+    lamsp = ensemble.Lam_special()
+'''
+import numpy as np
+import Orbit_Kernel
+from Ensemble_Store import metaNames
+
+class OrbitEnsemble(object):
+
+    # qp = (N,steps,5) array, params = (N,9) array (columns in metaNames order)
+    # or an array with metaNames fields (e.g. the metadata of an ensemble store)
+    def __init__(self,qp,params):
+        self.qp = qp
+        params = np.asarray(params)
+        if params.dtype.names is None:
+            params = np.asarray(params,dtype=float).reshape(len(qp),len(metaNames))
+            self.params = dict((name,params[:,i].copy()) for i, name in enumerate(metaNames))
+        else:
+            self.params = dict((name,np.asarray(params[name],dtype=float)) for name in metaNames)
+        self.__phys = None
+        self.__qpR = None
+
+    # Makes an ensemble from an ensemble store (the qp's stay memory mapped)
+    # orbits = indices or slice of the orbits to take (all if None)
+    @classmethod
+    def fromStore(cls,storename,orbits=None):
+        import Ensemble_Store
+        store = Ensemble_Store.EnsembleStore(storename)
+        if orbits is None:
+            return cls(store.qp,store.meta)
+        return cls(store.qp[orbits],store.meta[orbits])
+
+    # Makes an ensemble from LF_L4 text files (all of the same length), with the
+    # parameters read from their filenames unless given as an (N,9) array
+    @classmethod
+    def fromFiles(cls,filepaths,params=None):
+        import Table_Helper
+        from Orbit_Manifest import parseFilename
+        qp = None
+        for i, path in enumerate(filepaths):
+            data = Table_Helper.loadQP(path)
+            if qp is None:
+                qp = np.empty((len(filepaths),len(data),5))
+            qp[i] = data
+        if params is None:
+            params = np.array([parseFilename(path) for path in filepaths])
+        return cls(qp,params)
+
+    def __len__(self):
+        return len(self.qp)
+
+    # Returns the kernel tuple and the orbit indices of every spiral in the ensemble
+    def findSpirals(self):
+        import Orbit_Code
+        spirals = np.c_[self.params["m"],self.params["th"],self.params["CR"],self.params["eps"]]
+        unique, which = np.unique(spirals,axis=0,return_inverse=True)
+        which = np.ravel(which)
+        return [(Orbit_Code.findKernel(*spiral), np.nonzero(which == j)[0]) for j, spiral in enumerate(unique)]
+
+    # Runs a kernel function f(x,y,vx,vy,t,k) over every spiral of the ensemble
+    # Returns the (n,N,T) array of its n results
+    def apply(self,func):
+        out = None
+        for k, index in self.findSpirals():
+            qp = self.qp if len(index) == len(self.qp) else self.qp[index]
+            results = func(qp[:,:,0],qp[:,:,1],qp[:,:,2],qp[:,:,3],qp[:,:,4],k)
+            if out is None:
+                out = np.empty((len(results),) + self.qp.shape[0:2])
+            out[:,index] = results
+        return out
+
+    # Returns the findLam values of every orbit, (6,N,T), calculated on first use
+    # (the returned array is shared between calls, so copy it before changing it)
+    def findLam(self):
+        if self.__phys is None:
+            self.__phys = self.apply(Orbit_Kernel.findPhys)
+        return self.__phys
+
+    # Returns the qpR of every orbit, (N,T,7), calculated on first use
+    def getqpR(self):
+        if self.__qpR is None:
+            self.__qpR = np.moveaxis(self.apply(Orbit_Kernel.toRframe),0,2)
+        return self.__qpR
+
+    # Returns the guiding center x,y of every orbit in the rotating frame, (2,N,T)
+    def findRg(self):
+        return self.apply(Orbit_Kernel.findRg)
+
+    # Returns the trapped classification of every orbit (see Orbit_Calculator.Lam_special)
+    def Lam_special(self):
+        trapped = np.absolute(self.findLam()[0]) < 1.
+        first = trapped[:,0]
+        last = trapped[:,-1]
+        return np.where(first,
+                        np.where(last, np.where(trapped.all(axis=1),0,1), 2),
+                        np.where(last, 5, np.where(trapped.any(axis=1),3,4)))
+
+    # Returns L_z of every orbit at the 5 times of Orbit_Calculator.findLz, (N,5)
+    def findLz(self):
+        Lz = self.findLam()[3]
+        size = Lz.shape[1]
+        return Lz[:,[0,int(size/4.),int(size/2.),int(3.*size/4.),size-1]]
+
+    # Returns L_z of every orbit at every step, (N,T) (shared with findLam)
+    def find_All_Lz(self):
+        return self.findLam()[3]
+
+    # Returns an Orbit_Calculator for orbit i with its qp set
+    def getOrbit(self,i):
+        import Orbit_Code
+        orbit = Orbit_Code.Orbit_Calculator(*[self.params[name][i] for name in metaNames])
+        orbit.setqp(np.array(self.qp[i]))
+        return orbit
@@ -0,0 +1,194 @@
+'''
+Description:
+    This file holds the "grid" force mode of Orbit_Calculator (force="grid" in
+makeOrbit and makeEnsemble). In the frame rotating with the spiral the spiral
+potential doesn't change, so instead of working out the spiral force from exp,
+log, tan and sin at every call, its polar components are tabulated once per
+spiral on a grid of (ln R, phi_rot) and read back with bicubic B-spline
+interpolation (4th order accurate, with a continuous derivative). The logarithmic disk force is cheap and stays analytic.
+    The tabulated components are, with var1 the phase of Orbit_Kernel.accel
+(var1 = -m*phi_rot - alpha*ln(R/CR), phi_rot = arctan(y/x) - Omega*t),
+        a_R = A'(R)*cos(var1) + A(R)*alpha*sin(var1)/R
+        a_phi = A(R)*m*sin(var1)/R,        A'(R) = A(R)*(1/R - 1/Rd)
+in (km/s)^2/kpc, which give back the spiral part of Orbit_Kernel.accel as
+(x*a_R - y*a_phi, y*a_R + x*a_phi)/R. phi_rot only needs to cover one arm
+(2*pi/m), and the grid covers Rmin to Rmax, outside of which the interpolation
+is extrapolated and quickly loses accuracy.
+    Tables are kept in memory and saved in gridDir, so each spiral is only
+tabulated once per computer. The integrators are the ones of Orbit_Kernel,
+copied with accel replaced by gridAccel (see Orbit_Jit.rebind), so every scheme
+and backend works with the grid.
+
+Accuracy:
+    checkGrid compares gridAccel with Orbit_Kernel.accel at random positions
+between 1 and 15 kpc. With the default grid (nR = 1024 from 0.5 to 40 kpc,
+nPhi = 256 over one arm) the largest difference, relative to the total
+acceleration, is 1.1e-8 for m=4, theta=15, eps=0.3 (8e-10 at theta=30, 7.5e-9 
+for m=2, theta=10, eps=0.5). Each doubling of nR and nPhi shrinks it 16 times.
+
+Speed:
+    A lookup still needs ln R and arctan(y/x) to find its cell, and then reads
+16 table entries per component, so it only pays off where exp, tan and sin are
+slow. Measured on a 2020s x86 CPU with numpy 2 the grid is slower than the
+analytic kernel: 4.7 times for 1e5 stars at once with the numpy backend and 1.4
+times with the jit backend. Keep force="analytic" unless a benchmark on your
+computer says otherwise.
+'''
+import os
+import types
+import hashlib
+import numpy as np
+import Orbit_Kernel
+from Orbit_Kernel import kpc2km
+
+# Grid parameters (You can toggle these)
+nR = 1024           # Number of radii, spaced evenly in ln R
+nPhi = 256          # Number of angles over one arm (2*pi/m), periodic
+Rmin = 0.5          # Radius range of the grid (kpc)
+Rmax = 40.
+gridDir = os.path.join(os.path.dirname(os.path.abspath(__file__)),"force_grids")  # Where tables are saved
+
+grids = {}          # Tables already made or loaded, keyed by their filename
+integrators = {}    # Grid copies of the integrators, keyed by backend
+
+# Makes the table of a_R and a_phi (2,nR,nPhi) of the spiral in the kernel tuple k
+# Returns lnR0, dlnR, dphi and the table
+def makeGrid(k,nR=nR,nPhi=nPhi,Rmin=Rmin,Rmax=Rmax):
+    m, alpha, CR, Rd, Omega, vc2, Acoef = k
+    lnR0 = np.log(Rmin)
+    dlnR = (np.log(Rmax) - lnR0)/(nR - 1)
+    dphi = 2.*np.pi/m/nPhi
+    lnR = (lnR0 + dlnR*np.arange(nR))[:,np.newaxis]
+    phi = (dphi*np.arange(nPhi))[np.newaxis,:]
+    R = np.exp(lnR)
+    A = Acoef *R *np.exp(-R/Rd)
+    dA = A *(1./R - 1./Rd)
+    var1 = -m *phi -alpha *(lnR - np.log(CR))
+    table = np.array([dA*np.cos(var1) + A*alpha*np.sin(var1)/R, A*m*np.sin(var1)/R])
+    return lnR0, dlnR, dphi, splineFilter(table)
+
+# Turns a table of values (2,nR,nPhi) into the coefficients of the cubic B-spline
+# that goes through them (periodic in phi, mirrored at the ends in ln R), by
+# dividing out the (1,4,1)/6 B-spline kernel in Fourier space along each axis
+def splineFilter(table):
+    nR = table.shape[1]
+    nPhi = table.shape[2]
+    kernel = (4. + 2.*np.cos(2.*np.pi*np.arange(nPhi)/nPhi))/6.
+    table = np.fft.ifft(np.fft.fft(table,axis=2)/kernel,axis=2).real
+    mirror = np.concatenate((table,table[:,-2:0:-1,:]),axis=1)   # Mirror so the radii are periodic too
+    kernel = (4. + 2.*np.cos(2.*np.pi*np.arange(2*nR-2)/(2*nR-2)))/6.
+    mirror = np.fft.ifft(np.fft.fft(mirror,axis=1)/kernel[:,np.newaxis],axis=1).real
+    return mirror[:,0:nR,:]
+
+# Returns the filename a table is saved under (every parameter of it is hashed)
+def gridFilename(k,nR,nPhi,Rmin,Rmax):
+    key = repr(tuple(float(a) for a in k) + (int(nR),int(nPhi),float(Rmin),float(Rmax)))
+    return os.path.join(gridDir,"forcegrid_%s.npy" % hashlib.md5(key.encode('ascii')).hexdigest()[:16])
+
+# Returns the grid kernel tuple of the spiral in k: k followed by lnR0, dlnR, dphi
+# and the table, reading the table from memory or gridDir, or making and saving it
+def findGridKernel(k,nR=nR,nPhi=nPhi,Rmin=Rmin,Rmax=Rmax):
+    filename = gridFilename(k,nR,nPhi,Rmin,Rmax)
+    if filename not in grids:
+        lnR0 = np.log(Rmin)
+        dlnR = (np.log(Rmax) - lnR0)/(nR - 1)
+        dphi = 2.*np.pi/k[0]/nPhi
+        if os.path.isfile(filename):
+            table = np.load(filename)
+        else:
+            lnR0, dlnR, dphi, table = makeGrid(k,nR,nPhi,Rmin,Rmax)
+            if not os.path.isdir(gridDir):
+                os.makedirs(gridDir)
+            np.save(filename,table)
+        # Interleave a_R and a_phi, (nR,nPhi,2), so both are read from the same place
+        grids[filename] = tuple(k) + (lnR0, dlnR, dphi, np.ascontiguousarray(np.moveaxis(table,0,2)))
+    return grids[filename]
+
+# Calculates the acceleration (km/s^2) at coordinate x-y (kpc) at time tnow (yr)
+# from the grid kernel tuple kg, like Orbit_Kernel.accel (scalars or arrays)
+def gridAccel(x,y,tnow,kg):
+
+    m, alpha, CR, Rd, Omega, vc2, Acoef, lnR0, dlnR, dphi, table = kg
+    R2 = x**2 + y**2
+    R = np.sqrt(R2)
+
+    # Find the grid cell and the position inside it
+    u = (0.5*np.log(R2) - lnR0)/dlnR
+    v = (np.arctan(y/x) - Omega*tnow)/dphi
+    i = np.minimum(np.maximum(np.int64(np.floor(u)),1),table.shape[0]-3)
+    j = np.int64(np.floor(v))
+    fu = u - i
+    fv = v - j
+
+    # Cubic B-spline weights of the 4 rows and 4 columns around the point
+    wu0 = (1.-fu)**3/6.
+    wu1 = (fu*fu*(3.*fu - 6.) + 4.)/6.
+    wu2 = (fu*(fu*(3. - 3.*fu) + 3.) + 1.)/6.
+    wu3 = fu**3/6.
+    wv0 = (1.-fv)**3/6.
+    wv1 = (fv*fv*(3.*fv - 6.) + 4.)/6.
+    wv2 = (fv*(fv*(3. - 3.*fv) + 3.) + 1.)/6.
+    wv3 = fv**3/6.
+
+    # Interpolate along phi (periodic) in each row, then along ln R, reading the
+    # two components from the flattened table (index = 2*(row*nPhi + column))
+    n = table.shape[1]
+    flat = table.reshape(-1)
+    j0 = 2*((j - 1) % n)
+    j1 = 2*(j % n)
+    j2 = 2*((j + 1) % n)
+    j3 = 2*((j + 2) % n)
+    aR = 0.
+    aphi = 0.
+    for a in range(4):
+        wu = wu0 if a == 0 else (wu1 if a == 1 else (wu2 if a == 2 else wu3))
+        row = 2*n*(i - 1 + a)
+        aR = aR + wu*(wv0*flat[row+j0] + wv1*flat[row+j1] + wv2*flat[row+j2] + wv3*flat[row+j3])
+        aphi = aphi + wu*(wv0*flat[row+j0+1] + wv1*flat[row+j1+1] + wv2*flat[row+j2+1] + wv3*flat[row+j3+1])
+
+    # Add the logarithmic disk, converting (km/s)^2/kpc to km/s^2
+    dvxdt = (vc2*x/R2 + (x*aR - y*aphi)/R)/kpc2km
+    dvydt = (vc2*y/R2 + (y*aR + x*aphi)/R)/kpc2km
+    return dvxdt, dvydt
+
+# Compares gridAccel with Orbit_Kernel.accel at N random positions between 1 and
+# 15 kpc over one spiral pattern period, returns the largest difference relative
+# to the acceleration (see Accuracy above)
+def checkGrid(k,N=1000,nR=nR,nPhi=nPhi,Rmin=Rmin,Rmax=Rmax):
+    kg = findGridKernel(k,nR,nPhi,Rmin,Rmax)
+    R = 1. + 14.*np.random.random(N)
+    phi = 2.*np.pi*np.random.random(N)
+    tnow = 2.*np.pi*np.random.random(N)/k[4]
+    x = R*np.cos(phi)
+    y = R*np.sin(phi)
+    ax, ay = Orbit_Kernel.accel(x,y,tnow,k)
+    gx, gy = gridAccel(x,y,tnow,kg)
+    return np.max(np.sqrt((gx - ax)**2 + (gy - ay)**2)/np.sqrt(ax**2 + ay**2))
+
+# Holds copies of the Orbit_Kernel integrators (leapstep, integrate, integrateEvery,
+# composestep, integrateComposed, integrateAdaptive) that call gridAccel instead of accel, so
+# it can be used in place of a backend module (see Orbit_Code.findBackend)
+# With backend = "jit" the copies are compiled with numba (not cached on disk,
+# since they share their code with the analytic ones of Orbit_Jit)
+class GridIntegrator(object):
+
+    def __init__(self,backend):
+        names = ["leapstep","integrate","integrateEvery","composestep","integrateComposed","integrateAdaptive"]
+        g = dict(vars(Orbit_Kernel))
+        if backend == "jit":
+            import numba
+            wrap = numba.njit
+        else:
+            wrap = lambda func: func
+        g['accel'] = wrap(types.FunctionType(gridAccel.__code__, g, 'accel'))
+        self.accel = g['accel']
+        for name in names:
+            func = getattr(Orbit_Kernel,name)
+            g[name] = wrap(types.FunctionType(func.__code__, g, name, func.__defaults__, func.__closure__))
+            setattr(self,name,g[name])
+
+# Returns the grid integrators of a backend ("numpy" or "jit"), made once
+def findGridIntegrator(backend):
+    if backend not in integrators:
+        integrators[backend] = GridIntegrator(backend)
+    return integrators[backend]
@@ -0,0 +1,32 @@
+'''
+Description:
+    This file compiles the Orbit_Kernel functions to native code with numba so
+that the whole kick-drift-kick loop, spiral-arm acceleration included, runs 
+outside of the interpreter. It is the "jit" backend of Orbit_Calculator.makeOrbit
+and makeEnsemble, and is only imported when that backend is asked for, so numba 
+is an optional dependency.
+    The compiled functions are copies of the ones in Orbit_Kernel (see rebind), so
+the model is only ever written down once. Numba caches the compiled code in 
+__pycache__ next to Orbit_Kernel.py, so only the first run on a computer pays for
+compilation, and any change to Orbit_Kernel.py triggers a recompile.
+'''
+import types
+import numpy as np
+import numba
+from Orbit_Kernel import yr2sec, km2kpc, kpc2km, verlet, yoshida4, yoshida6
+import Orbit_Kernel
+
+# Makes a copy of a kernel function that looks up its global names (np, accel,
+# leapstep, the conversion factors, the scheme weights) in this module instead of in Orbit_Kernel,
+# so the compiled functions call each other rather than the python versions
+def rebind(func):
+    return types.FunctionType(func.__code__, globals(), func.__name__,
+                              func.__defaults__, func.__closure__)
+
+accel = numba.njit(cache=True)(rebind(Orbit_Kernel.accel))
+leapstep = numba.njit(cache=True)(rebind(Orbit_Kernel.leapstep))
+integrate = numba.njit(cache=True)(rebind(Orbit_Kernel.integrate))
+integrateEvery = numba.njit(cache=True)(rebind(Orbit_Kernel.integrateEvery))
+composestep = numba.njit(cache=True)(rebind(Orbit_Kernel.composestep))
+integrateComposed = numba.njit(cache=True)(rebind(Orbit_Kernel.integrateComposed))
+integrateAdaptive = numba.njit(cache=True)(rebind(Orbit_Kernel.integrateAdaptive))
@@ -0,0 +1,282 @@
+'''
+Description:
+    This file holds the unit-free force and leapfrog kernel used by the
+Orbit_Calculator class in Orbit_Code. Every function here works on plain floats
+(or numpy arrays of floats, one entry per star), so the same code integrates a
+single orbit or a whole ensemble. Astropy units are only handled at the edge, in
+Orbit_Code.findKernel, which folds all of the model constants into the tuple k.
+
+Units used throughout the kernel:
+    positions in kpc, velocities in km/s, times in yr, accelerations in km/s^2,
+    potentials and energies in (km/s)^2
+
+The kernel tuple k (see Orbit_Code.findKernel) holds:
+    k = (m, alpha, CR, Rd, Omega, vc2, Acoef)
+        m = number of spiral arms
+        alpha = m/tan(theta)
+        CR = corotation radius (kpc)
+        Rd = scale length of the disk (kpc)
+        Omega = pattern speed of the spiral (rad/yr)
+        vc2 = circular velocity squared ((km/s)^2)
+        Acoef = spiral amplitude per radius, A(R) = Acoef*R*exp(-R/Rd) ((km/s)^2/kpc)
+'''
+import numpy as np
+
+################################################################################
+# Conversion factors (identical to the literals used by Orbit_Code and LF_L4)
+################################################################################
+yr2sec = 3.15576e+07            # Seconds in a year
+km2kpc = 3.24077928947e-17      # Kiloparsecs in a kilometer
+kpc2km = 3.0856775814913673e+16 # Kilometers in a kiloparsec
+
+################################################################################
+# Composition schemes: the weights of the drift-kick-drift substeps of one step
+################################################################################
+cbrt2 = 2.**(1./3.)
+verlet = (1.,)                                                         # 2nd order, 1 force evaluation per step
+yoshida4 = (1./(2.-cbrt2), -cbrt2/(2.-cbrt2), 1./(2.-cbrt2))           # 4th order (Forest-Ruth), 3 per step
+yoshida6 = (0.784513610477560, 0.235573213359357, -1.17767998417887,   # 6th order (Yoshida's solution A), 7 per step
+            1.-2.*(0.784513610477560+0.235573213359357-1.17767998417887),
+            -1.17767998417887, 0.235573213359357, 0.784513610477560)
+
+################################################################################
+# Kernel functions
+################################################################################
+
+# Calculates the acceleration (km/s^2) at coordinate x-y (kpc) at time tnow (yr)
+# Same expressions as Orbit_Calculator.__dvdt, minus the astropy bookkeeping
+def accel(x,y,tnow,k):
+
+    m, alpha, CR, Rd, Omega, vc2, Acoef = k
+    R2 = x**2 + y**2
+    R = np.sqrt(R2)
+    A = Acoef *R *np.exp(-R/Rd)
+
+    # Find acceleration from logarithmic disk
+    dvxD = vc2 *x/R2
+    dvyD = vc2 *y/R2
+
+    # Find acceleration from spiral
+    var1 = m *Omega *tnow -m *np.arctan(y/x) -alpha *np.log(R/CR)
+    var2 = (-alpha-(1-R/Rd)/np.tan(var1))
+    dvSFront = -A *np.sin(var1)/R2
+    dvxS = dvSFront *(m*y + var2*x)
+    dvyS = dvSFront *(-m*x + var2*y)
+
+    # Find total acceleration, converting (km/s)^2/kpc to km/s^2
+    dvxdt = (dvxD + dvxS)/kpc2km
+    dvydt = (dvyD + dvyS)/kpc2km
+    return dvxdt, dvydt
+
+# Perform a single leapstep (t+dt), using kick-drift-kick method
+# dt is in seconds, x and y are in kpc, vx and vy are in km/s
+def leapstep(x,y,vx,vy,tnow,dt,k):
+
+    ax, ay = accel(x,y,tnow,k)  # Find acceleration at this coordinate
+    vx = vx -0.5 *dt *ax        # Advance v_x by half step
+    vy = vy -0.5 *dt *ay        # Advance v_y by half step
+    x = x +(dt*vx*km2kpc)       # Advance x by full step, while converting v*dt from km to kpc
+    y = y +(dt*vy*km2kpc)       # Advance y by full step, while converting v*dt from km to kpc
+
+    ax, ay = accel(x,y,tnow,k)  # Find a at new position and complete the velocity step
+    vx = vx -0.5 *dt *ax        # Complete v_x step
+    vy = vy -0.5 *dt *ay        # Complete v_y step
+    return x, y, vx, vy
+
+# Integrates a single star from x,y,vx,vy over the times T (yr) with steps of dt
+# seconds, writing x,y,vx,vy,t after every step into the (len(T),5) array qp
+# (this is the loop of Orbit_Calculator.makeOrbit, kept here so it can be compiled)
+def integrate(x,y,vx,vy,T,dt,k,qp):
+
+    for i in range(len(T)):
+        x, y, vx, vy = leapstep(x,y,vx,vy,T[i],dt,k)
+        qp[i,0] = x
+        qp[i,1] = y
+        qp[i,2] = vx
+        qp[i,3] = vy
+        qp[i,4] = T[i]
+    return qp
+
+# Integrates a single star like integrate, but only writes the state after every
+# every-th step (steps 0, every, 2*every, ...) into the (ceil(len(T)/every),5) 
+# array qp, so the step can be made small without storing every step
+def integrateEvery(x,y,vx,vy,T,dt,k,qp,every):
+
+    for i in range(len(T)):
+        x, y, vx, vy = leapstep(x,y,vx,vy,T[i],dt,k)
+        if i % every == 0:
+            j = i//every
+            qp[j,0] = x
+            qp[j,1] = y
+            qp[j,2] = vx
+            qp[j,3] = vy
+            qp[j,4] = T[i]
+    return qp
+
+# Perform a single step (t+dt) of a composition scheme w (see the weights above)
+# Each substep is a drift-kick-drift leapfrog of w[j]*dt, with the time advanced
+# along with the positions, so the kick sees the spiral where it is at that time
+# (unlike leapstep, which uses tnow for both kicks). t is in yr, dt in seconds
+def composestep(x,y,vx,vy,t,dt,k,w):
+
+    for wj in w:
+        h = wj *dt
+        x = x +(0.5*h*vx*km2kpc)    # Drift half a substep
+        y = y +(0.5*h*vy*km2kpc)
+        t = t +0.5*h/yr2sec
+        ax, ay = accel(x,y,t,k)     # Kick a full substep
+        vx = vx -h *ax
+        vy = vy -h *ay
+        x = x +(0.5*h*vx*km2kpc)    # Complete the drift
+        y = y +(0.5*h*vy*km2kpc)
+        t = t +0.5*h/yr2sec
+    return x, y, vx, vy, t
+
+# Integrates a single star with the composition scheme w, writing the state at
+# each of the times T (yr) into the (len(T),5) array qp, so qp[0] holds the 
+# initial x,y,vx,vy at T[0]. Between two times the star takes the whole number 
+# of equal steps closest to dt seconds (at least one)
+# Returns the number of force evaluations
+def integrateComposed(x,y,vx,vy,T,dt,k,qp,w):
+
+    qp[0,0] = x
+    qp[0,1] = y
+    qp[0,2] = vx
+    qp[0,3] = vy
+    qp[0,4] = T[0]
+    nEval = 0
+    for i in range(1,len(T)):
+        span = (T[i] - T[i-1])*yr2sec
+        n = max(1,int(np.rint(span/dt)))
+        t = T[i-1]
+        for j in range(n):
+            x, y, vx, vy, t = composestep(x,y,vx,vy,t,span/n,k,w)
+        nEval = nEval + n*len(w)
+        qp[i,0] = x
+        qp[i,1] = y
+        qp[i,2] = vx
+        qp[i,3] = vy
+        qp[i,4] = T[i]
+    return nEval
+
+# Integrates a single star with error-controlled steps: every step of h is 
+# compared with two steps of h/2 (both 4th-order yoshida4), the step is kept if 
+# their difference, relative to the radius and speed of the star, is below tol,
+# and h grows or shrinks with the error. dt (seconds) is the first step, and the
+# state at each of the times T (yr) is written into qp as in integrateComposed
+# Returns the number of force evaluations
+def integrateAdaptive(x,y,vx,vy,T,dt,k,qp,tol):
+
+    qp[0,0] = x
+    qp[0,1] = y
+    qp[0,2] = vx
+    qp[0,3] = vy
+    qp[0,4] = T[0]
+    nEval = 0
+    h = dt
+    t = T[0]
+    for i in range(1,len(T)):
+        while t < T[i]:
+            last = (T[i] - t)*yr2sec <= h     # Don't step past the next output time
+            hs = (T[i] - t)*yr2sec if last else h
+            x1, y1, vx1, vy1, t1 = composestep(x,y,vx,vy,t,hs,k,yoshida4)
+            x2, y2, vx2, vy2, t2 = composestep(x,y,vx,vy,t,0.5*hs,k,yoshida4)
+            x2, y2, vx2, vy2, t2 = composestep(x2,y2,vx2,vy2,t2,0.5*hs,k,yoshida4)
+            nEval = nEval + 3*len(yoshida4)
+            R = np.sqrt(x2**2 + y2**2)
+            v = np.sqrt(vx2**2 + vy2**2)
+            # Difference of a 4th-order step and two half steps is 15 times the error of the latter
+            err = max((abs(x1-x2) + abs(y1-y2))/R, (abs(vx1-vx2) + abs(vy1-vy2))/v)/15.
+            factor = min(4., max(0.2, 0.9*(tol/max(err,1e-300))**0.2))
+            if err <= tol:
+                x, y, vx, vy = x2, y2, vx2, vy2
+                t = T[i] if last else t2
+                if last:
+                    factor = max(factor, h/hs)    # A short last step doesn't shrink h
+            h = hs*factor
+        qp[i,0] = x
+        qp[i,1] = y
+        qp[i,2] = vx
+        qp[i,3] = vy
+        qp[i,4] = T[i]
+    return nEval
+
+# Calculates lambda, E_j, effective potential, angmom, total energy and random 
+# energy at every step of a qp, the same values as Orbit_Calculator.findLam.
+# The arrays may have any shape with time along the last axis (e.g. (N,steps) for
+# an ensemble); Ej0 is the E_j that lambda is measured from, E_j at the first 
+# step unless given (so single steps can be handled one at a time)
+# Returns Lam_nc2, E_j, phi_eff, L_z, E_tot, E_ran
+def findPhys(x,y,vx,vy,t,k,Ej0=None):
+
+    m, alpha, CR, Rd, Omega, vc2, Acoef = k
+    vc = np.sqrt(vc2)
+    OmegaCR = vc/CR                             # Pattern speed in km/s/kpc
+    # finding some preliminary variables
+    R = np.sqrt(x**2 + y**2)
+    phi = np.arctan2(y,x)
+    vphi = np.sqrt(vx**2 + vy**2)*np.sin(np.arctan2(vy,vx) - phi)
+    R_g = R*vphi/vc
+    A = Acoef *R *np.exp(-R/Rd)
+    A_CR = Acoef *CR *np.exp(-CR/Rd)
+    A_g = Acoef *R_g *np.exp(-R_g/Rd)
+    hcr = vc2*np.log(CR) + 0.5*vc2 - OmegaCR*CR*vc
+    # finding potentials of the star and the guiding center
+    disk_potential = vc2*np.log(R)
+    disk_potential_g = vc2*np.log(R_g)
+    spiral_potential = A*np.cos(-alpha*np.log(R/CR) + m*Omega*t -m*phi)
+    spiral_potential_g = A_g*np.cos(-alpha*np.log(R_g/CR) + m*Omega*t -m*phi)
+    potential = disk_potential + spiral_potential
+    potential_g = disk_potential_g + spiral_potential_g
+    # finding total energy for the star and the guiding center
+    E_tot = potential + 0.5*(vx**2 + vy**2)
+    E_tot_g = potential_g + 0.5*vc2
+    # finding E_j
+    L_z = R*vphi
+    E_j = E_tot - OmegaCR*L_z
+    # finding E_ran
+    E_ran = E_tot - E_tot_g
+    # finding Lambda
+    if Ej0 is None:
+        Ej0 = E_j[...,0:1]
+    Lam_c = (Ej0 - hcr)/A_CR
+    Lam_nc2 = Lam_c - ((R_g/CR)*(E_ran/A_CR))
+    # finding effective potential
+    phi_eff = potential - 0.5*(OmegaCR*R)**2
+    return Lam_nc2, E_j, phi_eff, L_z, E_tot, E_ran
+
+# Calculates the positions and velocities of a qp in the frame rotating with the
+# spiral, the same values as Orbit_Calculator.qpR (arrays of any shape, as in 
+# findPhys). vxR keeps the + sign of the original astropy version, so qpR is 
+# unchanged
+# Returns xR, yR, vxR, vyR, vr, vphi, vphiR
+def toRframe(x,y,vx,vy,t,k):
+
+    m, alpha, CR, Rd, Omega, vc2, Acoef = k
+    OmegaCR = np.sqrt(vc2)/CR                   # Pattern speed in km/s/kpc
+    # Calculate polar rotating coordinates for position
+    R = np.sqrt(x**2 + y**2)
+    phi = np.arctan2(y,x)
+    phiR = phi - t*Omega
+    xR = R *np.cos(phiR)
+    yR = R *np.sin(phiR)
+    # Calculate polar rotating coordinates for velocity
+    v_tot = np.sqrt(vx**2 + vy**2)
+    alph = np.arctan2(vy,vx) - phi              # angle between position and velocity vectors
+    vr = v_tot*np.cos(alph)
+    vphi = v_tot*np.sin(alph)
+    vphiR = vphi - OmegaCR*R
+    vxR = vr *np.cos(phiR) + vphiR*np.sin(phiR)
+    vyR = vr *np.sin(phiR) + vphiR*np.cos(phiR)
+    return xR, yR, vxR, vyR, vr, vphi, vphiR
+
+# Calculates the position of the guiding center of a qp in the frame rotating 
+# with the spiral, the same values as Orbit_Calculator.findRg
+# Returns xR, yR
+def findRg(x,y,vx,vy,t,k):
+
+    m, alpha, CR, Rd, Omega, vc2, Acoef = k
+    phi = np.arctan2(y,x)
+    R_g = np.sqrt(x**2 + y**2)*-np.sqrt(vx**2 + vy**2)*np.sin(phi - np.arctan2(vy,vx))/np.sqrt(vc2)
+    phiR = phi - t*Omega
+    return R_g *np.cos(phiR), R_g *np.sin(phiR)
@@ -0,0 +1,175 @@
+'''
+Description:
+    This file builds and queries the manifest of a run: a single table that maps
+each orbit id (its row) to the spiral parameters and initial conditions of the
+orbit (m, th, t, CR, eps, x0, y0, vx0, vy0) and to where its qp is stored. It
+replaces rebuilding those values from the filenames with parseFilename and
+finding the files with os.walk every time a run is loaded.
+    A manifest is a numpy structured array (manifestDtype), saved as one .npy
+file, so loading a run is a single np.load. The storage location of an orbit is
+either a qp text/npy file (path, with index = -1) or orbit number index of an
+ensemble store (path of the store, see Ensemble_Store).
+    Next to the manifest, manifest.json records the number of files of the run
+(qp files, stores and tar.gz archives) and the latest modification time of its
+subfolders when it was built. getManifest(filepath, check=True) compares them
+with the folder (one walk, which only stats the folders, see sourceStamp) and
+builds the manifest again when runs have been added, removed or renamed since;
+without check it is only the np.load.
+
+Usage:
+    manifest = getManifest(filepath)      # load filepath/manifest.npy, or build and save it
+    manifest = getManifest(filepath, check=True)   # rebuilt first if the runs changed
+    rows = queryManifest(manifest, th=20, x0=(7,9))   # orbits with theta=20 and 7 <= x0 <= 9
+    qp = loadOrbit(manifest[i])           # qp of an orbit in the Orbit_Calculator layout
+'''
+import os
+import json
+import numpy as np
+
+manifestName = "manifest.npy"   # Filename of the manifest inside a run folder
+stampName = "manifest.json"     # Filename of what the manifest was built from
+stampVersion = 2
+paramNames = ["m","th","t","CR","eps","x0","y0","vx0","vy0"]  # Same order as the filenames
+
+# Returns the dtype of a manifest whose paths are at most pathLength characters
+def manifestDtype(pathLength=256):
+    return np.dtype([(name,'<f8') for name in paramNames] + [('path','U%i' % pathLength),('index','<i8')])
+
+#from string of filename, return array of initial conditions
+def parseFilename(filename):
+    parts = os.path.basename(filename).split("=")
+    args = np.empty(len(parts)-1)
+    for l in range(1, len(parts)):
+        num = float(parts[l].split(")")[0])
+        args[l-1] = num
+    return args
+
+# Makes a manifest from lists of parameters (n,9), paths and store indices
+def makeManifest(params,paths,indices):
+    manifest = np.zeros(len(paths),dtype=manifestDtype(max([len(p) for p in paths] + [1])))
+    params = np.asarray(params,dtype=float).reshape(len(paths),len(paramNames))
+    for i, name in enumerate(paramNames):
+        manifest[name] = params[:,i]
+    manifest['path'] = paths
+    manifest['index'] = indices
+    return manifest
+
+# Yields (folder, filename) of every ensemble store and qp text/npy file under
+# filepath, the files a manifest is made of
+def iterRunFiles(filepath):
+    for dirpath, dirnames, files in os.walk(filepath):
+        for f in sorted(files):
+            if isRunFile(f):
+                yield dirpath, f
+
+# Returns True for the filename of an ensemble store or qp text/npy file
+def isRunFile(f):
+    return f.endswith(".qps") or (f.startswith("qp_") and (f.endswith(".txt") or f.endswith(".npy")))
+
+# Builds the manifest of every qp file (and ensemble store) under filepath
+# This is the only place the filenames are parsed
+def buildManifest(filepath):
+    import Ensemble_Store
+    params = []
+    paths = []
+    indices = []
+    for dirpath, f in iterRunFiles(filepath):
+        if f.endswith(".qps"):
+            store = Ensemble_Store.EnsembleStore(os.path.join(dirpath, f))
+            params.extend([[row[name] for name in paramNames] for row in store.meta])
+            paths.extend([dirpath+'/'+f]*len(store))
+            indices.extend(range(len(store)))
+        else:
+            params.append(parseFilename(f))
+            paths.append(dirpath+'/'+f)
+            indices.append(-1)
+    return makeManifest(params,paths,indices)
+
+# Returns what the manifest of the run in filepath is checked against, from one
+# walk of the folder that neither opens nor stats its files: the number of its
+# qp files, stores and tar.gz archives (so an archive that arrives before it is
+# unpacked counts too) and the latest modification time of its subfolders, 
+# which changes when files are added, removed or renamed in them (filepath 
+# itself is left out, since the manifest is saved there)
+def sourceStamp(filepath):
+    files = 0
+    mtime = 0.
+    for dirpath, dirnames, names in os.walk(filepath):
+        if dirpath != filepath:
+            mtime = max(mtime,os.path.getmtime(dirpath))
+        files = files + len([f for f in names if isRunFile(f) or f.endswith("tar.gz")])
+    return {"version": stampVersion, "files": files, "mtime": mtime}
+
+# Returns True if filepath has a manifest and no run files were added, removed
+# or renamed since it was built
+def isCurrent(filepath):
+    filename = os.path.join(filepath,manifestName)
+    stampname = os.path.join(filepath,stampName)
+    if not (os.path.isfile(filename) and os.path.isfile(stampname)):
+        return False
+    try:
+        with open(stampname) as f:
+            return json.load(f) == sourceStamp(filepath)
+    except ValueError:
+        return False
+
+# Builds the manifest of a single ensemble store (one read of its metadata)
+def buildManifestStore(storename):
+    import Ensemble_Store
+    store = Ensemble_Store.EnsembleStore(storename)
+    params = np.array([[row[name] for name in paramNames] for row in store.meta])
+    return makeManifest(params,[storename]*len(store),np.arange(len(store)))
+
+def saveManifest(manifest,filename):
+    np.save(filename,manifest)
+
+def loadManifest(filename):
+    return np.load(filename)
+
+# Returns the manifest of the run in filepath, reading filepath/manifest.npy if
+# there is one (and with check, only if it is current, see isCurrent) and 
+# otherwise building it and saving it there
+# (the stamp is taken before the build and written last, so files that arrive
+# during a build, or a build that was interrupted, mean a rebuild next time)
+def getManifest(filepath,rebuild=False,check=False):
+    filename = os.path.join(filepath,manifestName)
+    stampname = os.path.join(filepath,stampName)
+    if not rebuild and os.path.isfile(filename) and os.path.isfile(stampname) and (not check or isCurrent(filepath)):
+        return loadManifest(filename)
+    stamp = sourceStamp(filepath)
+    if os.path.isfile(stampname):
+        os.remove(stampname)
+    manifest = buildManifest(filepath)
+    saveManifest(manifest,filename)
+    with open(stampname,'w') as f:
+        json.dump(stamp,f)
+    return manifest
+
+# Returns the rows of the manifest that match every keyword, where each keyword
+# is a parameter name and either a value (th=20) or an inclusive range (x0=(7,9))
+def queryManifest(manifest,**ranges):
+    keep = np.ones(len(manifest),dtype=bool)
+    for name, value in ranges.items():
+        if name not in paramNames:
+            raise KeyError("Unknown parameter '%s', use one of %s" % (name,", ".join(paramNames)))
+        if np.ndim(value) == 0:
+            keep &= np.isclose(manifest[name],value)
+        else:
+            keep &= (manifest[name] >= value[0]) & (manifest[name] <= value[1])
+    return manifest[keep]
+
+# Returns the qp (x,y,vx,vy,t in kpc, km/s, yr) of the orbit in a manifest row
+def loadOrbit(row):
+    path = str(row['path'])
+    if row['index'] >= 0:
+        import Ensemble_Store
+        return np.array(Ensemble_Store.EnsembleStore(path).getOrbit(int(row['index'])))
+    if path.endswith(".npy"):
+        return np.load(path)
+    import Table_Helper
+    return Table_Helper.loadQP(path)
+
+# Returns the 9 parameters of a manifest row, in the order of the
+# Orbit_Calculator constructor
+def getParams(row):
+    return np.array([row[name] for name in paramNames])
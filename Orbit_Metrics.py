@@ -0,0 +1,158 @@
+'''
+Description:
+    This file holds the optional instrumentation of the integrators, the table
+builders and the ensemble runs: counters (steps, force evaluations, orbits) and
+timers of the phases of each job, written out as JSON lines so a long run can be
+broken down by phase without a profiler. It is off unless enable is called, and
+then every counter and timer call only costs a check of the enabled flag (the
+timers are shared do-nothing objects), so it can stay in the code for good.
+    Counters and timers add up until report is called, which writes them as one
+record (with the time, process id and a label) and starts them over. The table
+builders report once per table (and once per chunk in each worker of
+genTableParallel/genTableTarParallel), and Ensemble_Runner reports once per chunk
+in each worker and once for the whole run. Workers append to the same file, one
+line per record.
+    Steps and force evaluations are counted where the integrators are called
+(Orbit_Code.integrateScheme and integrateStars) rather than inside the kernel,
+so the jit backend is counted too and the step loop itself is untouched.
+
+Usage:
+    import Orbit_Metrics
+    Orbit_Metrics.enable("metrics.jsonl")        # or enable() to keep records in Orbit_Metrics.records
+    table1, table2 = Table_Helper.genTable(filepath)
+    Orbit_Metrics.summarize("metrics.jsonl")     # total seconds and calls of each timer, total counts
+
+Records (one JSON object per line):
+    {"label": ..., "time": unix time, "pid": process id,
+     "counters": {name: count}, "timers": {name: [seconds, calls]}}
+'''
+import os
+import json
+import time
+from timeit import default_timer
+
+enabled = False
+filename = None         # File the records are appended to (None keeps them in records)
+records = []
+counters = {}
+timers = {}             # name: [seconds, calls]
+
+# Turns the metrics on, writing the records to filename (kept in records if None)
+def enable(filename1=None):
+    global enabled
+    global filename
+    enabled = True
+    filename = filename1
+    reset()
+
+# Turns the metrics off (the counts so far are thrown away)
+def disable():
+    global enabled
+    enabled = False
+    reset()
+
+# Returns what a worker process needs to turn the metrics on like this process
+# (see initWorker)
+def getState():
+    return enabled, filename
+
+# Initializer of worker processes: turns the metrics on if they are on in the
+# process that started them (state from getState)
+def initWorker(state):
+    if state[0]:
+        enable(state[1])
+
+# Starts every counter and timer over
+def reset():
+    counters.clear()
+    timers.clear()
+
+# Adds n to a counter
+def count(name,n=1):
+    if enabled:
+        counters[name] = counters.get(name,0) + n
+
+# Adds the time spent in a with block to a timer
+class Timer(object):
+
+    def __init__(self,name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self,*exc):
+        total = timers.setdefault(self.name,[0.,0])
+        total[0] += default_timer() - self.start
+        total[1] += 1
+        return False
+
+# Stands in for Timer when the metrics are off
+class NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        return False
+
+nullTimer = NullTimer()
+
+# Returns a timer for a with block, e.g. with Orbit_Metrics.timer("findLam"): ...
+def timer(name):
+    return Timer(name) if enabled else nullTimer
+
+# Returns the items of an iterable, adding the time spent getting each one to a
+# timer (e.g. the walk of a folder); the iterable itself if the metrics are off
+def timedIter(name,iterable):
+    if not enabled:
+        return iterable
+    return timeNext(name,iter(iterable))
+
+def timeNext(name,iterator):
+    while True:
+        with Timer(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+# Writes the counters and timers as one record with a label, and starts them over
+def report(label):
+    if not enabled:
+        return
+    record = {"label": label, "time": time.time(), "pid": os.getpid(),
+              "counters": dict(counters), "timers": dict(timers)}
+    if filename is None:
+        records.append(record)
+    else:
+        with open(filename,'a') as f:
+            f.write(json.dumps(record,sort_keys=True) + "\n")
+    reset()
+
+# Returns the records of a file written by report (records if None)
+def loadRecords(filename1=None):
+    if filename1 is None:
+        return list(records)
+    with open(filename1) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# Adds up the records of a file (records if None), prints and returns the total
+# counters and timers ({name: count}, {name: [seconds, calls]})
+def summarize(filename1=None):
+    totalCounters = {}
+    totalTimers = {}
+    for record in loadRecords(filename1):
+        for name, n in record["counters"].items():
+            totalCounters[name] = totalCounters.get(name,0) + n
+        for name, (seconds, calls) in record["timers"].items():
+            total = totalTimers.setdefault(name,[0.,0])
+            total[0] += seconds
+            total[1] += calls
+    for name in sorted(totalTimers):
+        print("%-28s %12.3f s %10i calls" % (name,totalTimers[name][0],totalTimers[name][1]))
+    for name in sorted(totalCounters):
+        print("%-28s %14i" % (name,totalCounters[name]))
+    return totalCounters, totalTimers
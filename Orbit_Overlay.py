@@ -0,0 +1,136 @@
+'''
+Description:
+    This file holds what Orbit_Calculator.plot draws under an orbit: the capture
+region (the band of the rotating frame where the effective potential is within
+A(CR) of hcr, the Jacobi integral of a star at corotation), the Lindblad and
+ultraharmonic resonance circles, corotation and the spiral arms. All of them
+only depend on the spiral (m, theta, CR, epsilon), so they are worked out once
+per spiral from the unit-free kernel tuple (see Orbit_Code.findKernel) and kept
+in memory, and animations or runs of plots of orbits with the same spiral only
+add the ready-made patches to their axes.
+    The capture region used to be contoured on a 1040x1040 grid (0.025 kpc over
++-13 kpc) with astropy units at every plot call. It is now contoured on a grid
+matched to the size of the figure (oversample points per pixel of the axes, at
+most the old grid), and only the outline of the band is kept, as one matplotlib
+Path. Bands can also be saved in overlayDir (None keeps them in memory only),
+so each spiral and resolution is only contoured once per computer.
+
+Usage:
+    Orbit_Overlay.drawCaptureRegion(ax,Orbit_Code.findKernel(4,15,8,0.3))
+'''
+import os
+import hashlib
+import numpy as np
+from Orbit_Reducers import resonanceRadii
+
+# Overlay parameters (You can toggle these)
+extent = 13.            # The capture region is contoured over -extent to extent kpc
+oversample = 2.         # Grid points per pixel of the figure
+minPoints = 128         # Limits of the grid points across the region
+maxPoints = 1040        # (1040 is the 0.025 kpc grid plot used to contour on)
+axisExtent = 20.        # Half width of the axes of plot (kpc), used to find the pixels
+overlayDir = None       # Where bands are saved, e.g. os.path.join(os.path.dirname(os.path.abspath(__file__)),"overlays")
+
+bands = {}              # Bands already contoured or loaded, keyed by spiral and resolution
+
+# Returns the number of grid points across the capture region that resolve it
+# at the pixel size of a figure (size and dpi of the figure, the axes cover
+# -axisExtent to axisExtent kpc)
+def findResolution(fig):
+    width, height = fig.get_size_inches()
+    pixels = min(width,height)*fig.dpi*extent/axisExtent
+    return int(min(maxPoints,max(minPoints,np.ceil(oversample*pixels))))
+
+# Returns the x,y (kpc) of each spiral arm drawn by plot, (m,2,points)
+def findArms(k,points=20):
+    m, alpha, CR = k[0], k[1], k[2]
+    t = np.linspace(np.pi/24,np.pi/2+np.pi/16,points)
+    radius = CR*np.exp((-m*t+np.pi)/alpha)
+    turns = t + 2.*np.pi*np.arange(int(m))[:,np.newaxis]/m
+    return np.stack((radius*np.cos(turns),radius*np.sin(turns)),axis=1)
+
+# Returns the effective potential of a star at corotation in the rotating frame
+# at x,y (kpc), the contoured function of the capture region, and the range of
+# the band: hcr -+ A(CR), all in (km/s)^2
+def findEffectivePotential(x,y,k):
+    m, alpha, CR, Rd, Omega, vc2, Acoef = k
+    OmegaCR = np.sqrt(vc2)/CR                   # Pattern speed in km/s/kpc
+    R = np.sqrt(x**2 + y**2)
+    phi = np.arctan2(y,x)
+    A = Acoef *R *np.exp(-R/Rd)
+    A_CR = Acoef *CR *np.exp(-CR/Rd)
+    hcr = vc2*np.log(CR) + 0.5*vc2 - OmegaCR*CR*np.sqrt(vc2)
+    potential = A*np.cos(-alpha*np.log(R/CR) - m*phi) + vc2*np.log(R)
+    func = 0.5*(OmegaCR**2)*(CR**2) - (OmegaCR**2)*CR*R + potential
+    return func, hcr - A_CR, hcr + A_CR
+
+# Contours the capture region of the kernel tuple k on an n by n grid
+# Returns the vertices and codes of the outline of the band (a matplotlib Path)
+def makeBand(k,n):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.path import Path
+    X, Y = np.meshgrid(np.linspace(-extent,extent,n),np.linspace(-extent,extent,n))
+    func, phi_min, phi_max = findEffectivePotential(X,Y,k)
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    contour = fig.add_subplot(1,1,1).contourf(X,Y,func,[phi_min,phi_max])
+    if hasattr(contour,"get_paths"):            # matplotlib 3.8 and later
+        paths = contour.get_paths()
+    else:
+        paths = [path for collection in contour.collections for path in collection.get_paths()]
+    path = Path.make_compound_path(*paths)
+    return path.vertices, path.codes
+
+def bandFilename(k,n):
+    key = repr(tuple(float(a) for a in k) + (int(n),float(extent)))
+    return os.path.join(overlayDir,"band_%s.npz" % hashlib.md5(key.encode('ascii')).hexdigest()[:16])
+
+# Returns the outline of the capture region of the kernel tuple k contoured on
+# an n by n grid as a matplotlib Path, from memory or overlayDir, or contoured
+# (and saved if overlayDir is set)
+def findBand(k,n=maxPoints):
+    from matplotlib.path import Path
+    key = tuple(float(a) for a in k) + (int(n),float(extent))
+    if key not in bands:
+        filename = None if overlayDir is None else bandFilename(k,n)
+        if filename is not None and os.path.isfile(filename):
+            saved = np.load(filename)
+            vertices, codes = saved["vertices"], saved["codes"]
+        else:
+            vertices, codes = makeBand(k,n)
+            if filename is not None:
+                if not os.path.isdir(overlayDir):
+                    os.makedirs(overlayDir)
+                np.savez(filename,vertices=vertices,codes=codes)
+        bands[key] = Path(vertices,codes)
+    return bands[key]
+
+# Draws the capture region of the kernel tuple k on ax, contoured at the
+# resolution of its figure unless n is given
+# (added as a collection, like contourf, without updating the data limits, which
+# would go through every vertex of the outline)
+def drawCaptureRegion(ax,k,n=None):
+    from matplotlib.collections import PathCollection
+    if n is None:
+        n = findResolution(ax.figure)
+    band = PathCollection([findBand(k,n)],facecolors='gray',edgecolors='none',alpha=0.3,antialiaseds=False)
+    ax.add_collection(band,autolim=False)
+    return band
+
+# Draws the Lindblad (dashed) and ultraharmonic (dotted) resonance circles on ax
+def drawResonances(ax,k):
+    from matplotlib.patches import Circle
+    radii = resonanceRadii(k)
+    for name, ls in [("OLR",'dashed'),("ILR",'dashed'),("OUHR",'dotted'),("IUHR",'dotted')]:
+        ax.add_patch(Circle((0,0),radii[name],color='g',fill=False,ls=ls))
+
+# Draws the corotation circle on ax
+def drawCorotation(ax,k):
+    from matplotlib.patches import Circle
+    ax.add_patch(Circle((0,0),resonanceRadii(k)["CR"],color='g',fill=False))
+
+# Draws the spiral arms on ax
+def drawArms(ax,k):
+    for x, y in findArms(k):
+        ax.plot(x,y,color="purple",ls='dotted')
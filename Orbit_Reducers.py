@@ -0,0 +1,304 @@
+'''
+Description:
+    This file holds the streaming reducers of Orbit_Calculator.streamEnsemble.
+Most of what is done with an orbit afterwards (findLam, Lam_special, findLz, the
+trapped counts and dLz^2 sums of Table_Helper) only needs a few numbers from the
+whole trajectory, so instead of storing the (N,steps,5) qp's, streamEnsemble
+integrates the stars a block of steps at a time and hands every block to a list
+of reducers, which keep only what they need. Memory then no longer grows with
+the number of steps (for the reducers that keep O(1) numbers per star).
+    Every reducer has the same three methods:
+        start(N,nT,k)              before the first block, N stars, nT steps in
+                                   all (stored states, see outputTime) and the
+                                   kernel tuple k of the spiral
+        update(i0,qp,phys,stars)   for steps i0 to i0+nb, qp = (n,nb,5) block of
+                                   the qp's of the stars (indices into N) still
+                                   being integrated, and phys = Orbit_Kernel.findPhys
+                                   of the block (Lam_nc2, E_j, phi_eff, L_z, E_tot,
+                                   E_ran, each (n,nb))
+        finish()                   returns a dict of its results
+    and streamEnsemble returns all of the dicts merged into one summary. A
+reducer may also have isDone(stars), which returns which of the stars no longer
+need to be integrated (see Events); those stars are left out of the later
+blocks, and their results only cover the steps up to "nSteps" of the summary.
+A reducer that can only tell which stars it needs once the run is over (see
+TrappedSums) may have rerun(), which returns those stars and the reducers to
+integrate them with a second time, and finishRerun(summary), which returns its
+results from the summary of that second run (the integration is deterministic,
+so the stars go through the same steps again).
+
+Reducers (results):
+    LamSpecial      "lamsp": Lam_special classification of each star (0 to 5)   O(1) per star
+    LzAt            "Lz": L_z at chosen steps (those of findLz by default)        O(1) per star
+    EjDrift         "EjDrift": max |E_j - E_j0|/|E_j0| of each star               O(1) per star
+    DeltaLz2        "dLz2": sum over the steps of (L_z - L_z0)^2 of each star     O(1) per star
+    DeltaLz2Sums    "dLz2Sums": sum over the stars of (L_z - L_z0)^2 at each step  O(steps) in all
+    TrappedSums     "t", "trapped", "dLz2Trapped", "dLz2Always": the table2 sums
+                    of Table_Helper.partialTable over all stars (see tableSums)  O(steps) in all,
+                    integrating the always trapped stars a second time           O(1) per star
+    Lambda          "Lambda": Lam_nc2 of each star every few steps               O(steps/every) per star
+    Events          "events": table of the times each star is trapped/escapes
+                    and crosses the resonances, optional early stop              O(events) per star
+'''
+import numpy as np
+
+# Lam_special classification of each star, as Orbit_Calculator.Lam_special
+class LamSpecial(object):
+
+    def start(self,N,nT,k):
+        self.count = np.zeros(N,dtype=int)    # Number of steps trapped
+        self.n = np.zeros(N,dtype=int)        # Number of steps seen
+        self.first = np.zeros(N,dtype=bool)
+        self.last = np.zeros(N,dtype=bool)
+
+    def update(self,i0,qp,phys,stars):
+        trapped = np.absolute(phys[0]) < 1.
+        if i0 == 0:
+            self.first[stars] = trapped[:,0]
+        self.count[stars] += trapped.sum(axis=1)
+        self.n[stars] += trapped.shape[1]
+        self.last[stars] = trapped[:,-1]
+
+    def finish(self):
+        always = self.count == self.n
+        lamsp = np.where(self.first,
+                         np.where(self.last, np.where(always,0,1), 2),
+                         np.where(self.last, 5, np.where(self.count > 0,3,4)))
+        return {"lamsp": lamsp}
+
+# L_z of each star at the chosen steps, by default those of Orbit_Calculator.findLz
+# (the start, a quarter, half and three quarters of the way through, and the end)
+# Steps a star stopped before are left as nan
+class LzAt(object):
+
+    def __init__(self,steps=None):
+        self.steps = steps
+
+    def start(self,N,nT,k):
+        if self.steps is None:
+            self.index = np.array([0,int(nT/4.),int(nT/2.),int(3.*nT/4.),nT-1])
+        else:
+            self.index = np.asarray(self.steps,dtype=int)
+        self.Lz = np.full((N,len(self.index)),np.nan)
+
+    def update(self,i0,qp,phys,stars):
+        inBlock = np.nonzero((self.index >= i0) & (self.index < i0 + qp.shape[1]))[0]
+        self.Lz[stars[:,np.newaxis],inBlock] = phys[3][:,self.index[inBlock] - i0]
+
+    def finish(self):
+        return {"Lz": self.Lz}
+
+# Largest relative change of the Jacobi integral E_j of each star
+class EjDrift(object):
+
+    def start(self,N,nT,k):
+        self.drift = np.zeros(N)
+        self.Ej0 = np.zeros((N,1))
+
+    def update(self,i0,qp,phys,stars):
+        Ej = phys[1]
+        if i0 == 0:
+            self.Ej0[stars] = Ej[:,0:1]
+        Ej0 = self.Ej0[stars]
+        self.drift[stars] = np.maximum(self.drift[stars], np.max(np.absolute(Ej - Ej0)/np.absolute(Ej0),axis=1))
+
+    def finish(self):
+        return {"EjDrift": self.drift}
+
+# Running sum over the steps of (L_z - L_z0)^2 of each star (the rms change of
+# L_z of a star is sqrt(dLz2/nSteps))
+class DeltaLz2(object):
+
+    def start(self,N,nT,k):
+        self.dLz2 = np.zeros(N)
+        self.Lz0 = np.zeros((N,1))
+
+    def update(self,i0,qp,phys,stars):
+        Lz = phys[3]
+        if i0 == 0:
+            self.Lz0[stars] = Lz[:,0:1]
+        self.dLz2[stars] += ((Lz - self.Lz0[stars])**2).sum(axis=1)
+
+    def finish(self):
+        return {"dLz2": self.dLz2}
+
+# Sum over the stars of (L_z - L_z0)^2 at each step
+class DeltaLz2Sums(object):
+
+    def start(self,N,nT,k):
+        self.dLz2 = np.zeros(nT)
+        self.Lz0 = np.zeros((N,1))
+
+    def update(self,i0,qp,phys,stars):
+        Lz = phys[3]
+        if i0 == 0:
+            self.Lz0[stars] = Lz[:,0:1]
+        self.dLz2[i0:i0+qp.shape[1]] += ((Lz - self.Lz0[stars])**2).sum(axis=0)
+
+    def finish(self):
+        return {"dLz2Sums": self.dLz2}
+
+# Sums over the stars at each step, the same as the partial sums of
+# Table_Helper.partialTable: the number of initially trapped stars that are
+# trapped, and the (L_z - L_z0)^2 of the initially trapped and always trapped stars
+# Whether a star is always trapped is only known at the end, so only a flag of
+# whether each star has stayed trapped so far is kept (cleared as soon as it 
+# escapes, or stops, since it can't be counted at the later steps), and the 
+# always trapped stars are integrated a second time with DeltaLz2Sums for their
+# (L_z - L_z0)^2 (see rerun), instead of keeping every step of them
+class TrappedSums(object):
+
+    def start(self,N,nT,k):
+        self.t = np.zeros(nT)
+        self.trapped = np.zeros(nT)
+        self.dLz2Trapped = np.zeros(nT)
+        self.Lz0 = np.zeros((N,1))
+        self.first = np.zeros(N,dtype=bool)
+        self.always = np.zeros(N,dtype=bool)     # Trapped at every step so far
+
+    def update(self,i0,qp,phys,stars):
+        nb = qp.shape[1]
+        trapped = np.absolute(phys[0]) < 1.
+        Lz = phys[3]
+        if i0 == 0:
+            self.Lz0[stars] = Lz[:,0:1]
+            self.first[stars] = trapped[:,0]
+            self.always[stars] = True
+        dLz2 = (Lz - self.Lz0[stars])**2
+        first = self.first[stars]
+        self.t[i0:i0+nb] = qp[0,:,4]
+        self.trapped[i0:i0+nb] += trapped[first].sum(axis=0)
+        self.dLz2Trapped[i0:i0+nb] += dLz2[first].sum(axis=0)
+        integrated = np.zeros(len(self.always),dtype=bool)
+        integrated[stars] = trapped.all(axis=1)
+        self.always &= integrated
+
+    def finish(self):
+        return {"t": self.t, "trapped": self.trapped, "dLz2Trapped": self.dLz2Trapped, "dLz2Always": np.zeros(len(self.t))}
+
+    # The stars integrated a second time, and the reducers they are integrated with
+    def rerun(self):
+        return np.flatnonzero(self.always), [DeltaLz2Sums()]
+
+    def finishRerun(self,summary):
+        return {"dLz2Always": summary["dLz2Sums"]}
+
+# Lam_nc2 of each star at every few steps (0, every, 2*every, ...), nan after a
+# star stopped
+class Lambda(object):
+
+    def __init__(self,every=1):
+        self.every = every
+
+    def start(self,N,nT,k):
+        self.Lambda = np.full((N,(nT + self.every - 1)//self.every),np.nan)
+
+    def update(self,i0,qp,phys,stars):
+        steps = np.arange(i0,i0 + qp.shape[1])
+        keep = steps % self.every == 0
+        self.Lambda[stars[:,np.newaxis],steps[keep]//self.every] = phys[0][:,keep]
+
+    def finish(self):
+        return {"Lambda": self.Lambda}
+
+# Returns the radii (kpc) of the inner Lindblad, corotation and outer Lindblad
+# resonances of the spiral in the kernel tuple k, and of the inner and outer
+# ultraharmonic resonances (IUHR, OUHR). In the flat rotation curve of the disk
+# Omega = vc/R and kappa = sqrt(2)*vc/R, so m*(Omega - Omega_p) = -+kappa at
+# R = CR*(1 -+ sqrt(2)/m), and -+kappa/2 at R = CR*(1 -+ sqrt(2)/(2m))
+# (also the circles Orbit_Overlay draws)
+def resonanceRadii(k):
+    m, CR = k[0], k[2]
+    return {"ILR": CR*(1. - np.sqrt(2.)/m), "CR": CR, "OLR": CR*(1. + np.sqrt(2.)/m),
+            "IUHR": CR*(1. - np.sqrt(2.)/(2.*m)), "OUHR": CR*(1. + np.sqrt(2.)/(2.*m))}
+
+# Table of the events of each star, found between the steps as they are integrated:
+#   "trap"/"escape"   |Lam_nc2| goes below/back above 1
+#   "ILR","CR","OLR"  the guiding center radius R_g = L_z/vc crosses a resonance
+#                     (direction +1 outwards, -1 inwards)
+# The time of an event is found by linear interpolation between the two steps
+# around it, so it is good to a fraction of the step rather than to the step
+# With stopFree (years), a star is stopped once it has escaped and stayed free
+# for stopFree years, e.g. Events(stopFree=2e8) (checked at the end of every
+# block, so the star may run up to a block further). For other conditions,
+# subclass Events and override isDone
+class Events(object):
+
+    dtype = np.dtype([('star','<i8'),('t','<f8'),('event','U6'),('direction','<i1')])
+
+    def __init__(self,stopFree=None,radii=None):
+        self.stopFree = stopFree
+        self.radii = radii
+
+    def start(self,N,nT,k):
+        self.vc = np.sqrt(k[5])
+        if self.radii is None:
+            radii = resonanceRadii(k)
+            self.radii = dict((name, radii[name]) for name in ("ILR","CR","OLR"))
+        self.names = sorted(self.radii,key=self.radii.get)
+        self.R = np.array([self.radii[name] for name in self.names])
+        self.lastLam = np.zeros(N)            # |Lam_nc2| - 1 at the last step seen
+        self.lastRg = np.zeros(N)
+        self.lastT = np.zeros(N)
+        self.escaped = np.full(N,np.nan)      # Time of the last escape (nan if trapped or never trapped)
+        self.found = []
+
+    # Adds the crossings of zero of f (n,nb+1) to the table as events named
+    # names[0] if f falls through zero (direction -1), names[1] if it rises (+1)
+    # Returns the new events (in order of time for each star)
+    def crossings(self,stars,t,f,names):
+        below = f < 0.
+        star, j = np.nonzero(below[:,:-1] != below[:,1:])
+        f0 = f[star,j]
+        f1 = f[star,j+1]
+        event = np.zeros(len(star),dtype=self.dtype)
+        event['star'] = stars[star]
+        event['t'] = t[star,j] + (t[star,j+1] - t[star,j])*f0/(f0 - f1)
+        event['direction'] = np.where(below[star,j+1],-1,1)
+        event['event'] = np.where(below[star,j+1],names[0],names[1])
+        self.found.append(event)
+        return event
+
+    def update(self,i0,qp,phys,stars):
+        t = qp[:,:,4]
+        lam = np.absolute(phys[0]) - 1.
+        Rg = phys[3]/self.vc
+        if i0 > 0:
+            t = np.concatenate((self.lastT[stars,np.newaxis],t),axis=1)
+            lam = np.concatenate((self.lastLam[stars,np.newaxis],lam),axis=1)
+            Rg = np.concatenate((self.lastRg[stars,np.newaxis],Rg),axis=1)
+        event = self.crossings(stars,t,lam,("trap","escape"))
+        # The last trap/escape of each star decides whether it is free since an escape
+        last = np.append(event['star'][1:] != event['star'][:-1],True) if len(event) > 0 else []
+        event = event[last]
+        self.escaped[event['star']] = np.where(event['direction'] > 0,event['t'],np.nan)
+        for name, R in zip(self.names,self.R):
+            self.crossings(stars,t,Rg - R,(name,name))
+        self.lastT[stars] = t[:,-1]
+        self.lastLam[stars] = lam[:,-1]
+        self.lastRg[stars] = Rg[:,-1]
+
+    # Returns which of the stars can stop (see stopFree)
+    def isDone(self,stars):
+        if self.stopFree is None:
+            return np.zeros(len(stars),dtype=bool)
+        escaped = self.escaped[stars]
+        return ~np.isnan(escaped) & (self.lastT[stars] - np.nan_to_num(escaped) >= self.stopFree)
+
+    def finish(self):
+        events = np.concatenate(self.found) if len(self.found) > 0 else np.zeros(0,dtype=self.dtype)
+        return {"events": np.sort(events,order=['star','t'])}
+
+# Returns the rows of an event table (Events) of one star
+def starEvents(events,star):
+    return events[events['star'] == star]
+
+# Returns the reducers that make everything a table1 row and the table2 sums need
+def tableReducers():
+    return [LamSpecial(), LzAt(), TrappedSums()]
+
+# Returns the partial sums of Table_Helper.partialTable from a summary made with
+# TrappedSums, so they can be merged (Table_Helper.mergeSums) and finished
+# (Table_Helper.finishTable) like the sums of stored orbits
+def tableSums(summary):
+    return [summary["t"], summary["trapped"], summary["dLz2Trapped"], summary["dLz2Always"]]
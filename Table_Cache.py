@@ -0,0 +1,90 @@
+'''
+Description:
+    This file keeps a binary cache of the text tables made by MakeTable
+(table1_*.txt and table2_*.txt), so tableReader does not have to parse them with
+np.loadtxt every time it is imported or reloaded.
+    The first time a table is read, its numeric columns are saved as one float64
+.npy array and its text columns (the qp paths of table1) as a separate .npy
+string table, in the folder <table>.cache next to the text file. Later reads
+memory map those files, which takes milliseconds. The size and modification time
+of the text file are saved with the cache, and the cache is rebuilt whenever
+they no longer match (e.g. after MakeTable writes a new table).
+
+Usage:
+    data, paths = loadTable(filename)   # (rows, numeric columns) floats, (rows,) paths or None
+'''
+import os
+import json
+import numpy as np
+
+cacheVersion = 1
+
+# Returns the filenames of the cache of a table: (data, strings, stamp)
+def cacheNames(filename):
+    folder = filename + ".cache"
+    return (os.path.join(folder,"data.npy"), os.path.join(folder,"strings.npy"),
+            os.path.join(folder,"source.json"))
+
+# Returns what the cache of a table is checked against: the version of the
+# cache format and the size and modification time of the text file
+def sourceStamp(filename):
+    info = os.stat(filename)
+    return {"version": cacheVersion, "size": info.st_size, "mtime": info.st_mtime}
+
+# Reads a text table, returns the float array of its numeric columns and the
+# string array of its text columns (None if it has none)
+# A column is text if its first entry is not a number
+def readText(filename):
+    text = np.loadtxt(filename,delimiter=" ",dtype=str,ndmin=2)
+    numeric = []
+    for j in range(text.shape[1]):
+        try:
+            float(text[0,j])
+            numeric.append(j)
+        except ValueError:
+            pass
+    strings = [j for j in range(text.shape[1]) if j not in numeric]
+    data = text[:,numeric].astype(float)
+    if len(strings) == 0:
+        return data, None
+    return data, text[:,strings[0]] if len(strings) == 1 else text[:,strings]
+
+# Converts a text table to its cache (the stamp is written last, so an
+# interrupted conversion is never taken for a valid cache)
+def buildCache(filename):
+    dataname, stringname, stampname = cacheNames(filename)
+    stamp = sourceStamp(filename)
+    data, strings = readText(filename)
+    if not os.path.isdir(filename + ".cache"):
+        os.makedirs(filename + ".cache")
+    if os.path.isfile(stampname):
+        os.remove(stampname)
+    np.save(dataname,data)
+    if strings is None:
+        if os.path.isfile(stringname):
+            os.remove(stringname)
+    else:
+        np.save(stringname,strings)
+    with open(stampname,'w') as f:
+        json.dump(stamp,f)
+    return data, strings
+
+# Returns True if the cache of a table exists and matches the text file
+def isCurrent(filename):
+    dataname, stringname, stampname = cacheNames(filename)
+    if not (os.path.isfile(stampname) and os.path.isfile(dataname)):
+        return False
+    with open(stampname) as f:
+        return json.load(f) == sourceStamp(filename)
+
+# Returns the numeric columns (floats) and text columns (strings, or None) of a
+# text table, memory mapped from its cache, which is built or rebuilt first if
+# it is missing or out of date
+# For table1 these are the 15 columns after the path, and the paths
+def loadTable(filename,rebuild=False):
+    if rebuild or not isCurrent(filename):
+        buildCache(filename)
+    dataname, stringname, stampname = cacheNames(filename)
+    data = np.load(dataname,mmap_mode='r')
+    strings = np.load(stringname,mmap_mode='r') if os.path.isfile(stringname) else None
+    return data, strings
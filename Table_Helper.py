@@ -2,16 +2,11 @@ import numpy as np
 import os
 import Orbit_Code 
 reload(Orbit_Code)
+import Ensemble_Store
+import Orbit_Manifest
+import Orbit_Metrics
+from Orbit_Manifest import parseFilename
 import tarfile
-
-#from string of filename, return array of initial conditions
-def parseFilename(filename):
-    parts = filename.split("=")
-    args = np.empty(len(parts)-1)
-    for l in range(1, len(parts)):
-        num = float(parts[l].split(")")[0])
-        args[l-1] = num
-    return args
       
 #from list of filenames, return matrix of initial conditions    
 def parseList(files):
@@ -20,38 +15,110 @@ def parseList(files):
         table[l] = parseFilename(files[l])
     return table
  
-def genTable(filepath):
-    table = []
-    qp_len = 2001.       #the length of qp, can't figure out how to code that in
-    table2 = np.zeros(qp_len)  
-    table3 = np.zeros(qp_len)
-    table4 = np.zeros(qp_len)  
-    for dirpath, dirnames, files in os.walk(filepath):
+#from path (or open file) of an LF_L4 text file, return its qp in the Orbit_Calculator layout
+def loadQP(fullpath):
+    data = np.loadtxt(fullpath) #need to change around order of data columns for real thing
+    return convertQP(data)
+
+#from the columns of an LF_L4 text file, return the qp in the Orbit_Calculator layout
+def convertQP(data):
+    data = data.astype(float)   #change to float
+    t = data[:,0]   #next two lines switch order of t,x,y,vx,vy to x,y,vx,vy,t
+    data = np.c_[data[:,1:5] ,t] 
+    data[:,2] = data[:,2]*9.777922216731282e+8  #kpc/yr to km/s
+    data[:,3] = data[:,3]*9.777922216731282e+8
+    return data
+
+#walk through filepath and yield (path, initial conditions) for every qp text file
+#(the walk and the filename parsing are timed as "table.discover", see Orbit_Metrics)
+def iterPaths(filepath):
+    for dirpath, dirnames, files in Orbit_Metrics.timedIter("table.discover",os.walk(filepath)):
         for f in files:
-            fullpath = os.path.join(dirpath, f) #get full path of subject file
-            if f != ".DS_Store" and not f.endswith("tar.gz"):
-                a = parseFilename(f) #Turn filename into numpy array of initial conditions
-                orbit = Orbit_Code.Orbit_Calculator(a[0],a[1],a[2],a[3],a[4],a[5],a[6],a[7],a[8])
-                fullpath = os.path.join(dirpath, f) #get full path of subject file
-                data = np.loadtxt(fullpath) #need to change around order of data columns for real thing
-                data = data.astype(float)   #change to float
-                t = data[:,0]   #next two lines switch order of t,x,y,vx,vy to x,y,vx,vy,t
-                data = np.c_[data[:,1:5] ,t] 
-                data[:,2] = data[:,2]*9.777922216731282e+8
-                data[:,3] = data[:,3]*9.777922216731282e+8
-                orbit.setqp(data)
-                lam = orbit.findLam()[0]
-                if np.absolute(lam[0]) < 1.:
-                       table2 += (np.absolute(lam) < 1.)
-                       angmom = orbit.findLam()[3]
-                       angmom_del = angmom - angmom[0]
-                       angmom_del = angmom_del**2
-                       table3 += angmom_del
-                       if ((np.absolute(lam) < 1).sum() == len(lam)):
-                           table4 +=  angmom_del                    
-                lamsp = orbit.Lam_special()
-                Lz = orbit.findLz()
-                table.append([dirpath+'/'+f,a[0],a[1],a[2],a[3],a[4],a[5],a[6],a[7],a[8],lamsp,Lz[0],Lz[1],Lz[2],Lz[3],Lz[4]]) 
+            if f != ".DS_Store" and not f.endswith("tar.gz") and not f.endswith(".qps") and f not in (Orbit_Manifest.manifestName,Orbit_Manifest.stampName):
+                with Orbit_Metrics.timer("table.discover"):
+                    a = parseFilename(f)
+                yield dirpath+'/'+f, a #full path of subject file and its initial conditions
+
+#walk through filepath and yield (path, initial conditions, qp) for every qp text file
+def iterFiles(filepath):
+    for fullpath, a in iterPaths(filepath):
+        with Orbit_Metrics.timer("table.parse"):
+            data = loadQP(fullpath)
+        yield fullpath, a, data
+
+#yield (store[i], initial conditions, qp) for every orbit in an ensemble store
+def iterStore(storename):
+    store = Ensemble_Store.EnsembleStore(storename)
+    for i in range(len(store)):
+        with Orbit_Metrics.timer("table.parse"):
+            a = np.array([store.meta[i][name] for name in Ensemble_Store.metaNames])
+            data = np.array(store.getOrbit(i))
+        yield "%s[%i]" % (storename,i), a, data
+
+#yield (path, initial conditions, qp) for every orbit of a manifest (see Orbit_Manifest)
+def iterManifest(manifest):
+    stores = {}
+    for row in manifest:
+        path = str(row['path'])
+        with Orbit_Metrics.timer("table.parse"):
+            if row['index'] >= 0:
+                if path not in stores:
+                    stores[path] = Ensemble_Store.EnsembleStore(path)
+                path = "%s[%i]" % (path,row['index'])
+                data = np.array(stores[str(row['path'])].getOrbit(int(row['index'])))
+            else:
+                data = Orbit_Manifest.loadOrbit(row)
+        yield path, Orbit_Manifest.getParams(row), data
+
+#from (path, initial conditions, qp) of every orbit, make the table1 rows and the
+#partial sums of table2 (see mergeSums), without finishing the sums
+#this is the map step of the tables, so any subset of the orbits can go to a worker
+#each phase is timed by Orbit_Metrics when it is enabled
+def partialTable(orbits):
+    table = []
+    sums = None
+    for path, a, data in orbits:
+        if sums is None:
+            #t, trapped counts, sum of dLz^2, sum of dLz^2 of always trapped orbits
+            sums = [data[:,4].copy(), np.zeros(len(data)), np.zeros(len(data)), np.zeros(len(data))]
+        Orbit_Metrics.count("orbits")
+        with Orbit_Metrics.timer("table.setqp"):
+            orbit = Orbit_Code.Orbit_Calculator(a[0],a[1],a[2],a[3],a[4],a[5],a[6],a[7],a[8])
+            orbit.setqp(data)
+        with Orbit_Metrics.timer("table.findLam"):
+            phys = orbit.findLam() #calculated once, Lam_special and findLz reuse it
+        lam = phys[0]
+        if np.absolute(lam[0]) < 1.:
+               sums[1] += (np.absolute(lam) < 1.)
+               angmom = phys[3]
+               angmom_del = angmom - angmom[0]
+               angmom_del = angmom_del**2
+               sums[2] += angmom_del
+               if ((np.absolute(lam) < 1).sum() == len(lam)):
+                   sums[3] +=  angmom_del                    
+        with Orbit_Metrics.timer("table.Lam_special"):
+            lamsp = orbit.Lam_special()
+        with Orbit_Metrics.timer("table.findLz"):
+            Lz = orbit.findLz()
+        table.append([path,a[0],a[1],a[2],a[3],a[4],a[5],a[6],a[7],a[8],lamsp,Lz[0],Lz[1],Lz[2],Lz[3],Lz[4]]) 
+    return table, sums
+
+#adds two sets of partial sums from partialTable (None if a part had no orbits)
+#this is the reduce step of the tables
+def mergeSums(sums1,sums2):
+    if sums1 is None:
+        return sums2
+    if sums2 is None:
+        return sums1
+    return [sums1[0], sums1[1] + sums2[1], sums1[2] + sums2[2], sums1[3] + sums2[3]]
+
+#from the table1 rows and the merged sums, make the two tables
+#(sums is None when there were no orbits, which has no tables)
+def finishTable(table,sums):
+    if sums is None:
+        raise ValueError("No orbits to make the tables from (no qp files, tar.gz members or manifest rows found)")
+    t, table2, table3, table4 = sums
+    qp_len = float(len(t))  #the length of qp
     table3 = np.sqrt(table3/qp_len)
     table4 = np.sqrt(table4/qp_len)
     table2 = table2/(table2[0])
@@ -60,6 +127,152 @@ def genTable(filepath):
     table_final = np.vstack((t,table_final))
     return np.array(table), table_final.transpose()
 
+#from (path, initial conditions, qp) of every orbit, make the two tables
+#(reports the metrics of the whole table, see Orbit_Metrics)
+def buildTable(orbits):
+    table, sums = partialTable(orbits)
+    with Orbit_Metrics.timer("table.finish"):
+        tables = finishTable(table,sums)
+    Orbit_Metrics.report("table")
+    return tables
+
+#yield (path, initial conditions, qp) for every qp text file in a tar.gz from OSG,
+#reading the archive as a stream and parsing each member in memory, so nothing
+#is extracted to disk (path is the archive path followed by the member name)
+def iterTar(tarname):
+    tar = tarfile.open(tarname, "r|gz")
+    try:
+        for member in tar:
+            f = os.path.basename(member.name)
+            if member.isfile() and f.startswith("qp_"):
+                with Orbit_Metrics.timer("table.parse"):
+                    data = loadQP(tar.extractfile(member))
+                yield tarname+'/'+member.name, parseFilename(f), data
+    finally:
+        tar.close()
+
+#return the full paths of every tar.gz under filepath
+def findTars(filepath):
+    tars = []
+    for dirpath, dirnames, files in os.walk(filepath):
+        for f in sorted(files):
+            if f.endswith("tar.gz"):
+                tars.append(dirpath+'/'+f)
+    return tars
+
+#yield (path, initial conditions, qp) for every qp text file in every tar.gz under filepath
+def iterTars(filepath):
+    for tarname in findTars(filepath):
+        for orbit in iterTar(tarname):
+            yield orbit
+
+#make the tables from the qp text files under filepath
+def genTable(filepath):
+    return buildTable(iterFiles(filepath))
+
+#make the tables from the orbits of a manifest (e.g. a queryManifest selection)
+def genTableManifest(manifest):
+    return buildTable(iterManifest(manifest))
+
+#make the tables straight from the tar.gz files under filepath (no unTar needed)
+def genTableTar(filepath):
+    return buildTable(iterTars(filepath))
+
+#make the tables from an ensemble store
+def genTableStore(storename):
+    return buildTable(iterStore(storename))
+
+#worker of genTableParallel: the partial tables of one chunk of a manifest
+def partialManifest(manifest):
+    partial = partialTable(iterManifest(manifest))
+    Orbit_Metrics.report("table.chunk")
+    return partial
+
+#worker of genTableTarParallel: the partial tables of one tar.gz
+def partialTar(tarname):
+    partial = partialTable(iterTar(tarname))
+    Orbit_Metrics.report("table.chunk")
+    return partial
+
+#runs partial(task) for every task on a pool of worker processes and merges the
+#table1 rows and partial sums in the order of the tasks, so the tables match the
+#serial ones (the sums only differ by rounding, from the order they are added in)
+#workers = number of processes (None uses every core)
+def mapTables(partial,tasks,workers=None):
+    import multiprocessing
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(workers, initializer=Orbit_Metrics.initWorker, initargs=(Orbit_Metrics.getState(),))
+    try:
+        table = []
+        sums = None
+        for rows, partSums in pool.imap(partial, tasks):
+            table.extend(rows)
+            sums = mergeSums(sums,partSums)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    with Orbit_Metrics.timer("table.finish"):
+        tables = finishTable(table,sums)
+    Orbit_Metrics.report("table")
+    return tables
+
+#make the tables from the orbits of a manifest on a pool of worker processes,
+#giving the same tables as genTableManifest
+#workers = number of processes (None uses every core), chunk = orbits per task
+def genTableParallel(manifest,workers=None,chunk=None):
+    import multiprocessing
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if chunk is None:
+        chunk = max(1,int(np.ceil(len(manifest)/(4.*workers)))) #a few chunks per worker to even out the load
+    chunks = [manifest[i:i+chunk] for i in range(0,len(manifest),chunk)]
+    return mapTables(partialManifest,chunks,workers)
+
+#make the tables straight from the tar.gz files under filepath, decompressing
+#and parsing one archive per worker process at a time (same tables as genTableTar)
+def genTableTarParallel(filepath,workers=None):
+    return mapTables(partialTar,findTars(filepath),workers)
+
+#pack every qp text file under filepath into a single ensemble store
+def packStore(filepath,storename):
+    files = [(path, a) for path, a in iterPaths(filepath)]
+    if len(files) == 0:
+        raise ValueError("No qp files under %s to pack" % filepath)
+    nTime = len(loadQP(files[0][0]))
+    store = Ensemble_Store.createStore(storename,len(files),nTime)
+    store.writeMeta(0,np.array([a for path, a in files]))
+    for i in range(len(files)):
+        store.writeChunk(i,loadQP(files[i][0])[np.newaxis])
+    return store
+
+#pack every qp text file in the tar.gz files under filepath into a single
+#ensemble store, streaming the archives (once) instead of extracting them
+#the number of orbits is only known at the end, so the store is made for an
+#estimate of it (a byte of the archives per number of a qp, more orbits than the
+#text of real qp's compresses to), doubled if it runs out and cut to the orbits
+#written at the end (see Ensemble_Store.resizeStore)
+def packStoreTar(filepath,storename):
+    tars = findTars(filepath)
+    store = None
+    nOrbit = 0
+    for path, a, data in (orbit for tarname in tars for orbit in iterTar(tarname)):
+        if store is None:
+            bound = sum([os.path.getsize(tarname) for tarname in tars])//data.size + 1
+            store = Ensemble_Store.createStore(storename,bound,len(data))
+        if nOrbit == len(store):
+            store = Ensemble_Store.resizeStore(storename,2*nOrbit)
+        store.writeMeta(nOrbit,a[np.newaxis])
+        store.writeChunk(nOrbit,data[np.newaxis])
+        nOrbit = nOrbit + 1
+    if store is None:
+        raise ValueError("No qp files in the tar.gz files under %s to pack" % filepath)
+    del store
+    return Ensemble_Store.resizeStore(storename,nOrbit)
+
 def unTar(filepath):
     for dirpath, dirnames, files in os.walk(filepath):
         for f in files:
@@ -0,0 +1,232 @@
+'''
+Description:
+    This file measures the throughput of the integrators and of the analysis
+pipeline on synthetic but realistic workloads (m=4, CR=8, epsilon=0.3 at the
+pitch angles in thetas, initial conditions drawn with MC_fNew), so that changes
+in speed can be compared between versions and computers:
+        makeOrbit            steps/s of one orbit, for each backend and scheme
+        makeEnsemble         orbits/s (one core) of a batch of orbits
+        LF_L4                steps/s of the C++ integrator (if it runs here)
+        MC_fNew              initial conditions/s of sample_initial_conditions
+        genTable             orbits/s of Table_Helper.genTable over LF_L4 files
+        tableReader          seconds to load a table with and without its cache
+    Every run is timed a few times and the fastest one is kept (the first run of
+the jit backend, which may include compiling, is not counted). The results are
+saved as JSON, along with the computer, python and numpy they were measured on.
+
+Usage:
+    python Throughput_Benchmark.py                 # runs and saves resultsFile
+    python Throughput_Benchmark.py baseline.json   # also compares with a saved run
+    A result is reported as a regression when its rate is more than tolerance
+slower than in the baseline (durations, like the table loads, are compared as
+rates too: 1/seconds).
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+from timeit import default_timer
+
+# Benchmark parameters (You can toggle these)
+thetas = [15,30]            # Pitch angles (degrees) of the integrator runs
+spiral = (4,8,0.3)          # m, CR (kpc), epsilon
+orbitTime = 0.2             # Duration of the makeOrbit runs (gigayears), 2000 steps
+ensembleSize = 200          # Orbits in the makeEnsemble runs
+ensembleTime = 0.1          # Duration of the makeEnsemble runs (gigayears)
+sampleSize = 100000         # Initial conditions drawn with MC_fNew
+tableSize = 100             # LF_L4 files read by genTable (2000 steps each)
+repeat = 3                  # Runs of each measurement (the fastest is kept)
+tolerance = 0.2             # Slowdown reported as a regression (0.2 = 20%)
+backends = ["numpy","jit"]  # "jit" is skipped if numba is not installed
+schemes = [("leapfrog",None),("yoshida4",1e6)]   # (scheme, stepTime in years) of makeOrbit, storing every step
+lfl4 = os.path.join(os.path.dirname(os.path.abspath(__file__)),"LF_L4")   # C++ integrator (None to skip)
+table = os.path.join(os.path.dirname(os.path.abspath(__file__)),"table1_15.txt")   # Table loaded by tableReader
+resultsFile = "./Throughput_Benchmark.json"
+
+# Runs func repeat times, returns the shortest duration in seconds (the first run
+# isn't counted if warmup is True)
+def measure(func,warmup=False):
+    if warmup:
+        func()
+    durations = []
+    for i in range(repeat):
+        start = default_timer()
+        func()
+        durations.append(default_timer() - start)
+    return min(durations)
+
+# Returns a result: a rate of work per second, and the seconds and size it came from
+def result(size,unit,seconds):
+    return {"rate": size/seconds, "unit": unit, "seconds": seconds, "size": size}
+
+# Returns the backends that can run here
+def findBackends():
+    available = []
+    for backend in backends:
+        try:
+            import Orbit_Code
+            Orbit_Code.findBackend(backend)
+            available.append(backend)
+        except ImportError:
+            print("Skipping backend %s (not installed)" % backend)
+    return available
+
+# Returns n initial conditions drawn with MC_fNew (the same every run)
+def findInitials(n):
+    import MC_fNew
+    return MC_fNew.sample_initial_conditions(n,seed=1)
+
+# Steps/s of makeOrbit for each backend, scheme and theta
+def benchOrbit(results):
+    import Orbit_Code
+    m, CR, epsilon = spiral
+    x0, y0, vx0, vy0 = findInitials(1)[0]
+    for backend in findBackends():
+        for scheme, stepTime in schemes:
+            for theta in thetas:
+                orbit = Orbit_Code.Orbit_Calculator(m,theta,orbitTime,CR,epsilon,x0,y0,vx0,vy0)
+                run = lambda: orbit.makeOrbit(backend=backend,scheme=scheme,stepTime=stepTime,outputTime=stepTime)
+                seconds = measure(run,warmup=(backend == "jit"))
+                name = "makeOrbit_%s_%s_theta%i" % (backend,scheme,theta)
+                results[name] = result(float(len(orbit.getqp())),"steps/s",seconds)
+
+# Orbits/s of makeEnsemble (one core) for each backend and theta
+def benchEnsemble(results):
+    import Orbit_Code
+    m, CR, epsilon = spiral
+    qp0s = findInitials(ensembleSize)
+    for backend in findBackends():
+        for theta in thetas:
+            orbit = Orbit_Code.Orbit_Calculator(m,theta,ensembleTime,CR,epsilon,*qp0s[0])
+            run = lambda: orbit.makeEnsemble(qp0s,backend=backend)
+            seconds = measure(run,warmup=(backend == "jit"))
+            results["makeEnsemble_%s_theta%i" % (backend,theta)] = result(float(ensembleSize),"orbits/s",seconds)
+
+# Steps/s of LF_L4, run once in a scratch folder (it always takes 2e7 steps of
+# 100 yr and writes its qp into ./qp_file)
+def benchLF_L4(results):
+    if lfl4 is None or not os.path.isfile(lfl4):
+        print("Skipping LF_L4 (not found)")
+        return
+    folder = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(folder,"qp_file"))
+        with open(os.path.join(folder,"temp_initials.txt"),'w') as f:
+            f.write("%f %f %f %f\n" % tuple(findInitials(1)[0]))
+        start = default_timer()
+        try:
+            subprocess.check_call([lfl4],cwd=folder,stdout=open(os.devnull,'w'))
+        except (OSError, subprocess.CalledProcessError) as error:
+            print("Skipping LF_L4 (%s)" % str(error))
+            return
+        results["LF_L4"] = result(2e7,"steps/s",default_timer() - start)
+    finally:
+        shutil.rmtree(folder)
+
+# Initial conditions/s of MC_fNew.sample_initial_conditions, with both methods
+def benchSampler(results):
+    import MC_fNew
+    for method in ["box","envelope"]:
+        run = lambda: MC_fNew.sample_initial_conditions(sampleSize,seed=2,method=method)
+        seconds = measure(run,warmup=(method == "envelope"))    # The envelope is tabulated once
+        results["MC_fNew_%s" % method] = result(float(sampleSize),"samples/s",seconds)
+
+# Writes the qp of an orbit as an LF_L4 text file (t, x, y, vx, vy in kpc/yr, R, phi)
+def writeLF_L4(folder,params,qp):
+    name = "qp_(m=%g)_(th=%g)_(t=%g)_(CR=%g)_(eps=%g)_(x0=%g)_(y0=%g)_(vx0=%g)_(vy0=%g).txt" % tuple(params)
+    data = np.c_[qp[:,4],qp[:,0:2],qp[:,2:4]/9.777922216731282e+8,
+                 np.sqrt(qp[:,0]**2 + qp[:,1]**2),np.arctan2(qp[:,1],qp[:,0])]
+    np.savetxt(os.path.join(folder,name),data,fmt="%.10g")
+
+# Orbits/s of Table_Helper.genTable over tableSize LF_L4 files of one theta
+def benchTable(results):
+    import Orbit_Code
+    import Table_Helper
+    m, CR, epsilon = spiral
+    qp0s = findInitials(tableSize)
+    orbit = Orbit_Code.Orbit_Calculator(m,thetas[0],orbitTime,CR,epsilon,*qp0s[0])
+    qps = orbit.makeEnsemble(qp0s)
+    folder = tempfile.mkdtemp()
+    try:
+        for i in range(tableSize):
+            writeLF_L4(folder,(m,thetas[0],orbitTime,CR,epsilon) + tuple(qp0s[i]),qps[i])
+        seconds = measure(lambda: Table_Helper.genTable(folder))
+        results["genTable"] = result(float(tableSize),"orbits/s",seconds)
+    finally:
+        shutil.rmtree(folder)
+
+# Loads/s of a table the way tableReader loads it (Table_Cache.loadTable), the
+# first time (parsing the text and building the cache) and from the cache
+def benchTableReader(results):
+    import Table_Cache
+    if not os.path.isfile(table):
+        print("Skipping tableReader (%s not found)" % table)
+        return
+    folder = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(folder,os.path.basename(table))
+        shutil.copy(table,filename)
+        seconds = measure(lambda: Table_Cache.loadTable(filename,rebuild=True))
+        results["tableReader_text"] = result(1.,"loads/s",seconds)
+        seconds = measure(lambda: np.asarray(Table_Cache.loadTable(filename)[0]).sum())
+        results["tableReader_cache"] = result(1.,"loads/s",seconds)
+    finally:
+        shutil.rmtree(folder)
+
+# Runs every benchmark, returns the record that is saved as JSON
+def runBenchmarks():
+    results = {}
+    for bench in [benchOrbit,benchEnsemble,benchLF_L4,benchSampler,benchTable,benchTableReader]:
+        bench(results)
+    return {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "machine": platform.platform(), "processor": platform.processor(),
+            "cores": multiprocessing.cpu_count(), "python": platform.python_version(),
+            "numpy": np.__version__, "results": results}
+
+# Saves a record as JSON
+def saveResults(record,filename=resultsFile):
+    with open(filename,'w') as f:
+        json.dump(record,f,indent=1,sort_keys=True)
+
+# Returns a record saved by saveResults
+def loadResults(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+# Prints the rates of a record next to those of a baseline record
+# Returns the names of the results that are more than tolerance slower
+def compareResults(record,baseline,tolerance=tolerance):
+    regressions = []
+    print("%-34s %14s %14s %8s" % ("benchmark","baseline","now","ratio"))
+    for name in sorted(set(record["results"]) | set(baseline["results"])):
+        if name not in record["results"] or name not in baseline["results"]:
+            print("%-34s %s" % (name,"only in the baseline" if name in baseline["results"] else "new"))
+            continue
+        now = record["results"][name]["rate"]
+        before = baseline["results"][name]["rate"]
+        ratio = now/before
+        flag = ""
+        if ratio < 1. - tolerance:
+            flag = "  SLOWER"
+            regressions.append(name)
+        elif ratio > 1. + tolerance:
+            flag = "  faster"
+        print("%-34s %14.4g %14.4g %8.2f%s" % (name,before,now,ratio,flag))
+    if baseline.get("machine") != record.get("machine"):
+        print("Note: the baseline was measured on %s" % baseline.get("machine"))
+    return regressions
+
+if __name__ == "__main__":
+    record = runBenchmarks()
+    for name in sorted(record["results"]):
+        print("%-34s %14.4g %s" % (name,record["results"][name]["rate"],record["results"][name]["unit"]))
+    saveResults(record)
+    if len(sys.argv) > 1:
+        regressions = compareResults(record,loadResults(sys.argv[1]))
+        sys.exit(1 if len(regressions) > 0 else 0)
@@ -1,9 +1,6 @@
 import os
 import numpy as np
-import matplotlib.pyplot as plt
-import Orbit_Code
-from matplotlib.colors import LogNorm
-reload(Orbit_Code)
+import Table_Cache
 
 filepath = "C:/Users/Noah/Documents/GitHub/Trapped_Orbital_Integrator/" 
 
@@ -11,13 +8,79 @@ filepath = "C:/Users/Noah/Documents/GitHub/Trapped_Orbital_Integrator/"
 files1 = [i for i in os.listdir(filepath) if os.path.isfile(os.path.join(filepath,i)) and 'table1' in i]
 files2 = [i for i in os.listdir(filepath) if os.path.isfile(os.path.join(filepath,i)) and 'table2' in i]
 
-#Import all data
-tableInfo1 = np.array([np.loadtxt(filepath+files1[i],delimiter=" ",dtype= str)[:,1:16].astype(float) for i in range(len(files1))]) 
-tableInfo2 = np.array([np.loadtxt(filepath+files2[i],delimiter=" ",dtype= str).astype(float) for i in range(len(files2))]) 
+#Tables are only read when a function first needs them (from their binary caches,
+#see Table_Cache) and are then kept in tableCache, keyed by filename
+#matplotlib is imported by the plotting functions themselves, so importing this
+#file and calling Lz_rms or trap_frac doesn't pay for it
+tableCache = {}
+
+#Returns the numeric columns and paths (None for table2) of one table file
+def getTable(filename):
+    if filename not in tableCache:
+        tableCache[filename] = Table_Cache.loadTable(filepath+filename)
+    return tableCache[filename]
+
+#Returns the table1 data (the 15 columns after the path) and table2 of one theta, e.g. getTheta("15")
+def getTheta(theta):
+    return getTable("table1_%s.txt" % theta)[0][:,0:15], getTable("table2_%s.txt" % theta)[0]
+
+#Returns the qp paths of table1 of one theta
+def getPaths(theta):
+    return getTable("table1_%s.txt" % theta)[1]
+
+#Returns tableInfo1 and tableInfo2, the data of every theta (in the order of files1 and files2)
+def getTables():
+    tableInfo1 = np.array([getTable(files1[i])[0][:,0:15] for i in range(len(files1))])
+    tableInfo2 = np.array([getTable(files2[i])[0] for i in range(len(files2))])
+    return tableInfo1, tableInfo2
+
+#Returns tablePaths1, the qp paths of table1 of every theta (in the order of files1)
+def getTablePaths():
+    return [getTable(files1[i])[1] for i in range(len(files1))]
+
+#Stands in for a table that used to be read on import (tableInfo1, tableInfo2,
+#tablePaths1): it is only read the first time it is indexed, iterated over or
+#used as an array, and then behaves like it
+class LazyTable(object):
+
+    def __init__(self,load):
+        self._load = load
+        self._data = None
+
+    def data(self):
+        if self._data is None:
+            self._data = self._load()
+        return self._data
+
+    def __getitem__(self,i):
+        return self.data()[i]
+
+    def __len__(self):
+        return len(self.data())
+
+    def __iter__(self):
+        return iter(self.data())
+
+    def __array__(self,*args):
+        return np.asarray(self.data(),*args)
+
+    def __getattr__(self,name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.data(),name)
+
+    def __repr__(self):
+        return repr(self.data())
+
+#The tables of every theta under their old names, still read only when first used
+tableInfo1 = LazyTable(lambda: getTables()[0])
+tableInfo2 = LazyTable(lambda: getTables()[1])
+tablePaths1 = LazyTable(getTablePaths)
 
 ###This function plots fraction of trapped stars over time for each theta
 def trap_plot():
-    
+    import matplotlib.pyplot as plt
+    tableInfo1, tableInfo2 = getTables()
     t = tableInfo2[0][:,0] 
     trap_frac = np.array([tableInfo2[i][:,1] for i in range(len(tableInfo2))])
     lam_spec = np.array([tableInfo1[i][:,9] for i in range(len(tableInfo1))])
@@ -36,7 +99,8 @@ def trap_plot():
     
 ###This function plots rms of change in angmom over time for each theta
 def angmom_plot():
-      
+    import matplotlib.pyplot as plt
+    tableInfo1, tableInfo2 = getTables()
     t = tableInfo2[0][:,0] 
     Lz_rms = np.array([tableInfo2[i][:,2] for i in range(len(tableInfo2))])
     Lz_rms_spec = np.array([tableInfo2[i][:,3] for i in range(len(tableInfo2))])
@@ -57,12 +121,14 @@ def angmom_plot():
     
 ###This function returns rms of angmom for each theta at different time intervals
 def Lz_rms():
+    tableInfo1, tableInfo2 = getTables()
     num = [11,12,13,14]
     rms = np.array([np.sqrt((tableInfo1[i][:,[10,num[j]]]**2).mean(axis=1)) for i in range(len(tableInfo1)) for j in range(len(num))])
     return np.split(rms,4)
 
 ###This function returns the fraction of initially trapped orbits that end trapped for each theta
 def trap_frac():
+    tableInfo1, tableInfo2 = getTables()
     lam_spec = np.array([tableInfo1[i][:,9] for i in range(len(tableInfo1))])
     start_trapped = np.array([float((lam_spec[i] == 0).sum()+(lam_spec[i] == 1).sum()+(lam_spec[i] == 2).sum()) for i in range(len(tableInfo1))])
     end_trapped = np.array([float((lam_spec[i] == 0).sum()+(lam_spec[i] == 1).sum()) for i in range(len(tableInfo1))])
@@ -71,6 +137,9 @@ def trap_frac():
     return trap_frac
 
 def plot_Lz():
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm
+    tableInfo1, tableInfo2 = getTables()
     #Extract Lz data and calculate delta Lz
     Lz = np.array([tableInfo1[i][:,10:15] for i in range(len(tableInfo1))])
     del_Lz = np.array([np.subtract(Lz[i][:,j+1],Lz[i][:,0]) for i in range(len(tableInfo1)) for j in range (len(Lz[i].transpose())-1)])